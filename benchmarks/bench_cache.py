@@ -0,0 +1,31 @@
+"""
+Benchmark the size and load time of the JSON and binary key caches of a 2 of 3 multisig account.
+
+Run from the repository root:
+
+    PYTHONPATH=. python benchmarks/bench_cache.py [num_leaves_per_subchain]
+"""
+from __future__ import print_function
+import sys
+import time
+
+from multisigcore.hierarchy import MultisigAccount
+from multisigcore.testing import make_multisig_account, wallet_key, recover_key, oracle_key
+
+__author__ = 'devrandom'
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    account = make_multisig_account()
+    account.derive_range(0, 0, count)
+    account.derive_range(1, 0, count)
+    for name, blob in (("json", account.cache), ("binary", account.binary_cache)):
+        start = time.time()
+        MultisigAccount(keys=[wallet_key, recover_key, oracle_key], cache=blob)
+        elapsed = time.time() - start
+        print("%-8s %6d leaves %10d bytes %8.2fs load" % (name, 2 * count, len(blob), elapsed))
+
+
+if __name__ == '__main__':
+    main()
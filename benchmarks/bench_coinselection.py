@@ -0,0 +1,38 @@
+"""
+Benchmark coin selection strategies over synthetic sets of coins.
+
+Run from the repository root:
+
+    PYTHONPATH=. python benchmarks/bench_coinselection.py [num_coins ...]
+"""
+from __future__ import print_function
+import random
+import sys
+import time
+
+from multisigcore.coinselection import FeeModel, InOrderSelector, LargestFirstSelector, BranchAndBoundSelector
+
+__author__ = 'devrandom'
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000]
+    # a 2 of 3 P2SH spend paying one P2PKH output, with P2SH change
+    fee_model = FeeModel([34], 297, 32)
+    selectors = (("in order", InOrderSelector()), ("largest", LargestFirstSelector()),
+                 ("bnb", BranchAndBoundSelector(seed=1)))
+    rng = random.Random(1)
+    for size in sizes:
+        values = [int(rng.lognormvariate(11, 2)) + 1000 for _ in range(size)]
+        target = sum(values) // size * 20
+        for name, selector in selectors:
+            start = time.time()
+            selected = selector.select_values(values, target, fee_model)
+            elapsed = time.time() - start
+            total = sum(values[i] for i in selected)
+            print("%8d coins %-9s %8.3fs %6d inputs %10d fee+change" % (size, name, elapsed, len(selected),
+                                                                         total - target))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+Benchmark leaf address derivation for a 2 of 3 multisig account.
+
+Compares walking the whole path from the account key for each leaf against
+the account's subchain node cache, where each new leaf is a single CKD step per cosigner,
+and against batched derivation with Account.derive_range.  All three derive with the
+generator table of multisigcore.derivation, so the differences are due to caching and
+batching alone.
+
+Run from the repository root:
+
+    PYTHONPATH=. python benchmarks/bench_derivation.py [num_addresses]
+"""
+from __future__ import print_function
+import sys
+import time
+
+from multisigcore.derivation import public_subkeys
+from multisigcore.testing import make_multisig_account
+
+__author__ = 'devrandom'
+
+
+def derive_full_path(account, count):
+    for n in range(count):
+        # nothing derived for the previous leaf is reused
+        for key in account.keys:
+            subchain = public_subkeys(key, 0, 1)[0]
+            public_subkeys(subchain, n, n + 1)
+
+
+def derive_cached(account, count):
+    for n in range(count):
+        account.script_for_path("0/%d" % (n,))
+
+
+def derive_batch(account, count):
+    account.derive_range(0, 0, count)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    for name, f in (("full path", derive_full_path), ("node cache", derive_cached), ("batch range", derive_batch)):
+        account = make_multisig_account()
+        start = time.time()
+        f(account, count)
+        elapsed = time.time() - start
+        print("%-12s %6d leaves %8.2fs %8.2fms/leaf" % (name, count, elapsed, elapsed * 1000 / count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Benchmark sequential and parallel signing of 2 of 3 multisig transactions by number of inputs.
+
+Run from the repository root:
+
+    PYTHONPATH=. python benchmarks/bench_signing.py [num_inputs ...]
+"""
+from __future__ import print_function
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from multisigcore.hierarchy import MasterKey, MultisigAccount, AccountTx
+from multisigcore.providers import BatchService
+from pycoin import encoding
+from pycoin.serialize import h2b
+from pycoin.tx import Spendable
+from pycoin.tx.pay_to import ScriptPayToScript
+
+__author__ = 'devrandom'
+
+
+def make_tx(account, num_inputs):
+    scripts = [ScriptPayToScript(encoding.hash160(account.script_for_path("0/%d" % (n,)).script())).script()
+               for n in range(10)]
+
+    class Provider(BatchService):
+        def spendables_for_addresses(self, addresses):
+            return [Spendable(coin_value=10000, script=scripts[n % len(scripts)], tx_out_index=n, tx_hash=b'2' * 32)
+                    for n in range(num_inputs)]
+    account._provider = Provider()
+    account.set_lookahead(10)
+    return account.tx([("3FfiLhj1yXkXRFRRb9CMsMXBNZXQEv23Pi", 10000 * num_inputs - 100000)])
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [10, 100, 500]
+    master_key = MasterKey.from_seed(h2b("000102030405060708090a0b0c0d0e0f"))
+    keys = [master_key.account_for_path("0H/1/%dH" % (n,)) for n in (2, 3, 4)]
+    with ProcessPoolExecutor() as executor:
+        for num_inputs in counts:
+            tx = make_tx(MultisigAccount(keys=keys), num_inputs)
+            blob = tx.serialize()
+            for name, pool in (("sequential", None), ("parallel", executor)):
+                account = MultisigAccount(keys=keys)
+                tx = AccountTx.deserialize(blob)
+                start = time.time()
+                account.sign(tx, executor=pool)
+                print("%5d inputs %-10s %8.2fs" % (num_inputs, name, time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,7 @@ __author__ = 'devrandom'
 from pycoin.tx.pay_to import build_p2sh_lookup, build_hash160_lookup
 from pycoin.tx.tx_utils import LazySecretExponentDB
 from .oracle import Oracle
+from .signing import KeyLookup, sign_parallel
 
 
 class LazySecretExponentDBWithNetwork(LazySecretExponentDB):
@@ -30,25 +31,28 @@ class LazySecretExponentDBWithNetwork(LazySecretExponentDB):
         return None
 
 
-def local_sign(tx, redeem_scripts, keys):
+def local_sign(tx, redeem_scripts, keys, executor=None):
     """
     Utility for locally signing a multisig transaction
 
     :param tx:
     :param scripts:
-    :param keys: one key per transaction input
+    :param keys: one key per transaction input, or a KeyLookup of the keys, which can be reused across transactions
+    :param executor: optional executor for computing signatures in parallel, e.g. a ProcessPoolExecutor -
+        see signing.sign_parallel
     :return:
     """
     lookup = None
     if redeem_scripts:
         raw_scripts = [script.script() for script in redeem_scripts]
         lookup = build_p2sh_lookup(raw_scripts)
-    if keys:
-        netcode = keys[0]._netcode
-    else:
+    if not keys:
         # Nothing to do
         return
-    db = LazySecretExponentDBWithNetwork(netcode, [key.wif() for key in keys], {})
-    tx.sign(db, p2sh_lookup=lookup)
+    db = keys if isinstance(keys, KeyLookup) else KeyLookup(keys)
+    if executor is not None:
+        sign_parallel(tx, db, p2sh_lookup=lookup, executor=executor)
+    else:
+        tx.sign(db, p2sh_lookup=lookup)
 
 
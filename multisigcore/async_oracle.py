@@ -0,0 +1,155 @@
+"""
+asyncio client for the Oracle.
+
+:class:`AsyncOracle` has the API of :class:`multisigcore.oracle.Oracle`, with sign, sign_with_paths, get, create and
+verify_personal_information as coroutines raising the same exceptions.  The requests of all AsyncOracles for the same
+base_url in an event loop share one aiohttp connection pool, and at most max_in_flight of them are in flight at a
+time, so one process can keep many oracle requests in flight without a thread per request.
+
+This module needs Python 3.5 or later and aiohttp, and is not imported by the multisigcore package.
+"""
+import asyncio
+import weakref
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .hierarchy import AccountTxIn, AccountTxOut
+from .oracle import DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT, Oracle
+
+__author__ = 'devrandom'
+
+DEFAULT_MAX_IN_FLIGHT = 100
+
+_JSON_HEADERS = {'content-type': 'application/json'}
+
+# for each event loop, the pool of each base_url using the shared session, and of each session passed in
+_pools = weakref.WeakKeyDictionary()
+
+
+def _client_timeout(timeout):
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return aiohttp.ClientTimeout(connect=connect, sock_read=read)
+    return aiohttp.ClientTimeout(total=timeout)
+
+
+def make_session(pool_size=DEFAULT_POOL_SIZE):
+    """
+    An aiohttp session keeping up to pool_size connections open.  Must be called in a running event loop.
+
+    :rtype: aiohttp.ClientSession
+    """
+    if aiohttp is None:
+        raise ImportError("AsyncOracle requires aiohttp")
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=pool_size))
+
+
+class _Pool(object):
+    def __init__(self, session, max_in_flight):
+        self.session = session
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+
+
+def _pool(key, make, max_in_flight):
+    pools = _pools.setdefault(asyncio.get_event_loop(), {})
+    pool = pools.get(key)
+    if pool is None or pool.session.closed:
+        pool = pools[key] = _Pool(make(), max_in_flight)
+    return pool
+
+
+async def close_sessions():
+    """Close the shared sessions of the running event loop, and release the sessions passed in"""
+    pools = _pools.pop(asyncio.get_event_loop(), {})
+    for key, pool in pools.items():
+        if key is not pool.session:
+            await pool.session.close()
+
+
+class AsyncOracle(Oracle):
+    """
+    An Oracle with coroutine requests.
+
+    Building a sign request looks up the input transactions in tx_db synchronously, so tx_db should not block.
+
+    :param session: the aiohttp session to use, by default the session shared by AsyncOracles with the same
+        base_url in the running event loop
+    :type session: aiohttp.ClientSession
+    :param pool_size: number of connections of the shared session, if created by this AsyncOracle
+    :param timeout: request timeout in seconds, or a (connect, read) pair
+    :param max_in_flight: maximum number of requests in flight on the session, set by the first AsyncOracle using it
+    """
+    def __init__(self, account, tx_db=None, manager=None, base_url=None, num_oracle_keys=1, session=None,
+                 pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        self.max_in_flight = max_in_flight
+        super(AsyncOracle, self).__init__(account, tx_db=tx_db, manager=manager, base_url=base_url,
+                                          num_oracle_keys=num_oracle_keys, session=session, pool_size=pool_size,
+                                          timeout=timeout)
+
+    def _init_session(self, session, pool_size):
+        """:nodoc:"""
+        if aiohttp is None:
+            raise ImportError("AsyncOracle requires aiohttp")
+        self.session = session
+        self._pool_size = pool_size
+
+    def _connection(self):
+        if self.session is None:
+            pool = _pool(self.base_url, lambda: make_session(self._pool_size), self.max_in_flight)
+        else:
+            pool = _pool(self.session, lambda: self.session, self.max_in_flight)
+        return pool.session, pool.semaphore
+
+    async def _request(self, method, url, body=None):
+        """:nodoc: the status code and content of the response"""
+        session, semaphore = self._connection()
+        async with semaphore:
+            async with session.request(method, url, data=body, headers=_JSON_HEADERS if body is not None else None,
+                                       timeout=_client_timeout(self.timeout)) as response:
+                return response.status, await response.read()
+
+    async def sign(self, tx, spend_id=None, verifications=None, callback=None):
+        """
+        Have the Oracle sign the transaction, see :meth:`Oracle.sign`
+
+        :type tx: AccountTx
+        :rtype: multisigcore.oracle.SignatureResult
+        """
+        input_chain_paths = [x.path if isinstance(x, AccountTxIn) else None for x in tx.txs_in]
+        output_chain_paths = [x.path if isinstance(x, AccountTxOut) else None for x in tx.txs_out]
+        return await self.sign_with_paths(tx, input_chain_paths, output_chain_paths, spend_id, verifications,
+                                          callback=callback)
+
+    async def sign_with_paths(self, tx, input_chain_paths, output_chain_paths, spend_id=None, verifications=None,
+                              callback=None):
+        """
+        Have the Oracle sign the transaction, see :meth:`Oracle.sign_with_paths`
+
+        :rtype: multisigcore.oracle.SignatureResult
+        """
+        url, body = self._sign_request(tx, input_chain_paths, output_chain_paths, spend_id, verifications, callback)
+        status_code, content = await self._request('POST', url, body)
+        return self._sign_response(status_code, content)
+
+    async def get(self):
+        """Retrieve the oracle public key from the Oracle"""
+        if self._account.complete:
+            raise Exception("the account for this Oracle is already complete")
+        url = self._url()
+        status_code, content = await self._request('GET', url)
+        self._get_response(url, status_code, content)
+
+    async def create(self, parameters, personal_info):
+        """Create an Oracle keychain on server and retrieve the oracle public key, see :meth:`Oracle.create`"""
+        body = self._create_body(parameters, personal_info)
+        status_code, content = await self._request('POST', self._url(), body)
+        self._create_response(body, status_code, content)
+
+    async def verify_personal_information(self, personal_info, call=None, callback=None):
+        """See :meth:`Oracle.verify_personal_information`"""
+        body = self._verify_body(personal_info, call, callback)
+        status_code, content = await self._request('POST', self._url() + "/verifyPii", body)
+        self._verify_response(body, status_code, content)
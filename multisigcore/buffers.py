@@ -0,0 +1,19 @@
+"""
+Helpers for reading binary formats in place from bytes, memoryviews and mmaps.
+"""
+
+__author__ = 'devrandom'
+
+
+def slice_bytes(buf, start, end):
+    """
+    Copy buf[start:end] to bytes.  On Python 2, bytes() of a memoryview is its repr, so memoryview slices are
+    copied with tobytes.
+
+    :param buf: bytes, memoryview, mmap or any other buffer
+    :rtype: bytes
+    """
+    chunk = buf[start:end]
+    if isinstance(chunk, memoryview):
+        return chunk.tobytes()
+    return bytes(chunk)
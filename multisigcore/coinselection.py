@@ -0,0 +1,266 @@
+"""
+Coin selection strategies for :meth:`multisigcore.hierarchy.Account.tx`.
+
+A selector picks spendables whose total covers the amount sent plus the fee for the resulting transaction.
+The fee depends only on the number of inputs and on whether the transaction has a change output, so it is
+provided as a :class:`FeeModel` that can be evaluated for each candidate set without building a transaction.
+
+Selectors work on an array of coin values and return indices into it - :meth:`CoinSelector.select` adapts them
+to a list of spendables.
+"""
+import random
+
+from .txsize import TX_FIXED_SIZE, fee_for_size, varint_size
+
+__author__ = 'devrandom'
+
+DUST = 546
+TX_FEE_PER_THOUSAND_BYTES = 1000
+
+
+class FeeModel(object):
+    """
+    The fee of a transaction as a function of its number of inputs and whether it has change.
+
+    :param list[int] output_sizes: serialized sizes of the payment outputs
+    :param int input_size: serialized size of each input
+    :param int change_size: serialized size of the change output
+    :param int fee_per_kb: fee per started thousand bytes
+    :param fee_per_byte: fee rate in satoshis per byte, overriding fee_per_kb
+    """
+    def __init__(self, output_sizes, input_size, change_size, fee_per_kb=TX_FEE_PER_THOUSAND_BYTES, dust=DUST,
+                 fee_per_byte=None):
+        self.output_sizes = output_sizes
+        self.input_size = input_size
+        self.change_size = change_size
+        self.fee_per_kb = fee_per_kb
+        self.fee_per_byte = fee_per_byte
+        self.dust = dust
+        self._outputs_size = sum(output_sizes)
+
+    def size(self, num_inputs, with_change=False):
+        """The serialized size of the transaction"""
+        num_outputs = len(self.output_sizes) + (1 if with_change else 0)
+        return (TX_FIXED_SIZE + varint_size(num_inputs) + varint_size(num_outputs) +
+                num_inputs * self.input_size + self._outputs_size + (self.change_size if with_change else 0))
+
+    def fee(self, num_inputs, with_change=False):
+        return self._fee_for_size(self.size(num_inputs, with_change))
+
+    def input_fee(self):
+        """An upper bound on the fee added by one more input"""
+        # the input count may grow by up to 8 bytes
+        return self._fee_for_size(self.input_size + 8)
+
+    def _fee_for_size(self, size):
+        if self.fee_per_byte is not None:
+            return fee_for_size(size, self.fee_per_byte)
+        return self.fee_per_kb * ((999 + size) // 1000)
+
+    def cost_of_change(self, num_inputs):
+        """
+        The least excess over the amount and fee that is worth a change output - excess below this is
+        left to the miner.
+        """
+        return self.fee(num_inputs, True) - self.fee(num_inputs, False) + self.dust
+
+
+class CoinSelector(object):
+    """Base class for coin selection strategies"""
+    def select(self, spendables, target, fee_model):
+        """
+        Select spendables to send target, plus fees.
+
+        :param list[pycoin.tx.Spendable] spendables: available coins
+        :param int target: the amount sent, excluding fees
+        :type fee_model: FeeModel
+        :return: the selected spendables, or None if the balance is insufficient
+        :rtype: list[pycoin.tx.Spendable]
+        """
+        indices = self.select_values([spend.coin_value for spend in spendables], target, fee_model)
+        if indices is None:
+            return None
+        return [spendables[i] for i in indices]
+
+    def select_values(self, values, target, fee_model):
+        """
+        Select coin values to send target, plus fees.
+
+        :param list[int] values: available coin values
+        :param int target: the amount sent, excluding fees
+        :type fee_model: FeeModel
+        :return: indices into values, or None if the balance is insufficient
+        :rtype: list[int]
+        """
+        raise NotImplementedError()
+
+
+def _accumulate(values, order, target, fee_model):
+    total = 0
+    selected = []
+    for i in order:
+        selected.append(i)
+        total += values[i]
+        if total >= target + fee_model.fee(len(selected)):
+            return selected
+    return None
+
+
+class InOrderSelector(CoinSelector):
+    """Spend coins in the order they are given, e.g. in provider order"""
+    def select_values(self, values, target, fee_model):
+        return _accumulate(values, range(len(values)), target, fee_model)
+
+
+class LargestFirstSelector(CoinSelector):
+    """Spend the largest coins first, minimizing the number of inputs"""
+    def select_values(self, values, target, fee_model):
+        return _accumulate(values, sorted(range(len(values)), key=values.__getitem__, reverse=True),
+                           target, fee_model)
+
+
+class OldestFirstSelector(CoinSelector):
+    """Spend the coins confirmed earliest first, and unconfirmed coins last"""
+    def select(self, spendables, target, fee_model):
+        ordered = sorted(spendables, key=lambda spend: spend.block_index_available or float('inf'))
+        return InOrderSelector().select(ordered, target, fee_model)
+
+
+class BranchAndBoundSelector(CoinSelector):
+    """
+    Search for a changeless set of coins, whose excess over the amount and fee is less than the cost of creating
+    and later spending a change output.  If there is none, fall back to a knapsack approximation that aims for the
+    smallest change, and finally to largest first.
+
+    The search runs over the values sorted in descending order, with the suffix sums of the sorted values
+    bounding each branch, and gives up after max_tries steps.
+
+    :param int max_tries: bound on the number of search steps
+    :param int knapsack_iterations: number of random passes of the knapsack approximation
+    :param int knapsack_pool: number of largest coins considered by the knapsack approximation
+    """
+    def __init__(self, max_tries=100000, knapsack_iterations=100, knapsack_pool=1000, seed=None):
+        self.max_tries = max_tries
+        self.knapsack_iterations = knapsack_iterations
+        self.knapsack_pool = knapsack_pool
+        self.seed = seed
+
+    def select_values(self, values, target, fee_model):
+        input_fee = fee_model.input_fee()
+        # coins that do not pay for their own input can only increase the fee
+        order = sorted((i for i in range(len(values)) if values[i] > input_fee),
+                       key=values.__getitem__, reverse=True)
+        sorted_values = [values[i] for i in order]
+        selected = self.branch_and_bound(sorted_values, target, fee_model)
+        if selected is None:
+            selected = self.knapsack(sorted_values, target, fee_model)
+        if selected is None:
+            return LargestFirstSelector().select_values(values, target, fee_model)
+        return [order[i] for i in selected]
+
+    def branch_and_bound(self, sorted_values, target, fee_model):
+        """
+        Depth first search for a changeless solution.
+
+        :param list[int] sorted_values: coin values in descending order
+        :return: indices into sorted_values, or None
+        """
+        n = len(sorted_values)
+        remaining = [0] * (n + 1)
+        for i in range(n - 1, -1, -1):
+            remaining[i] = remaining[i + 1] + sorted_values[i]
+        best = None
+        best_excess = None
+        selected = []
+        total = 0
+        i = 0
+        tries = 0
+        while tries < self.max_tries:
+            tries += 1
+            need = target + fee_model.fee(len(selected))
+            backtrack = False
+            if total >= need:
+                excess = total - need
+                if excess <= fee_model.cost_of_change(len(selected)):
+                    if best is None or excess < best_excess or \
+                            (excess == best_excess and len(selected) < len(best)):
+                        best = list(selected)
+                        best_excess = excess
+                        if excess == 0:
+                            break
+                backtrack = True
+            elif i >= n or total + remaining[i] < need:
+                backtrack = True
+            if backtrack:
+                # drop the last included coin, and skip it in favor of the next one
+                if not selected:
+                    break
+                last = selected.pop()
+                total -= sorted_values[last]
+                i = last + 1
+                # including an equal coin instead of this one gives the same sums
+                while i < n and sorted_values[i] == sorted_values[last]:
+                    i += 1
+                continue
+            selected.append(i)
+            total += sorted_values[i]
+            i += 1
+        return best
+
+    def knapsack(self, sorted_values, target, fee_model):
+        """
+        Approximate the subset of coins that leaves the least change above dust, by random passes over the largest
+        coins smaller than the amount wanted.  A single larger coin is used instead if it leaves less change.
+
+        :param list[int] sorted_values: coin values in descending order
+        :return: indices into sorted_values, or None
+        """
+        def wanted(num_inputs):
+            return target + fee_model.fee(num_inputs, True) + fee_model.dust
+
+        # the coins enough on their own come first
+        num_larger = _count_at_least(sorted_values, wanted(1))
+        lowest_larger = num_larger - 1 if num_larger else None
+        candidates = sorted_values[num_larger:num_larger + self.knapsack_pool]
+        best = None
+        best_total = None
+        if sum(candidates) >= wanted(len(candidates)):
+            rng = random.Random(self.seed)
+            for _ in range(self.knapsack_iterations):
+                included = [False] * len(candidates)
+                count = 0
+                total = 0
+                reached = False
+                for pass_number in range(2):
+                    if reached:
+                        break
+                    for i, value in enumerate(candidates):
+                        if (rng.random() < 0.5) if pass_number == 0 else not included[i]:
+                            total += value
+                            count += 1
+                            included[i] = True
+                            if total >= wanted(count):
+                                reached = True
+                                if best is None or total < best_total:
+                                    best = [num_larger + j for j in range(len(candidates)) if included[j]]
+                                    best_total = total
+                                total -= value
+                                count -= 1
+                                included[i] = False
+            if best is not None and best_total == wanted(len(best)):
+                return best
+        if lowest_larger is not None and (best is None or sorted_values[lowest_larger] <= best_total):
+            return [lowest_larger]
+        return best
+
+
+def _count_at_least(sorted_values, value):
+    """The number of values at least value, in a list sorted in descending order"""
+    lo, hi = 0, len(sorted_values)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if sorted_values[mid] >= value:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
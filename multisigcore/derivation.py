@@ -0,0 +1,267 @@
+"""
+Batched public child key derivation, and private child key derivation without memoization.
+
+Deriving many non-hardened children of the same parent node shares the HMAC setup for the parent
+chain code and public key, multiplies the generator through a precomputed table of its multiples
+using Jacobian coordinates, and normalizes the whole batch to affine coordinates with a single
+modular inversion.
+"""
+import hashlib
+import hmac
+import struct
+
+from pycoin.ecdsa import generator_secp256k1
+from pycoin.encoding import EncodingError, from_bytes_32, public_pair_to_sec, to_bytes_32
+from pycoin.intbytes import byte_to_int
+from pycoin.key.bip32 import DerivationError
+
+__author__ = 'devrandom'
+
+_P = generator_secp256k1.curve().p()
+_ORDER = generator_secp256k1.order()
+_INFINITY = (0, 1, 0)
+
+# _G_TABLE[w][b - 1] is b * 256**w * G in affine coordinates
+_G_TABLE = None
+
+
+def _double(X1, Y1, Z1):
+    """Double a point in Jacobian coordinates (a = 0)"""
+    if Z1 == 0 or Y1 == 0:
+        return _INFINITY
+    YY = Y1 * Y1 % _P
+    S = 4 * X1 * YY % _P
+    M = 3 * X1 * X1 % _P
+    X3 = (M * M - 2 * S) % _P
+    Y3 = (M * (S - X3) - 8 * YY * YY) % _P
+    Z3 = 2 * Y1 * Z1 % _P
+    return X3, Y3, Z3
+
+
+def _add_affine(X1, Y1, Z1, x2, y2):
+    """Add an affine point to a point in Jacobian coordinates"""
+    if Z1 == 0:
+        return x2, y2, 1
+    Z1Z1 = Z1 * Z1 % _P
+    H = (x2 * Z1Z1 - X1) % _P
+    r = (y2 * Z1 * Z1Z1 - Y1) % _P
+    if H == 0:
+        if r == 0:
+            return _double(X1, Y1, Z1)
+        return _INFINITY
+    HH = H * H % _P
+    HHH = H * HH % _P
+    V = X1 * HH % _P
+    X3 = (r * r - HHH - 2 * V) % _P
+    Y3 = (r * (V - X3) - Y1 * HHH) % _P
+    Z3 = Z1 * H % _P
+    return X3, Y3, Z3
+
+
+def to_affine(points):
+    """
+    Convert points in Jacobian coordinates to affine public pairs, using one modular inversion for the batch.
+
+    :param points: list of (X, Y, Z), none of which may be the point at infinity
+    :rtype: list[(int, int)]
+    """
+    prefix = []
+    acc = 1
+    for X, Y, Z in points:
+        prefix.append(acc)
+        acc = acc * Z % _P
+    inv = pow(acc, _P - 2, _P)
+    result = [None] * len(points)
+    for i in range(len(points) - 1, -1, -1):
+        X, Y, Z = points[i]
+        z_inv = inv * prefix[i] % _P
+        inv = inv * Z % _P
+        z_inv2 = z_inv * z_inv % _P
+        result[i] = (X * z_inv2 % _P, Y * z_inv2 * z_inv % _P)
+    return result
+
+
+def _g_table():
+    global _G_TABLE
+    if _G_TABLE is None:
+        table = []
+        base = generator_secp256k1.pair()
+        for _ in range(32):
+            row = [(base[0], base[1], 1)]
+            for _ in range(254):
+                row.append(_add_affine(row[-1][0], row[-1][1], row[-1][2], base[0], base[1]))
+            row = to_affine(row)
+            table.append(row)
+            X, Y, Z = _add_affine(row[-1][0], row[-1][1], 1, base[0], base[1])
+            base = to_affine([(X, Y, Z)])[0]
+        _G_TABLE = table
+    return _G_TABLE
+
+
+def mul_generator(k, start=_INFINITY):
+    """
+    Multiply the generator by k.
+
+    :param int k: scalar, 0 < k < order
+    :param start: a point in Jacobian coordinates to add the product to
+    :return: the point in Jacobian coordinates
+    """
+    table = _g_table()
+    X, Y, Z = start
+    w = 0
+    while k:
+        b = k & 0xff
+        if b:
+            x, y = table[w][b - 1]
+            X, Y, Z = _add_affine(X, Y, Z, x, y)
+        k >>= 8
+        w += 1
+    return X, Y, Z
+
+
+def mul_point(public_pair, k):
+    """
+    Multiply a point by k, by double and add.
+
+    :param public_pair: the point in affine coordinates
+    :param int k: scalar, 0 < k < order
+    :return: the point in Jacobian coordinates
+    """
+    x, y = public_pair
+    X, Y, Z = _INFINITY
+    for bit in bin(k)[2:]:
+        X, Y, Z = _double(X, Y, Z)
+        if bit == '1':
+            X, Y, Z = _add_affine(X, Y, Z, x, y)
+    return X, Y, Z
+
+
+def public_children(public_pair, chain_code, indices):
+    """
+    Derive non-hardened public children (BIP32 CKDpub) of a parent node in one batch.
+
+    :param public_pair: the parent public key
+    :param bytes chain_code: the parent chain code
+    :param indices: child indices, each below 0x80000000
+    :return: a (public_pair, chain_code) pair for each index
+    :rtype: list[((int, int), bytes)]
+    """
+    mac = hmac.new(chain_code, public_pair_to_sec(public_pair, compressed=True), hashlib.sha512)
+    px, py = public_pair
+    points = []
+    chain_codes = []
+    for i in indices:
+        if not 0 <= i < 0x80000000:
+            raise ValueError("bad non-hardened subkey index %r" % (i,))
+        h = mac.copy()
+        h.update(struct.pack(">L", i))
+        I64 = h.digest()
+        I_left_as_exponent = from_bytes_32(I64[:32])
+        if I_left_as_exponent >= _ORDER:
+            raise DerivationError('I_L >= {}'.format(_ORDER))
+        X, Y, Z = mul_generator(I_left_as_exponent)
+        X, Y, Z = _add_affine(X, Y, Z, px, py)
+        if Z == 0:
+            raise DerivationError('K_{} == infinity'.format(i))
+        points.append((X, Y, Z))
+        chain_codes.append(I64[32:])
+    return list(zip(to_affine(points), chain_codes))
+
+
+def public_subkeys(node, start, stop):
+    """
+    Derive the public subkeys start..stop-1 of a BIP32 node.
+
+    :type node: pycoin.key.BIP32Node.BIP32Node
+    :rtype: list[pycoin.key.BIP32Node.BIP32Node]
+    """
+    netcode = node.netcode()
+    depth = node.tree_depth() + 1
+    fingerprint = node.fingerprint()
+    cls = node.__class__
+    return [cls(netcode=netcode, chain_code=chain_code, depth=depth, parent_fingerprint=fingerprint,
+                child_index=i, public_pair=public_pair)
+            for i, (public_pair, chain_code) in zip(range(start, stop),
+                                                    public_children(node.public_pair(), node.chain_code(),
+                                                                    range(start, stop)))]
+
+
+def public_pair_for_sec(sec):
+    """
+    Decode a compressed SEC public key with a single modular exponentiation (p = 3 mod 4).
+
+    :param bytes sec: 33 byte compressed public key
+    :rtype: (int, int)
+    """
+    prefix = byte_to_int(sec[0])
+    if len(sec) != 33 or prefix not in (2, 3):
+        raise EncodingError("bad compressed sec")
+    x = from_bytes_32(sec[1:33])
+    y2 = (x * x * x + 7) % _P
+    y = pow(y2, (_P + 1) // 4, _P)
+    if y * y % _P != y2:
+        raise EncodingError("point not on curve")
+    if (y & 1) != (prefix & 1):
+        y = _P - y
+    return x, y
+
+
+def subkey_from_parts(node, i, chain_code, sec):
+    """
+    Rebuild the public subkey i of a BIP32 node from its chain code and compressed public key,
+    without deriving it.
+
+    :type node: pycoin.key.BIP32Node.BIP32Node
+    :rtype: pycoin.key.BIP32Node.BIP32Node
+    """
+    return node.__class__(netcode=node.netcode(), chain_code=chain_code, depth=node.tree_depth() + 1,
+                          parent_fingerprint=node.fingerprint(), child_index=i,
+                          public_pair=public_pair_for_sec(sec))
+
+
+def private_subkey(node, i, is_hardened=False):
+    """
+    Derive the private subkey i of a private BIP32 node (CKDpriv).  The child public key is computed by pycoin
+    rather than with the generator table, which is not meant for secrets.  Unlike node.subkey, the child is not
+    memoized on the parent node.
+
+    :type node: pycoin.key.BIP32Node.BIP32Node
+    :param bool is_hardened: use hardened derivation
+    :rtype: pycoin.key.BIP32Node.BIP32Node
+    """
+    if not 0 <= i < 0x80000000:
+        raise ValueError("bad subkey index %r" % (i,))
+    secret_exponent = node.secret_exponent()
+    if secret_exponent is None:
+        raise ValueError("node is not private")
+    if is_hardened:
+        i |= 0x80000000
+        data = b'\0' + to_bytes_32(secret_exponent) + struct.pack(">L", i)
+    else:
+        data = public_pair_to_sec(node.public_pair(), compressed=True) + struct.pack(">L", i)
+    I64 = hmac.new(node.chain_code(), data, hashlib.sha512).digest()
+    I_left_as_exponent = from_bytes_32(I64[:32])
+    if I_left_as_exponent >= _ORDER:
+        raise DerivationError('I_L >= {}'.format(_ORDER))
+    child_exponent = (I_left_as_exponent + secret_exponent) % _ORDER
+    if child_exponent == 0:
+        raise DerivationError('k_{} == 0'.format(i))
+    # the public pair is derived by pycoin, the generator table is only used on public data
+    return node.__class__(netcode=node.netcode(), chain_code=I64[32:], depth=node.tree_depth() + 1,
+                          parent_fingerprint=node.fingerprint(), child_index=i, secret_exponent=child_exponent)
+
+
+def private_subkey_for_path(node, path):
+    """
+    Derive a private subkey of a private BIP32 node, such as "1", "0/5" or "0H/1", without memoizing children on
+    the nodes along the path.
+
+    :type node: pycoin.key.BIP32Node.BIP32Node
+    :rtype: pycoin.key.BIP32Node.BIP32Node
+    """
+    for level in path.split('/'):
+        is_hardened = level[-1:] in ("'", "p", "H")
+        if is_hardened:
+            level = level[:-1]
+        node = private_subkey(node, int(level), is_hardened)
+    return node
@@ -1,25 +1,39 @@
 from __future__ import print_function
+import contextlib
 import io
 import json
+import struct
+import threading
 from functools import reduce
 
 import multisigcore
+from . import keycache
+from . import txsize
+from .buffers import slice_bytes
+from .coinselection import DUST, TX_FEE_PER_THOUSAND_BYTES, FeeModel, InOrderSelector
+from .derivation import private_subkey_for_path, public_subkeys, subkey_from_parts
+from .lru import LRUCache
+from .sighash import SighashEngine
+from .signing import KeyLookup, sign_parallel_many
+from .verification import verify_multisig_inputs
 from .providers import BatchService
 from pycoin import encoding
+from pycoin.networks import address_prefix_for_netcode, pay_to_script_prefix_for_netcode
 from pycoin.key.BIP32Node import BIP32Node
 from pycoin.scripts.tx import DEFAULT_VERSION
+from pycoin.intbytes import bytes_from_int
 from pycoin.serialize import h2b, b2h
 from pycoin.serialize.bitcoin_streamer import parse_struct
 from pycoin.services import providers
 from pycoin.tx import Tx, TxOut, TxIn
+from pycoin.tx.Tx import SIGHASH_ALL
 from pycoin.tx.TxOut import standard_tx_out_script
-from pycoin.tx.pay_to import ScriptMultisig, ScriptPayToScript, ScriptPayToAddress
+from pycoin.tx.pay_to import ScriptMultisig, ScriptPayToScript, ScriptPayToAddress, build_p2sh_lookup
 
 
 __author__ = 'devrandom'
 
 LOOKAHEAD = 20
-DUST = 546
 
 
 class InsufficientBalanceException(ValueError):
@@ -32,6 +46,23 @@ class AccountKey(BIP32Node):
     def from_key(cls, key):
         return cls.from_hwif(key)
 
+    @classmethod
+    def from_node(cls, node, as_private=True):
+        """
+        Convert a BIP32 node to an AccountKey directly, without a round-trip through hwif.
+        The public pair already computed for the node is reused.
+
+        :type node: BIP32Node
+        :param as_private: keep the private key if the node has one
+        :rtype: AccountKey
+        """
+        if node.is_private() and not as_private:
+            node = node.public_copy()
+        key = cls.__new__(cls)
+        key.__dict__.update(node.__dict__)
+        key._subkey_cache = dict()
+        return key
+
     def leaf(self, n, change=False):
         return self.leaf_for_path("%s/%s" % (1 if change else 0, n))
 
@@ -54,7 +85,22 @@ class MasterKey(BIP32Node):
         return cls.from_hwif(key)
 
     def account_for_path(self, path):
-        return AccountKey.from_key(self.subkey_for_path(path).hwif(as_private=self.is_private()))
+        return AccountKey.from_node(self.subkey_for_path(path), as_private=self.is_private())
+
+    def accounts_for_range(self, path, start, stop, hardened=True):
+        """
+        Derive sibling accounts path/start .. path/(stop-1), sharing the derivation of the common parent.
+        For example accounts_for_range("44H/0H", 0, 100) returns the first hundred BIP44 bitcoin accounts.
+
+        :param str path: the parent path, or "" for children of this key
+        :param int start: first account number
+        :param int stop: account number to stop at (exclusive)
+        :param hardened: whether to use hardened derivation for the accounts
+        :rtype: list[AccountKey]
+        """
+        parent = self.subkey_for_path(path) if path else self
+        return [AccountKey.from_node(parent.subkey(n, is_hardened=hardened), as_private=self.is_private())
+                for n in range(start, stop)]
 
     def electrum_account(self, n):
         return self.account_for_path("0H/%s" % (n,))
@@ -66,13 +112,11 @@ class MasterKey(BIP32Node):
         return self.account_for_path("%sH/%sH/%sH" % (purpose, coin, n))
 
 
-TX_FEE_PER_THOUSAND_BYTES = 1000
-
-
 def recommended_fee_for_tx(tx):
     """
     Return the recommended transaction fee in satoshis.
-    This is a grossly simplified version of this function.
+    This is a grossly simplified version of this function, measuring the transaction as is - see
+    Account.recommended_fee for the fee of an unsigned transaction once signed.
     TODO: improve to consider TxOut sizes.
       - whether the transaction contains "dust"
       - whether any outputs are less than 0.001
@@ -85,6 +129,30 @@ def recommended_fee_for_tx(tx):
     return tx_fee
 
 
+def parse_varint(buf, offset):
+    """
+    Parse a bitcoin variable length integer in place.
+
+    :param buf: bytes, memoryview, mmap or any other buffer
+    :return: the value and the offset after it
+    :rtype: (int, int)
+    """
+    v, = struct.unpack_from("<B", buf, offset)
+    if v < 253:
+        return v, offset + 1
+    if v == 253:
+        return struct.unpack_from("<H", buf, offset + 1)[0], offset + 3
+    if v == 254:
+        return struct.unpack_from("<L", buf, offset + 1)[0], offset + 5
+    return struct.unpack_from("<Q", buf, offset + 1)[0], offset + 9
+
+
+def _parse_tx_out_buffer(buf, offset):
+    coin_value, = struct.unpack_from("<Q", buf, offset)
+    length, offset = parse_varint(buf, offset + 8)
+    return coin_value, slice_bytes(buf, offset, offset + length), offset + length
+
+
 class AccountTxIn(TxIn):
     def __init__(self, previous_hash, previous_index, script=b'', sequence=4294967295, path=None):
         super(AccountTxIn, self).__init__(previous_hash, previous_index, script, sequence)
@@ -100,6 +168,57 @@ class AccountTxOut(TxOut):
 class AccountTx(Tx):
     def __init__(self, version, txs_in, txs_out, locktime=0, unspents=[]):
         super(AccountTx, self).__init__(version, txs_in, txs_out, locktime, unspents)
+        self._sighash_engine = None
+        self._signing_passes = 0
+
+    def sighash_engine(self):
+        """
+        The signature hash engine of this transaction, rebuilt if the transaction changed other than in its input
+        scripts.
+
+        :rtype: multisigcore.sighash.SighashEngine
+        """
+        engine = self._sighash_engine
+        if engine is None or not engine.matches(self):
+            engine = self._sighash_engine = SighashEngine(self)
+        return engine
+
+    def __getstate__(self):
+        # the signature hash engine holds hash states, which cannot be copied - it is rebuilt when needed
+        state = self.__dict__.copy()
+        state['_sighash_engine'] = None
+        state['_signing_passes'] = 0
+        return state
+
+    @contextlib.contextmanager
+    def signing_pass(self):
+        """
+        Context in which the transaction only changes in its input scripts, so that the signature hash engine is
+        checked once on entry rather than for each signature hash.
+        """
+        self.sighash_engine()
+        self._signing_passes += 1
+        try:
+            yield
+        finally:
+            self._signing_passes -= 1
+
+    def signature_hash(self, tx_out_script, unsigned_txs_out_idx, hash_type):
+        """As Tx.signature_hash, without re-serializing the transaction for each input if hash_type is SIGHASH_ALL"""
+        if hash_type != SIGHASH_ALL or not 0 <= unsigned_txs_out_idx < len(self.txs_in):
+            return super(AccountTx, self).signature_hash(tx_out_script, unsigned_txs_out_idx, hash_type)
+        engine = self._sighash_engine if self._signing_passes else self.sighash_engine()
+        return engine.signature_hash(tx_out_script, unsigned_txs_out_idx)
+
+    def sign(self, hash160_lookup, hash_type=SIGHASH_ALL, **kwargs):
+        """As Tx.sign, checking the signature hash engine once for all inputs"""
+        with self.signing_pass():
+            return super(AccountTx, self).sign(hash160_lookup, hash_type=hash_type, **kwargs)
+
+    def bad_signature_count(self):
+        """As Tx.bad_signature_count, checking the signature hash engine once for all inputs"""
+        with self.signing_pass():
+            return super(AccountTx, self).bad_signature_count()
 
     def input_chain_paths(self):
         return [tin.path for tin in self.txs_in]
@@ -144,6 +263,51 @@ class AccountTx(Tx):
         lock_time, = parse_struct("L", f)
         return class_(version, txs_in, txs_out, lock_time)
 
+    @classmethod
+    def parse_buffer(class_, buf, offset=0, input_chain_paths=None, output_chain_paths=None):
+        """
+        Parse a transaction in place from a buffer, such as bytes, a memoryview or an mmap, without copying
+        more than the fields of the transaction.
+
+        :param int offset: where the transaction starts
+        :return: the transaction and the offset after it
+        :rtype: (AccountTx, int)
+        """
+        version, = struct.unpack_from("<L", buf, offset)
+        count, offset = parse_varint(buf, offset + 4)
+        txs_in = []
+        for i in range(count):
+            previous_hash = slice_bytes(buf, offset, offset + 32)
+            previous_index, = struct.unpack_from("<L", buf, offset + 32)
+            length, offset = parse_varint(buf, offset + 36)
+            script = slice_bytes(buf, offset, offset + length)
+            sequence, = struct.unpack_from("<L", buf, offset + length)
+            offset += length + 4
+            txs_in.append(AccountTxIn(previous_hash, previous_index, script, sequence,
+                                      input_chain_paths[i] if input_chain_paths else None))
+        count, offset = parse_varint(buf, offset)
+        txs_out = []
+        for i in range(count):
+            coin_value, script, offset = _parse_tx_out_buffer(buf, offset)
+            path = output_chain_paths[i] if output_chain_paths else None
+            txs_out.append(AccountTxOut(coin_value, script, path) if path else TxOut(coin_value, script))
+        lock_time, = struct.unpack_from("<L", buf, offset)
+        return class_(version, txs_in, txs_out, lock_time), offset + 4
+
+    def parse_unspents_buffer(self, buf, offset=0):
+        """
+        Parse the unspents of each input in place from a buffer, see :meth:`parse_buffer`.
+
+        :return: the offset after the unspents
+        :rtype: int
+        """
+        unspents = []
+        for _ in self.txs_in:
+            coin_value, script, offset = _parse_tx_out_buffer(buf, offset)
+            unspents.append(TxOut(coin_value, script) if coin_value else None)
+        self.set_unspents(unspents)
+        return offset
+
     @classmethod
     def deserialize(class_, blob):
         """
@@ -156,30 +320,153 @@ class AccountTx(Tx):
         return tx
 
 class Account(object):
-    __slots__ = ['netcode', 'lookahead', 'address_map', '_provider', '_cache']
+    __slots__ = ['netcode', 'lookahead', 'address_map', '_provider', '_cache', '_nodes', '_addresses', '_script_map',
+                 '_utxo_store', '_reservations', '_private_cache', '_lock']
 
     def __init__(self, netcode='BTC', cache=None):
         """
         :param netcode: network code
-        :param str cache: the JSON formatted cache - see the cache property
+        :param cache: the JSON formatted cache - see the cache property, or the binary cache - see binary_cache.
+            A binary cache can also be a snapshot opened with keycache.open_snapshot.  Binary caches are decoded
+            lazily.
+        :type cache: str or bytes or mmap.mmap
         """
         object.__setattr__(self, 'netcode', netcode)
         object.__setattr__(self, 'lookahead', LOOKAHEAD)
         self._provider = providers
-        self.address_map = None
+        self.address_map = {}
+        self._nodes = {}
+        self._addresses = {'0': [], '1': []}
+        self._script_map = {}
+        self._utxo_store = None
+        self._reservations = None
+        self._private_cache = None
+        self._lock = threading.RLock()
 
         def decode_key(dct):
             if 'hwif' in dct:
                 return BIP32Node.from_hwif(dct['hwif'])
             return dct
-        if cache:
+        if cache and keycache.is_binary_cache(cache):
+            _, self._cache = keycache.loads_lazy(cache)
+        elif cache:
             self._cache = json.loads(cache, object_hook=decode_key)
         else:
             self._cache = {'keys': {}, 'issued': {'0': 1, '1': 1}}
 
+    def _public_subkey(self, key, key_index, path):
+        """
+        Derive the public subkey of one of our account keys.
+        Non-hardened paths are derived with a single CKD step from a cached parent node (e.g. the "0" or "1" subchain).
+
+        :param key: the account key
+        :type key: BIP32Node
+        :param int key_index: index of the key in this account, used to key the node cache
+        :param str path: the derivation path relative to the account key (e.g. "0/123")
+        :rtype: BIP32Node
+        """
+        parent_path, _, child = path.rpartition('/')
+        if not parent_path or child[-1] in "'pH":
+            return key.subkey_for_path(path + ".pub")
+        n = int(child)
+        return public_subkeys(self._node_for_path(key, key_index, parent_path), n, n + 1)[0]
+
+    def _node_for_path(self, key, key_index, path):
+        """The cached public node for an intermediate path, such as a subchain"""
+        node = self._nodes.get((key_index, path))
+        if node is None:
+            node = self._public_subkey(key, key_index, path)
+            self._nodes[(key_index, path)] = node
+        return node
+
+    def derive_range(self, subchain, start, stop):
+        """
+        Derive a contiguous range of leaves in one batch.  Much faster than calling :meth:`address` in a loop.
+
+        :param subchain: the subchain - 0 (receive), 1 (change) or a longer parent path such as "0/0"
+        :param int start: first leaf number
+        :param int stop: leaf number to stop at (exclusive)
+        :rtype: LeafRange
+        """
+        raise NotImplementedError()
+
     def set_lookahead(self, lookahead):
         """Set the lookahead for looking for spendables"""
         object.__setattr__(self, 'lookahead', lookahead)
+        if self.address_map:
+            self._update_address_map()
+
+    def _update_address_map(self):
+        """
+        Extend the address index (:attr:`address_map`) and the output script index to cover the issued keys plus
+        the lookahead.  Only leaves beyond the already indexed ones are processed.  Leaves in the key cache are not
+        derived again.
+        """
+        with self._lock:
+            for subchain in self._addresses:
+                self._index_leaves(subchain, self._cache['issued'][subchain] + self.lookahead)
+
+    def _index_leaves(self, subchain, stop):
+        """Extend the address and output script indexes of a subchain up to leaf stop (exclusive)"""
+        addresses = self._addresses[subchain]
+        for start, end, cached in self._leaf_runs(subchain, len(addresses), stop):
+            if cached:
+                address_prefix = self._address_prefix()
+                paths = ["%s/%d" % (subchain, n) for n in range(start, end)]
+                hash160s = [self._leaf_hash160(path) for path in paths]
+                new_addresses = [encoding.hash160_sec_to_bitcoin_address(hash160, address_prefix=address_prefix)
+                                 for hash160 in hash160s]
+                scripts = [self._output_script(hash160) for hash160 in hash160s]
+            else:
+                leaves = self.derive_range(subchain, start, end)
+                paths = leaves.paths()
+                new_addresses = leaves.addresses
+                scripts = leaves.scripts
+            addresses.extend(new_addresses)
+            self.address_map.update(zip(new_addresses, paths))
+            self._script_map.update(zip(scripts, paths))
+
+    def _cached_secs(self, path):
+        """The public keys of a cached leaf, one per account key.  Does not decode leaves of a binary cache."""
+        keys_cache = self._cache['keys']
+        if isinstance(keys_cache, keycache.LazyKeys):
+            return keys_cache.secs(path)
+        entry = keys_cache[path]
+        return [key.sec() for key in (entry if isinstance(entry, list) else [entry])]
+
+    def _leaf_hash160(self, path):
+        """The hash160 paid to by the output script of a leaf"""
+        raise NotImplementedError()
+
+    def _output_script(self, hash160):
+        """The output script (scriptPubKey) paying to a leaf hash160"""
+        raise NotImplementedError()
+
+    def _address_prefix(self):
+        raise NotImplementedError()
+
+    def _leaf_runs(self, subchain, start, stop, max_length=None):
+        """Split leaves start..stop-1 into runs of leaves that are all cached or all uncached.
+
+        :return: iterator of (start, stop, cached)
+        """
+        keys_cache = self._cache['keys']
+        n = start
+        while n < stop:
+            run_start = n
+            cached = "%s/%d" % (subchain, n) in keys_cache
+            n += 1
+            while n < stop and ("%s/%d" % (subchain, n) in keys_cache) == cached and \
+                    (max_length is None or n - run_start < max_length):
+                n += 1
+            yield run_start, n, cached
+
+    def _watched_addresses(self):
+        """The indexed addresses within the issued keys plus the lookahead"""
+        addresses = []
+        for subchain in ('0', '1'):
+            addresses.extend(self._addresses[subchain][0:self._cache['issued'][subchain] + self.lookahead])
+        return addresses
 
     @property
     def cache(self):
@@ -190,9 +477,18 @@ class Account(object):
         def encode_key(obj):
             if isinstance(obj, BIP32Node):
                 return {'hwif': obj.hwif()}
+            if isinstance(obj, keycache.LazyKeys):
+                return dict(obj.items())
             raise TypeError()
         return json.dumps(self._cache, default=encode_key)
 
+    @property
+    def binary_cache(self):
+        """The cache in a compact binary format, see :mod:`multisigcore.keycache`.
+        Much smaller and faster to load than the JSON cache, and can be passed to the constructor in its place.
+        """
+        return keycache.dumps(self._cache, self.netcode)
+
     def address(self, n, change=False):
         """
         The address of leaf key n in either the public subchain or the change subchain
@@ -225,38 +521,215 @@ class Account(object):
         addresses.extend([self.address(n, True) for n in range(0, self.num_int_keys + lookahead)])
         return addresses
 
-    def make_address_map(self, do_lookahead=False):
+    def make_address_map(self, do_lookahead=False, executor=None, chunk_size=1000):
         """
         A map of addresses to derivation path
+
+        Leaves that are not in the key cache yet can be derived in parallel by passing a
+        concurrent.futures.ProcessPoolExecutor.  Only the public account keys are sent to the workers, and
+        the derived keys are merged back into the key cache.
+
         :param do_lookahead: whether to look ahead beyond our last issued address
+        :param executor: optional executor for deriving uncached leaves in parallel
+        :type executor: concurrent.futures.Executor
+        :param int chunk_size: number of leaves derived by each parallel task
         :return: map of addresses to sub-paths
         :rtype: dict[str, str]
         """
         lookahead = self.lookahead if do_lookahead else 0
-        address_map = {self.address(n, False): "0/%d"%(n,) for n in range(0, self.num_ext_keys + lookahead)}
-        address_map.update({self.address(n, True): "1/%d"%(n,) for n in range(0, self.num_int_keys + lookahead)})
+        counts = (('0', self.num_ext_keys + lookahead), ('1', self.num_int_keys + lookahead))
+        address_map = {}
+        derived = set()
+        if executor is not None:
+            for leaves in self._derive_parallel(executor, counts, chunk_size):
+                paths = leaves.paths()
+                address_map.update(zip(leaves.addresses, paths))
+                derived.update(paths)
+        for subchain, count in counts:
+            change = subchain == '1'
+            for n in range(0, count):
+                path = "%s/%d" % (subchain, n)
+                if path not in derived:
+                    address_map[self.address(n, change)] = path
         return address_map
 
+    def _derive_parallel(self, executor, counts, chunk_size):
+        """Derive uncached leaves on the executor, merge them into the key cache and yield LeafRange objects"""
+        state = self._public_state()
+        keys_cache = self._cache['keys']
+        futures = []
+        for subchain, count in counts:
+            for start, stop, cached in self._leaf_runs(subchain, 0, count, chunk_size):
+                if not cached:
+                    futures.append(executor.submit(_derive_range_worker, state, subchain, start, stop))
+        for future in futures:
+            leaves, leaf_keys = future.result()
+            parents = [self._node_for_path(key, i, leaves.subchain) for i, key in enumerate(self._account_keys())]
+            for n, parts in zip(range(leaves.start, leaves.stop), leaf_keys):
+                subkeys = [subkey_from_parts(parent, n, chain_code, sec)
+                           for parent, (chain_code, sec) in zip(parents, parts)]
+                keys_cache.setdefault(leaves.path(n), self._cache_entry(subkeys))
+            yield leaves
+
+    def _account_keys(self):
+        """The account keys leaves are derived from, in node cache order"""
+        raise NotImplementedError()
+
+    def _cache_entry(self, subkeys):
+        """The key cache entry for a leaf, given its subkey for each account key"""
+        raise NotImplementedError()
+
+    def _public_state(self):
+        """A picklable description of the public part of this account, see :func:`_derive_range_worker`"""
+        raise NotImplementedError()
+
     def spendables(self):
         """
-        A list of Spendables - unspent transaction outputs
+        A list of Spendables - unspent transaction outputs.
+        The address index is extended incrementally, so a warm account does not derive any keys here.
         :return: dict of spendables for our addresses
         """
-        self.address_map = self.make_address_map(True)
+        self._update_address_map()
+        addresses = self._watched_addresses()
+        if self._utxo_store is None:
+            return self._spendables_for_addresses(addresses)
+        self._sync_store(addresses)
+        return self._utxo_store.spendables([self.address_map[addr] for addr in addresses])
+
+    @property
+    def utxo_store(self):
+        """:rtype: multisigcore.utxostore.UtxoStore"""
+        return self._utxo_store
+
+    def attach_utxo_store(self, store):
+        """
+        Keep our spendables in a local store.  spendables, balance and tx then only query the provider for
+        addresses that were never synced, were synced more than the store's max_age ago, or were marked stale, see
+        :meth:`sync`.
+
+        :type store: multisigcore.utxostore.UtxoStore
+        """
+        self._utxo_store = store
+
+    @property
+    def reservations(self):
+        """:rtype: multisigcore.reservation.Reservations"""
+        return self._reservations
+
+    def attach_reservations(self, reservations):
+        """
+        Reserve the spendables selected by :meth:`tx`, so that transactions can be built concurrently from several
+        threads without spending the same outputs.  Call :meth:`commit_tx` once a transaction is broadcast, or
+        :meth:`release_tx` if it is abandoned.
+
+        :type reservations: multisigcore.reservation.Reservations
+        """
+        self._reservations = reservations
+
+    @property
+    def private_cache(self):
+        """:rtype: multisigcore.privatecache.PrivateNodeCache"""
+        return self._private_cache
+
+    def attach_private_cache(self, cache):
+        """
+        Keep the private subchain nodes used for signing in a bounded cache, so that each input key is derived
+        with a single step.  Without a cache, subchain nodes are derived again for each signing call.
+
+        :type cache: multisigcore.privatecache.PrivateNodeCache
+        """
+        self._private_cache = cache
+
+    def commit_tx(self, tx):
+        """
+        Record that a transaction built by :meth:`tx` was broadcast.  Its outputs are marked spent in the UTXO
+        store and the reservations, if attached.
+
+        :type tx: AccountTx
+        """
+        if self._reservations is not None:
+            self._reservations.commit(tx)
+        if self._utxo_store is not None:
+            self._utxo_store.mark_spent(tx)
+
+    def release_tx(self, tx):
+        """
+        Make the outputs spent by an abandoned transaction built by :meth:`tx` available again.
+
+        :type tx: AccountTx
+        """
+        if self._reservations is not None:
+            self._reservations.release(tx)
+        if self._utxo_store is not None:
+            self._utxo_store.mark_spent(tx, False)
+
+    def sync(self, full=False):
+        """
+        Refresh the UTXO store from the provider for stale and expired addresses.
+
+        :param full: refresh all watched addresses
+        """
+        self._update_address_map()
+        self._sync_store(self._watched_addresses(), full)
+
+    def _sync_store(self, addresses, full=False):
+        store = self._utxo_store
+        if not full:
+            stale = set(store.stale_paths([self.address_map[addr] for addr in addresses]))
+            addresses = [addr for addr in addresses if self.address_map[addr] in stale]
+        if addresses:
+            spendables = self._spendables_for_addresses(addresses)
+            store.update([self.address_map[addr] for addr in addresses],
+                         [(self._path_for_spend(spend), spend) for spend in spendables])
+
+    def _spendables_for_addresses(self, addresses):
         spendables = None
         if isinstance(self._provider, BatchService):
             provider = self._provider
             """:type: BatchService"""
-            spendables = provider.spendables_for_addresses(self.address_map.keys())
+            spendables = provider.spendables_for_addresses(addresses)
         else:
             spendables = []
-            for addr in self.address_map.keys():
+            for addr in addresses:
                 spends = self._provider.spendables_for_address(addr)
                 if spends:
                     spendables.extend(spends)
 
         return spendables
 
+    def discover(self, gap_limit=LOOKAHEAD, batch_size=None):
+        """
+        Scan the receive and change subchains for spendables, for account recovery.
+
+        Addresses are derived and queried in batches until gap_limit consecutive addresses have no spendables,
+        and the issued counters are advanced past the last address found with spendables, so that the current
+        addresses are unused.  The cost is proportional to the actual usage of the account.
+        Note that providers only report unspent outputs, so an address whose outputs were all spent counts as unused.
+
+        :param int gap_limit: number of consecutive unused addresses after which to stop scanning a subchain
+        :param int batch_size: number of addresses to query at once, defaults to gap_limit
+        :return: the spendables found
+        :rtype: list[pycoin.tx.Spendable.Spendable]
+        """
+        batch_size = batch_size or gap_limit
+        spendables = []
+        for subchain in ('0', '1'):
+            addresses = self._addresses[subchain]
+            last_used = -1
+            n = 0
+            while n - last_used - 1 < gap_limit:
+                self._index_leaves(subchain, n + batch_size)
+                found = self._spendables_for_addresses(addresses[n:n + batch_size])
+                for spend in found:
+                    path = self._script_map.get(spend.script)
+                    if path is not None and path.startswith(subchain + '/'):
+                        last_used = max(last_used, int(path[len(subchain) + 1:]))
+                spendables.extend(found)
+                n += batch_size
+                if self._cache['issued'][subchain] < last_used + 2:
+                    self._cache['issued'][subchain] = last_used + 2
+        return spendables
+
     def balance(self):
         """Total balance in spendables for our keys"""
         spendables = self.spendables()
@@ -275,16 +748,69 @@ class Account(object):
         addr = script.info(self.netcode)['address']
         return addr
 
+    def _path_for_spend(self, spend):
+        path = self._script_map.get(spend.script)
+        if path is None:
+            path = self.path_for_check(self.address_from_spend(spend))
+        return path
+
     def add_spend(self, spend, spendables, txs_in):
-        addr = self.address_from_spend(spend)
+        path = self._path_for_spend(spend)
         spendables.append(spend)
-        txs_in.append(AccountTxIn(spend.tx_hash, spend.tx_out_index, script=b'', sequence=4294967295, path=self.path_for_check(addr)))
+        txs_in.append(AccountTxIn(spend.tx_hash, spend.tx_out_index, script=b'', sequence=4294967295, path=path))
 
-    def tx(self, payables, change_address=None):
+    def input_size(self):
+        """The size of a signed input spending from this account"""
+        raise NotImplementedError()
+
+    def estimate_size(self, tx):
+        """
+        The size of a transaction once the inputs are signed, without serializing it.
+
+        :type tx: AccountTx
+        :rtype: int
+        """
+        return txsize.tx_size([self.input_size()] * len(tx.txs_in),
+                              [txsize.output_size(len(tx_out.script)) for tx_out in tx.txs_out])
+
+    def recommended_fee(self, tx, fee_per_byte=None):
+        """
+        The fee for a transaction once its inputs are signed.
+
+        :type tx: AccountTx
+        :param fee_per_byte: fee rate in satoshis per byte, by default TX_FEE_PER_THOUSAND_BYTES per started kB
+        :rtype: int
+        """
+        size = self.estimate_size(tx)
+        if fee_per_byte is not None:
+            return txsize.fee_for_size(size, fee_per_byte)
+        return TX_FEE_PER_THOUSAND_BYTES * ((999 + size) // 1000)
+
+    def fee_model(self, txs_out, change_script, fee_per_byte=None):
+        """
+        The fee of a transaction with these outputs, as a function of the number of inputs.
+
+        :param list[TxOut] txs_out: the payment outputs
+        :param bytes change_script: the script of a change output
+        :param fee_per_byte: fee rate in satoshis per byte, by default TX_FEE_PER_THOUSAND_BYTES per started kB
+        :rtype: FeeModel
+        """
+        return FeeModel([txsize.output_size(len(tx_out.script)) for tx_out in txs_out], self.input_size(),
+                        txsize.output_size(len(change_script)),
+                        fee_per_kb=TX_FEE_PER_THOUSAND_BYTES, dust=DUST, fee_per_byte=fee_per_byte)
+
+    def tx(self, payables, change_address=None, selector=None, fee_per_byte=None):
         """
         Construct a transaction with available spendables
         :param list[(str, int)] payables: tuple of address and amount
+        :param selector: coin selection strategy, by default spendables are used in provider order
+        :type selector: multisigcore.coinselection.CoinSelector
+        :param fee_per_byte: fee rate in satoshis per byte, by default TX_FEE_PER_THOUSAND_BYTES per started kB
         :return Tx or None: the transaction or None if not enough balance
+
+        If reservations are attached, the spendables used are reserved.  Otherwise, if a UTXO store is attached,
+        they are marked spent in it.  Call :meth:`commit_tx` once the transaction is broadcast, or :meth:`release_tx`
+        if it is abandoned.
         """
         all_spendables = self.spendables()
 
@@ -297,40 +823,219 @@ class Account(object):
             script = standard_tx_out_script(address)
             txs_out.append(TxOut(coin_value, script))
 
+        if change_address:
+            change_path = None
+            change_script = standard_tx_out_script(change_address)
+        else:
+            change_path = "1/%d" % (self.num_int_keys - 1,)
+            change_script = self._output_script(self._leaf_hash160(change_path))
+        fee_model = self.fee_model(txs_out, change_script, fee_per_byte)
+
+        def select(available):
+            return (selector or InOrderSelector()).select(available, send_amount, fee_model)
+        if self._reservations is None:
+            available, selected = all_spendables, select(all_spendables)
+        else:
+            available, selected = self._reservations.reserve(all_spendables, select)
+        if selected is None:
+            raise InsufficientBalanceException(sum(spend.coin_value for spend in available))
+
+        try:
+            tx = self._assemble_tx(selected, txs_out, send_amount, fee_model, change_script, change_path)
+        except Exception:
+            if self._reservations is not None:
+                self._reservations.cancel(selected)
+            raise
+
+        if self._reservations is None and self._utxo_store is not None:
+            self._utxo_store.mark_spent(tx)
+        return tx
+
+    def _assemble_tx(self, selected, txs_out, send_amount, fee_model, change_script, change_path):
+        """
+        Build a transaction spending the selected spendables, adding a change output if the excess is above dust.
+
+        :param change_path: the path of the change output, or None to look it up from change_script
+        :rtype: AccountTx
+        """
         total = 0
         txs_in = []
         spendables = []
-        while total < send_amount and all_spendables:
-            spend = all_spendables.pop(0)
-            self.add_spend(spend, spendables, txs_in)
-            total += spend.coin_value
-
-        tx_for_fee = Tx(txs_in=txs_in, txs_out=txs_out, version=DEFAULT_VERSION, unspents=spendables)
-        fee = recommended_fee_for_tx(tx_for_fee)
-
-        while total < send_amount + fee and all_spendables:
-            spend = all_spendables.pop(0)
+        for spend in selected:
             self.add_spend(spend, spendables, txs_in)
             total += spend.coin_value
 
+        fee = fee_model.fee(len(txs_in), True)
         if total > send_amount + fee + DUST:
-            addr = change_address or self.current_change_address()
-            script = standard_tx_out_script(addr)
-            txs_out.append(AccountTxOut(total - send_amount - fee, script, self.path_for_check(addr)))
-        elif total < send_amount + fee:
-            raise InsufficientBalanceException(total)
+            if change_path is None:
+                change_path = self.path_for_script(change_script)
+            txs_out = txs_out + [AccountTxOut(total - send_amount - fee, change_script, change_path)]
 
         # check total >= amount + fee
-        tx = AccountTx(version=DEFAULT_VERSION, txs_in=txs_in, txs_out=txs_out, unspents=spendables)
-        return tx
+        return AccountTx(version=DEFAULT_VERSION, txs_in=txs_in, txs_out=txs_out, unspents=spendables)
+
+    def tx_batch(self, payables, max_outputs=1000, max_size=100000, selector=None, fee_per_byte=None):
+        """
+        Construct transactions paying many payables, e.g. for a payout run.
 
-    def sign(self, tx):
+        The payables are split into transactions of at most max_outputs outputs, including change, and transactions
+        estimated to exceed max_size once signed are split further.  Spendables are assigned to the transactions in
+        one pass, so that no two transactions spend the same output, and each transaction with change gets its own
+        change address, starting from the current change address.  The change addresses are issued in bulk once all
+        the transactions are built, leaving the one after the last used as the current change address.
+
+        :param list[(str, int)] payables: tuple of address and amount
+        :param int max_outputs: maximum number of outputs of a transaction
+        :param int max_size: maximum estimated size of a signed transaction, None for no limit
+        :param selector: coin selection strategy, by default spendables are used in provider order
+        :type selector: multisigcore.coinselection.CoinSelector
+        :param fee_per_byte: fee rate in satoshis per byte, by default TX_FEE_PER_THOUSAND_BYTES per started kB
+        :return: the transactions, in the order of the payables
+        :rtype: list[AccountTx]
+        :raise InsufficientBalanceException: if the spendables do not cover all the payables
+        """
+        if max_outputs < 2:
+            raise ValueError("max_outputs must allow for a payment and change")
+        all_spendables = self.spendables()
+        selector = selector or InOrderSelector()
+        # all change scripts of an account have the same size
+        template_change_script = self._output_script(self._leaf_hash160("1/%d" % (self.num_int_keys - 1,)))
+        chunks = [payables[i:i + max_outputs - 1] for i in range(0, len(payables), max_outputs - 1)]
+        chunks.reverse()
+        plans = []
+
+        def select_all(available):
+            del plans[:]
+            pool = available
+            pending = list(chunks)
+            while pending:
+                chunk = pending.pop()
+                txs_out = [TxOut(coin_value, standard_tx_out_script(address)) for address, coin_value in chunk]
+                send_amount = sum(coin_value for _, coin_value in chunk)
+                fee_model = self.fee_model(txs_out, template_change_script, fee_per_byte)
+                selected = selector.select(pool, send_amount, fee_model)
+                if selected is None:
+                    raise InsufficientBalanceException(sum(spend.coin_value for spend in pool))
+                total = sum(spend.coin_value for spend in selected)
+                with_change = total > send_amount + fee_model.fee(len(selected), True) + DUST
+                if max_size is not None and fee_model.size(len(selected), with_change) > max_size:
+                    if len(chunk) == 1:
+                        raise ValueError("cannot pay %s within %d bytes" % (chunk[0][0], max_size))
+                    pending.append(chunk[len(chunk) // 2:])
+                    pending.append(chunk[:len(chunk) // 2])
+                    continue
+                used = set(id(spend) for spend in selected)
+                pool = [spend for spend in pool if id(spend) not in used]
+                plans.append((selected, txs_out, send_amount, fee_model, with_change))
+            return [spend for plan in plans for spend in plan[0]]
+
+        if self._reservations is None:
+            selected = select_all(all_spendables)
+        else:
+            _, selected = self._reservations.reserve(all_spendables, select_all)
+
+        try:
+            with self._lock:
+                next_change = self.num_int_keys - 1
+                txs = []
+                for selected_spends, txs_out, send_amount, fee_model, with_change in plans:
+                    if with_change:
+                        change_path = "1/%d" % (next_change,)
+                        next_change += 1
+                    else:
+                        change_path = "1/%d" % (self.num_int_keys - 1,)
+                    change_script = self._output_script(self._leaf_hash160(change_path))
+                    txs.append(self._assemble_tx(selected_spends, txs_out, send_amount, fee_model, change_script,
+                                                 change_path))
+                self.next_change_addresses(next_change - (self.num_int_keys - 1))
+        except Exception:
+            if self._reservations is not None:
+                self._reservations.cancel(selected)
+            raise
+
+        if self._reservations is None and self._utxo_store is not None:
+            for tx in txs:
+                self._utxo_store.mark_spent(tx)
+        return txs
+
+    def sign(self, tx, executor=None):
         """Sign a previously constructed transaction
         :type tx: Tx
+        :param executor: optional executor for computing signatures in parallel, e.g. a ProcessPoolExecutor
         """
         keys = self.keys_for_tx(tx)
 
-        multisigcore.local_sign(tx, self.collect_redeem_scripts(tx), keys)
+        multisigcore.local_sign(tx, self.collect_redeem_scripts(tx), keys, executor=executor)
+
+    def sign_many(self, txs, executor=None):
+        """
+        Sign previously constructed transactions, deriving the private key and redeem script of each input path
+        once for the whole batch.
+
+        :type txs: list[AccountTx]
+        :param executor: optional executor for computing signatures in parallel, e.g. a ProcessPoolExecutor
+        :rtype: list[AccountTx]
+        """
+        key_lookup, p2sh_lookup = self.signing_lookups(txs)
+        if not key_lookup:
+            return txs
+        if executor is not None:
+            return sign_parallel_many(txs, key_lookup, p2sh_lookup, executor=executor)
+        for tx in txs:
+            tx.sign(key_lookup, p2sh_lookup=p2sh_lookup)
+        return txs
+
+    def signing_lookups(self, txs):
+        """
+        The private keys and redeem scripts for the union of the input paths of transactions.
+
+        :type txs: list[AccountTx]
+        :return: a key lookup and a P2SH lookup (or None), reusable for signing any transaction spending from
+            these paths
+        :rtype: (multisigcore.signing.KeyLookup, dict)
+        """
+        paths = sorted(set(tin.path for tx in txs for tin in tx.txs_in if tin.path))
+        key_lookup = KeyLookup(self.private_keys_for_paths(paths))
+        scripts = self.redeem_scripts_for_paths(paths)
+        p2sh_lookup = build_p2sh_lookup([script.script() for script in scripts]) if scripts else None
+        return key_lookup, p2sh_lookup
+
+    def private_keys_for_paths(self, paths):
+        """
+        The private keys of leaf paths.  Each subchain node is derived once, or taken from the private node cache
+        if attached.  Private keys are not memoized on the account key.
+
+        :param list[str] paths: leaf paths, such as "1/5"
+        :rtype: list[pycoin.key.Key]
+        """
+        key = self._signing_key()
+        cache = self._private_cache
+        nodes = {}
+        result = []
+        for path in paths:
+            chain, _, index = path.rpartition('/')
+            node = nodes.get(chain)
+            if node is None:
+                if not chain:
+                    node = key
+                elif cache is not None:
+                    node = cache.node_for_path(key, chain)
+                else:
+                    node = private_subkey_for_path(key, chain)
+                nodes[chain] = node
+            result.append(private_subkey_for_path(node, index))
+        return result
+
+    def redeem_scripts_for_paths(self, paths):
+        """
+        :param list[str] paths: leaf paths
+        :rtype: list[ScriptMultisig] or None
+        """
+        return None
+
+    def _signing_key(self):
+        """The private key that leaf signing keys are derived from"""
+        raise NotImplementedError()
 
     def current_address(self):
         """
@@ -347,12 +1052,31 @@ class Account(object):
         return self.address(self.num_int_keys - 1, True)
 
     def next_address(self):
-        self._cache['issued']['0'] += 1
-        return self.current_address()
+        with self._lock:
+            self._cache['issued']['0'] += 1
+            if self.address_map:
+                self._update_address_map()
+            return self.current_address()
 
     def next_change_address(self):
-        self._cache['issued']['1'] += 1
-        return self.current_change_address()
+        with self._lock:
+            self._cache['issued']['1'] += 1
+            if self.address_map:
+                self._update_address_map()
+            return self.current_change_address()
+
+    def next_change_addresses(self, count):
+        """
+        Issue count change addresses at once.
+
+        :return: the new change addresses
+        :rtype: list[str]
+        """
+        with self._lock:
+            self._cache['issued']['1'] += count
+            if self.address_map:
+                self._update_address_map()
+            return [self.address(n, True) for n in range(self.num_int_keys - count, self.num_int_keys)]
 
     def path_for(self, addr):
         """
@@ -374,13 +1098,27 @@ class Account(object):
             raise ValueError("unknown address %s"%(addr,))
         return path
 
+    def path_for_script(self, script):
+        """
+        :param bytes script: an output script (scriptPubKey)
+        :return: sub-path (e.g. "0/123" or "1/456")
+        :rtype: str
+        :raise: if the script does not pay to an indexed address
+        """
+        path = self._script_map.get(script)
+        if path is None:
+            raise ValueError("unknown script %s" % (b2h(script),))
+        return path
+
     def keys_for_tx(self, tx):
         """
         A list of private keys, matching each input
         :type tx: Tx
         :return: list[pycoin.key.Key]
         """
-        raise NotImplementedError()
+        paths = [tin.path for tin in tx.txs_in if tin and tin.path]
+        keys = iter(self.private_keys_for_paths(paths))
+        return [next(keys) if tin and tin.path else None for tin in tx.txs_in]
 
     def collect_redeem_scripts(self, tx):
         """
@@ -396,13 +1134,14 @@ class Account(object):
         :return: whether any addresses were rotated due to incoming coins
         :rtype: bool
         """
-        scripts = [o.script for o in tx.txs_out]
+        self._update_address_map()
+        paths = set(self._script_map.get(o.script) for o in tx.txs_out)
         rotated = False
-        while standard_tx_out_script(self.current_address()) in scripts:
+        while "0/%d" % (self.num_ext_keys - 1,) in paths:
             self.next_address()
             rotated = True
 
-        while standard_tx_out_script(self.current_change_address()) in scripts:
+        while "1/%d" % (self.num_int_keys - 1,) in paths:
             self.next_change_address()
             rotated = True
         return rotated
@@ -414,31 +1153,71 @@ class SimpleAccount(Account):
     def __init__(self, key, cache=None):
         """
         :type key: AccountKey
-        :param str cache: JSON formatted cache
+        :param cache: JSON formatted or binary cache
         """
         super(SimpleAccount, self).__init__(key._netcode, cache)
         self._key = key
 
+    @classmethod
+    def _from_public_state(cls, xpubs):
+        return cls(AccountKey.from_key(xpubs[0]))
+
+    def _public_state(self):
+        return self.__class__, [self._key.hwif(as_private=False)], {}
+
+    def _account_keys(self):
+        return [self._key]
+
+    def _cache_entry(self, subkeys):
+        return subkeys[0]
+
     def address(self, n, change=False):
         subchain_index = '1' if change else '0'
         path = "%s/%s" % (subchain_index, n)
+        return encoding.hash160_sec_to_bitcoin_address(self._leaf_hash160(path), address_prefix=self._address_prefix())
+
+    def _subkey_for_path(self, path):
         if path not in self._cache['keys']:
-            self._cache['keys'][path] = self._key.subkey_for_path(path + ".pub")
-        return self._cache['keys'][path].address()
+            self._cache['keys'][path] = self._public_subkey(self._key, 0, path)
+        return self._cache['keys'][path]
 
-    def keys_for_tx(self, tx):
-        result = []
-        for tin in tx.txs_in:
-            if tin and tin.path:
-                # we only cache public keys - derive the private key
-                result.append(self._key.subkey_for_path(tin.path))
-            else:
-                result.append(None)
-        return result
+    def _leaf_hash160(self, path):
+        if path not in self._cache['keys']:
+            self._subkey_for_path(path)
+        return encoding.hash160(self._cached_secs(path)[0])
+
+    def _output_script(self, hash160):
+        return b'\x76\xa9\x14' + hash160 + b'\x88\xac'
+
+    def _address_prefix(self):
+        return address_prefix_for_netcode(self.netcode)
+
+    def input_size(self):
+        return txsize.p2pkh_input_size()
+
+    def derive_range(self, subchain, start, stop):
+        subchain = str(subchain)
+        subkeys = public_subkeys(self._node_for_path(self._key, 0, subchain), start, stop)
+        keys_cache = self._cache['keys']
+        address_prefix = self._address_prefix()
+        hash160s = []
+        scripts = []
+        addresses = []
+        for n, subkey in zip(range(start, stop), subkeys):
+            keys_cache.setdefault("%s/%d" % (subchain, n), subkey)
+            hash160 = encoding.hash160(subkey.sec())
+            hash160s.append(hash160)
+            scripts.append(self._output_script(hash160))
+            addresses.append(encoding.hash160_sec_to_bitcoin_address(hash160, address_prefix=address_prefix))
+        return LeafRange(subchain, start, stop, b''.join(hash160s), scripts, addresses)
+
+    def _signing_key(self):
+        return self._key
 
 
 class MultisigAccount(Account):
-    def __init__(self, keys, num_sigs=None, sort=True, complete=True, netcode='BTC', cache=None):
+    def __init__(self, keys, num_sigs=None, sort=True, complete=True, netcode='BTC', cache=None,
+                 script_cache_size=10000):
         """
         Create a multisig account with multiple participating keys
 
@@ -446,6 +1225,7 @@ class MultisigAccount(Account):
         :type keys: list[BIP32Node]
         :param num_sigs: number of required signatures
         :param complete: whether we need additional keys to complete the configuration of this account
+        :param script_cache_size: maximum number of paths to keep redeem scripts and their hash for, None for no limit
         """
         super(MultisigAccount, self).__init__(netcode, cache)
         self._keys = keys
@@ -455,11 +1235,34 @@ class MultisigAccount(Account):
         self._complete = complete
         self._sort = sort
         self._oracles = []
+        self._scripts = LRUCache(script_cache_size)
+
+    @classmethod
+    def _from_public_state(cls, xpubs, num_sigs, sort, netcode):
+        return cls([AccountKey.from_key(xpub) for xpub in xpubs], num_sigs=num_sigs, sort=sort, netcode=netcode)
+
+    def _public_state(self):
+        if not self._complete:
+            raise Exception("account not complete")
+        return (self.__class__, [key.hwif(as_private=False) for key in self._keys],
+                {'num_sigs': self._num_sigs, 'sort': self._sort, 'netcode': self.netcode})
+
+    def _account_keys(self):
+        return self._keys
+
+    def _cache_entry(self, subkeys):
+        return subkeys
 
     @property
     def complete(self):
         return self._complete
 
+    @property
+    def script_cache(self):
+        """The per-path cache of redeem scripts and their hash160, see LRUCache.stats for hit/miss counters
+        :rtype: LRUCache"""
+        return self._scripts
+
     @property
     def public_keys(self):
         return self._public_keys
@@ -507,18 +1310,64 @@ class MultisigAccount(Account):
         :return: the script
         :rtype: ScriptMultisig
         """
+        return self._script_entry(path)[0]
+
+    def _script_entry(self, path):
+        """The redeem script for the path and its hash160, memoized per path under the account lock"""
+        with self._lock:
+            entry = self._scripts.get(path)
+            if entry is None:
+                if not self._complete:
+                    raise Exception("account not complete")
+                if path not in self._cache['keys']:
+                    self._cache['keys'][path] =\
+                        [self._public_subkey(key, i, path) for i, key in enumerate(self.keys)]
+
+                secs = self._cached_secs(path)
+                if self._sort:
+                    secs.sort()
+                script = ScriptMultisig(self._num_sigs, secs)
+                entry = (script, encoding.hash160(script.script()))
+                self._scripts.put(path, entry)
+            return entry
+
+    def derive_range(self, subchain, start, stop):
         if not self._complete:
             raise Exception("account not complete")
-        if path not in self._cache['keys']:
-            self._cache['keys'][path] =\
-                [key.subkey_for_path(path + ".pub") for key in self.keys]
-
-        subkeys = self._cache['keys'][path]
-        secs = [key.sec() for key in subkeys]
-        if self._sort:
-            secs.sort()
-        script = ScriptMultisig(self._num_sigs, secs)
-        return script
+        subchain = str(subchain)
+        subkeys = [public_subkeys(self._node_for_path(key, i, subchain), start, stop)
+                   for i, key in enumerate(self.keys)]
+        keys_cache = self._cache['keys']
+        address_prefix = self._address_prefix()
+        hash160s = []
+        scripts = []
+        redeem_scripts = []
+        addresses = []
+        for n, leaf_keys in zip(range(start, stop), zip(*subkeys)):
+            keys_cache.setdefault("%s/%d" % (subchain, n), list(leaf_keys))
+            secs = [key.sec() for key in leaf_keys]
+            if self._sort:
+                secs.sort()
+            redeem_script = multisig_script(self._num_sigs, secs)
+            hash160 = encoding.hash160(redeem_script)
+            redeem_scripts.append(redeem_script)
+            hash160s.append(hash160)
+            scripts.append(self._output_script(hash160))
+            addresses.append(encoding.hash160_sec_to_bitcoin_address(hash160, address_prefix=address_prefix))
+        return LeafRange(subchain, start, stop, b''.join(hash160s), scripts, addresses, redeem_scripts)
+
+    def _leaf_hash160(self, path):
+        return self._script_entry(path)[1]
+
+    def _output_script(self, hash160):
+        return b'\xa9\x14' + hash160 + b'\x87'
+
+    def _address_prefix(self):
+        return pay_to_script_prefix_for_netcode(self.netcode)
+
+    def input_size(self):
+        # an incomplete account is still missing a key, e.g. from an oracle
+        return txsize.p2sh_multisig_input_size(self._num_sigs, len(self._keys) + (0 if self._complete else 1))
 
     def payto_for_path(self, path):
         """Get the payto script for the path.  See also :meth:`.script`
@@ -528,21 +1377,13 @@ class MultisigAccount(Account):
         :return: the script
         :rtype: LeafPayTo
         """
-        script = self.script_for_path(path)
-        payto = LeafPayTo(hash160=encoding.hash160(script.script()), path=path)
+        payto = LeafPayTo(hash160=self._script_entry(path)[1], path=path)
         return payto
 
-    def keys_for_tx(self, tx):
+    def _signing_key(self):
         if self._local_key is None:
             raise ValueError("no private key supplied - can't sign")
-        result = []
-        for tin in tx.txs_in:
-            if tin and tin.path:
-                # we only cache public keys - derive the private key
-                result.append(self._local_key.subkey_for_path(tin.path))
-            else:
-                result.append(None)
-        return result
+        return self._local_key
 
     def collect_redeem_scripts(self, tx):
         raw_scripts = []
@@ -551,8 +1392,98 @@ class MultisigAccount(Account):
                 raw_scripts.append(self.script_for_path(tin.path))
         return raw_scripts
 
+    def redeem_scripts_for_paths(self, paths):
+        return [self.script_for_path(path) for path in paths]
+
+    def verify_signatures(self, tx, input_chain_paths=None, executor=None):
+        """
+        Verify that the inputs of a transaction are fully signed for the redeem scripts of their paths, e.g. the
+        transaction returned by Oracle.sign.  See verification.verify_multisig_inputs.
+
+        :type tx: Tx
+        :param input_chain_paths: the path of each input, by default the paths of an AccountTx
+        :type input_chain_paths: list[str or None]
+        :param executor: optional executor to verify on, e.g. a ProcessPoolExecutor
+        :return: for each input, whether its signatures are valid, or None if it has no path
+        :rtype: list[bool or None]
+        """
+        if input_chain_paths is None:
+            input_chain_paths = [getattr(tin, 'path', None) for tin in tx.txs_in]
+        redeem_scripts = [self.script_for_path(path).script() if path else None for path in input_chain_paths]
+        return verify_multisig_inputs(tx, redeem_scripts, executor=executor)
+
 
 class LeafPayTo(ScriptPayToScript):
     def __init__(self, hash160, path):
         super(LeafPayTo, self).__init__(hash160)
         self.path = path
+
+
+def multisig_script(num_sigs, secs):
+    """
+    The raw bytes of an m of n multisig script, same as ScriptMultisig(num_sigs, secs).script()
+
+    :param int num_sigs: required signatures (m)
+    :param list[bytes] secs: the public keys in SEC format
+    :rtype: bytes
+    """
+    if not 0 < num_sigs <= len(secs) <= 16:
+        return ScriptMultisig(num_sigs, secs).script()
+    parts = [bytes_from_int(0x50 + num_sigs)]
+    for sec in secs:
+        parts.append(bytes_from_int(len(sec)))
+        parts.append(sec)
+    parts.append(bytes_from_int(0x50 + len(secs)))
+    parts.append(b'\xae')  # OP_CHECKMULTISIG
+    return b''.join(parts)
+
+
+def _derive_range_worker(state, subchain, start, stop):
+    """
+    Derive a range of leaves in a worker process, from the public account state only.
+
+    :return: the LeafRange and, for each leaf, a (chain code, sec) pair per account key
+    """
+    cls, xpubs, options = state
+    account = cls._from_public_state(xpubs, **options)
+    leaves = account.derive_range(subchain, start, stop)
+    keys_cache = account._cache['keys']
+    leaf_keys = []
+    for path in leaves.paths():
+        entry = keys_cache[path]
+        subkeys = entry if isinstance(entry, list) else [entry]
+        leaf_keys.append([(subkey.chain_code(), subkey.sec()) for subkey in subkeys])
+    return leaves, leaf_keys
+
+
+class LeafRange(object):
+    """A contiguous range of leaves of one subchain, as derived by :meth:`Account.derive_range`.
+
+    Hash160s are packed into one bytes object, 20 bytes per leaf.  Scripts are the output scripts (scriptPubKey),
+    redeem_scripts is only set for multisig accounts.
+    """
+    __slots__ = ['subchain', 'start', 'stop', 'hash160s', 'scripts', 'addresses', 'redeem_scripts']
+
+    def __init__(self, subchain, start, stop, hash160s, scripts, addresses, redeem_scripts=None):
+        self.subchain = subchain
+        self.start = start
+        self.stop = stop
+        self.hash160s = hash160s
+        self.scripts = scripts
+        self.addresses = addresses
+        self.redeem_scripts = redeem_scripts
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def path(self, n):
+        """The sub-path of leaf n (e.g. "0/123")"""
+        return "%s/%d" % (self.subchain, n)
+
+    def paths(self):
+        return [self.path(n) for n in range(self.start, self.stop)]
+
+    def hash160(self, n):
+        """The hash160 of leaf n"""
+        offset = (n - self.start) * 20
+        return self.hash160s[offset:offset + 20]
@@ -0,0 +1,373 @@
+"""
+Compact binary format for the account key cache.
+
+The JSON cache stores every cached node as a base58 hwif string.  The binary format stores only the chain code
+and the compressed public key of each leaf, packed per parent path (e.g. per subchain) with the depth and parent
+fingerprint shared by the group::
+
+    magic "MSKC", version (1 byte)
+    netcode, issued counters
+    number of keys per leaf, whether leaves are stored as lists (multisig)
+    groups: parent path, depth and parent fingerprint per key, leaf count
+        leaves sorted by child index: child index, then chain code and sec per key
+
+Leaf records have a fixed size, so a cache can also be used in place - see :class:`LazyKeys` and
+:func:`open_snapshot`, which map a snapshot file into memory and only decode leaves when they are accessed.
+Serializing a :class:`LazyKeys` copies the records of the leaves never decoded as they are.
+"""
+import mmap
+import os
+import struct
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+from pycoin.key.BIP32Node import BIP32Node
+
+from .buffers import slice_bytes
+from .derivation import public_pair_for_sec
+
+__author__ = 'devrandom'
+
+MAGIC = b'MSKC'
+VERSION = 1
+
+
+def is_binary_cache(blob):
+    return isinstance(blob, (bytes, bytearray, memoryview, mmap.mmap)) and slice_bytes(blob, 0, 4) == MAGIC
+
+
+def _pack_str(s):
+    data = s.encode('utf8')
+    return struct.pack(">H", len(data)) + data
+
+
+def _unpack_str(buf, offset):
+    length, = struct.unpack_from(">H", buf, offset)
+    offset += 2
+    return slice_bytes(buf, offset, offset + length).decode('utf8'), offset + length
+
+
+def encode_leaf(child_index, nodes):
+    """The leaf record of nodes"""
+    parts = [struct.pack(">L", child_index)]
+    for node in nodes:
+        parts.append(node.chain_code())
+        parts.append(node.sec())
+    return b''.join(parts)
+
+
+def leaf_records(keys):
+    """
+    The leaf records of a key cache, grouped by parent path.  The leaves of a :class:`LazyKeys` that were not
+    decoded are copied from its buffer.
+
+    :param keys: the key cache - path to node, or to a list of nodes (one per account key)
+    :return: whether entries are lists, the number of keys per leaf, and a dict of parent path to the
+        (depth, parent fingerprint) of each key and a list of (child index, leaf record) sorted by index
+    """
+    groups = {}
+    # the shape of the account - an empty cache does not record it
+    is_list, num_keys = False, 0
+    if isinstance(keys, LazyKeys):
+        for parent_path, parents, child_index, record in keys.undecoded_records():
+            is_list, num_keys = keys.is_list, keys.num_keys
+            groups.setdefault(parent_path, (parents, []))[1].append((child_index, record))
+        entries = keys.decoded_items()
+    else:
+        entries = keys.items()
+    for path, entry in entries:
+        is_list = isinstance(entry, list)
+        nodes = entry if is_list else [entry]
+        num_keys = len(nodes)
+        parent_path, _, child = path.rpartition('/')
+        parents = [(node.tree_depth(), node.parent_fingerprint()) for node in nodes]
+        groups.setdefault(parent_path, (parents, []))[1].append((int(child), encode_leaf(int(child), nodes)))
+    for _, leaves in groups.values():
+        leaves.sort(key=lambda leaf: leaf[0])
+    return is_list, num_keys, groups
+
+
+def dumps(cache, netcode):
+    """
+    Serialize an account cache to the binary format.
+
+    :param dict cache: the account cache, with 'issued' counters and 'keys'
+    :param str netcode: network code
+    :rtype: bytes
+    """
+    is_list, num_keys, groups = leaf_records(cache['keys'])
+    parts = [MAGIC, struct.pack(">B", VERSION), _pack_str(netcode)]
+    issued = sorted(cache['issued'].items())
+    parts.append(struct.pack(">H", len(issued)))
+    for subchain, count in issued:
+        parts.append(_pack_str(subchain))
+        parts.append(struct.pack(">L", count))
+    parts.append(struct.pack(">BBL", num_keys, 1 if is_list else 0, len(groups)))
+    for parent_path, (parents, leaves) in sorted(groups.items()):
+        parts.append(_pack_str(parent_path))
+        for depth, parent_fingerprint in parents:
+            parts.append(struct.pack(">B", depth) + parent_fingerprint)
+        parts.append(struct.pack(">L", len(leaves)))
+        parts.extend(record for _, record in leaves)
+    return b''.join(parts)
+
+
+def read_header(buf):
+    """
+    Parse the header of a binary cache.
+
+    :return: netcode, issued counters, number of keys per leaf, whether leaves are lists, group count and the
+        offset of the first group
+    """
+    if slice_bytes(buf, 0, 4) != MAGIC:
+        raise ValueError("not a binary key cache")
+    version, = struct.unpack_from(">B", buf, 4)
+    if version != VERSION:
+        raise ValueError("unsupported key cache version %d" % (version,))
+    netcode, offset = _unpack_str(buf, 5)
+    count, = struct.unpack_from(">H", buf, offset)
+    offset += 2
+    issued = {}
+    for _ in range(count):
+        subchain, offset = _unpack_str(buf, offset)
+        issued[subchain], = struct.unpack_from(">L", buf, offset)
+        offset += 4
+    num_keys, is_list, num_groups = struct.unpack_from(">BBL", buf, offset)
+    return netcode, issued, num_keys, bool(is_list), num_groups, offset + 6
+
+
+def read_group_header(buf, offset, num_keys):
+    """
+    Parse a group header.
+
+    :return: parent path, list of (depth, parent fingerprint) per key, leaf count and the offset of the first leaf
+    """
+    parent_path, offset = _unpack_str(buf, offset)
+    parents = []
+    for _ in range(num_keys):
+        depth, = struct.unpack_from(">B", buf, offset)
+        parents.append((depth, slice_bytes(buf, offset + 1, offset + 5)))
+        offset += 5
+    count, = struct.unpack_from(">L", buf, offset)
+    return parent_path, parents, count, offset + 4
+
+
+def leaf_size(num_keys):
+    """The size of a leaf record"""
+    return 4 + 65 * num_keys
+
+
+def decode_leaf(buf, offset, netcode, parents):
+    """
+    Decode the leaf record at offset.
+
+    :return: child index and one node per key
+    """
+    child_index, = struct.unpack_from(">L", buf, offset)
+    offset += 4
+    nodes = []
+    for depth, parent_fingerprint in parents:
+        chain_code = slice_bytes(buf, offset, offset + 32)
+        sec = slice_bytes(buf, offset + 32, offset + 65)
+        offset += 65
+        nodes.append(BIP32Node(netcode=netcode, chain_code=chain_code, depth=depth,
+                               parent_fingerprint=parent_fingerprint, child_index=child_index,
+                               public_pair=public_pair_for_sec(sec)))
+    return child_index, nodes
+
+
+def loads(blob):
+    """
+    Parse a binary cache.
+
+    :return: netcode and the account cache, with 'issued' counters and 'keys'
+    :rtype: (str, dict)
+    """
+    netcode, issued, num_keys, is_list, num_groups, offset = read_header(blob)
+    keys = {}
+    size = leaf_size(num_keys)
+    for _ in range(num_groups):
+        parent_path, parents, count, offset = read_group_header(blob, offset, num_keys)
+        prefix = parent_path + '/' if parent_path else ''
+        for _ in range(count):
+            child_index, nodes = decode_leaf(blob, offset, netcode, parents)
+            offset += size
+            keys["%s%d" % (prefix, child_index)] = nodes if is_list else nodes[0]
+    return netcode, {'keys': keys, 'issued': issued}
+
+
+def loads_lazy(buf):
+    """
+    Open a binary cache in place.  Only the header and group headers are parsed up front.
+
+    :param buf: bytes, or any buffer such as an mmap
+    :return: netcode and the account cache, with 'issued' counters and 'keys' as :class:`LazyKeys`
+    :rtype: (str, dict)
+    """
+    netcode, issued, num_keys, is_list, num_groups, offset = read_header(buf)
+    size = leaf_size(num_keys)
+    groups = {}
+    for _ in range(num_groups):
+        parent_path, parents, count, offset = read_group_header(buf, offset, num_keys)
+        groups[parent_path] = (parents, count, offset)
+        offset += count * size
+    return netcode, {'keys': LazyKeys(buf, netcode, num_keys, is_list, groups), 'issued': issued}
+
+
+class LazyKeys(MutableMapping):
+    """
+    A key cache backed by a binary cache buffer.  The shape of the leaves in the buffer (is_list, num_keys) is
+    that of the account if the buffer has any leaves - added entries are checked one by one.
+
+    Leaves are decoded into nodes on first access, and the raw public keys can be read without decoding them
+    with :meth:`secs`.  Added or replaced entries are kept in memory.
+    """
+    def __init__(self, buf, netcode, num_keys, is_list, groups):
+        self._buf = buf
+        self._netcode = netcode
+        self.num_keys = num_keys
+        self.is_list = is_list
+        self._size = leaf_size(num_keys)
+        self._groups = groups
+        self._entries = {}
+        self._deleted = set()
+
+    def _locate(self, path):
+        """The offset of the leaf record for path in the buffer, or None"""
+        if path in self._deleted:
+            return None
+        parent_path, _, child = path.rpartition('/')
+        group = self._groups.get(parent_path)
+        if group is None or not child.isdigit():
+            return None
+        child_index = int(child)
+        parents, count, offset = group
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value, = struct.unpack_from(">L", self._buf, offset + mid * self._size)
+            if value == child_index:
+                return offset + mid * self._size
+            if value < child_index:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def secs(self, path):
+        """
+        The compressed public keys of a leaf, one per account key, without decoding the leaf.
+
+        :rtype: list[bytes]
+        """
+        entry = self._entries.get(path)
+        if entry is not None:
+            return [node.sec() for node in (entry if isinstance(entry, list) else [entry])]
+        offset = self._locate(path)
+        if offset is None:
+            raise KeyError(path)
+        offset += 4
+        return [slice_bytes(self._buf, offset + 65 * i + 32, offset + 65 * i + 65)
+                for i in range(self.num_keys)]
+
+    def __getitem__(self, path):
+        entry = self._entries.get(path)
+        if entry is None:
+            offset = self._locate(path)
+            if offset is None:
+                raise KeyError(path)
+            parents = self._groups[path.rpartition('/')[0]][0]
+            _, nodes = decode_leaf(self._buf, offset, self._netcode, parents)
+            entry = nodes if self.is_list else nodes[0]
+            self._entries[path] = entry
+        return entry
+
+    def __contains__(self, path):
+        return path in self._entries or self._locate(path) is not None
+
+    def __setitem__(self, path, entry):
+        self._entries[path] = entry
+        self._deleted.discard(path)
+
+    def __delitem__(self, path):
+        if path not in self:
+            raise KeyError(path)
+        self._entries.pop(path, None)
+        self._deleted.add(path)
+
+    def __iter__(self):
+        for parent_path, (parents, count, offset) in self._groups.items():
+            prefix = parent_path + '/' if parent_path else ''
+            for i in range(count):
+                child_index, = struct.unpack_from(">L", self._buf, offset + i * self._size)
+                path = "%s%d" % (prefix, child_index)
+                if path not in self._entries and path not in self._deleted:
+                    yield path
+        for path in self._entries:
+            yield path
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def undecoded_records(self):
+        """
+        The raw records of the leaves in the buffer that were not decoded, replaced or deleted.
+
+        :return: iterator of (parent path, (depth, parent fingerprint) per key, child index, leaf record)
+        """
+        for parent_path, (parents, count, offset) in self._groups.items():
+            prefix = parent_path + '/' if parent_path else ''
+            for i in range(count):
+                record_offset = offset + i * self._size
+                child_index, = struct.unpack_from(">L", self._buf, record_offset)
+                path = "%s%d" % (prefix, child_index)
+                if path not in self._entries and path not in self._deleted:
+                    record = slice_bytes(self._buf, record_offset, record_offset + self._size)
+                    yield parent_path, parents, child_index, record
+
+    def decoded_items(self):
+        """The leaves decoded or added so far, as (path, entry)"""
+        return self._entries.items()
+
+    def decoded_count(self):
+        """The number of leaves decoded or added so far"""
+        return len(self._entries)
+
+
+def _replace(src, dst):
+    """Rename src to dst, replacing dst if it exists"""
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+        return
+    # Python 2 - rename does not replace an existing file on Windows
+    if os.name == 'nt' and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+
+def write_snapshot(account, filename):
+    """
+    Atomically write the binary cache of an account to a snapshot file.
+
+    :type account: multisigcore.hierarchy.Account
+    """
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(account.binary_cache)
+        f.flush()
+        os.fsync(f.fileno())
+    _replace(tmp, filename)
+
+
+def open_snapshot(filename):
+    """
+    Map a snapshot file into memory.  Pass the result as the cache to an account constructor - leaves are then
+    decoded lazily on first access, so opening a snapshot does not depend on the number of cached keys.
+
+    :rtype: mmap.mmap
+    """
+    with open(filename, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
@@ -1,10 +1,12 @@
 from __future__ import print_function
+import threading
 import uuid
 from copy import deepcopy
 
 import dateutil.tz
 import dateutil.parser
 import requests
+from requests.adapters import HTTPAdapter
 
 from pycoin.tx import Tx
 from pycoin.ecdsa import generator_secp256k1
@@ -16,6 +18,39 @@ from pycoin.tx.script import der
 
 __author__ = 'sserrano, devrandom'
 
+DEFAULT_POOL_SIZE = 10
+# seconds, or a (connect, read) pair - None waits forever
+DEFAULT_TIMEOUT = None
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def make_session(pool_size=DEFAULT_POOL_SIZE):
+    """
+    An HTTP session keeping up to pool_size connections per host alive for reuse.
+
+    :rtype: requests.Session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def shared_session(base_url, pool_size=DEFAULT_POOL_SIZE):
+    """
+    The session shared by all Oracle instances for base_url, created on first use with pool_size connections.
+
+    :rtype: requests.Session
+    """
+    with _sessions_lock:
+        session = _sessions.get(base_url)
+        if session is None:
+            session = _sessions[base_url] = make_session(pool_size)
+        return session
+
 
 class Error(Exception):
     pass
@@ -111,7 +146,8 @@ class PersonalInformation(object):
 class Oracle(object):
     """Keep track of a single Oracle account, including user keys and oracle master public key"""
 
-    def __init__(self, account, tx_db=None, manager=None, base_url=None, num_oracle_keys=1):
+    def __init__(self, account, tx_db=None, manager=None, base_url=None, num_oracle_keys=1, session=None,
+                 pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT):
         """
         Create an Oracle object
 
@@ -119,16 +155,26 @@ class Oracle(object):
         :type account: MultisigAccount
         :param tx_db: lookup database for transactions - see pycoin.services.get_tx_db()
         :param manager: the manager identifier for this wallet (only used on creation for now)
+        :param session: the HTTP session to use, by default the pooled session shared by Oracles with the same base_url
+        :type session: requests.Session
+        :param pool_size: number of connections kept alive if the shared session is created by this Oracle
+        :param timeout: request timeout in seconds, or a (connect, read) pair
         """
         self._account = account
         self.manager = manager
         self._wallet_agent = 'multisig-core-0.01'
         self.tx_db = tx_db
         self.base_url = base_url or 'https://s.digitaloracle.co/'
+        self.timeout = timeout
         self.num_oracle_keys = num_oracle_keys
         self.verbose = 0
+        self._init_session(session, pool_size)
         self._account.add_oracle(self)
 
+    def _init_session(self, session, pool_size):
+        """:nodoc:"""
+        self.session = session or shared_session(self.base_url, pool_size)
+
     @property
     def account(self):
         """The multisig account.  May be incomplete if we did not yet create or get the oracle key.
@@ -216,16 +262,24 @@ class Oracle(object):
         :return: a dictionary with the transaction in 'transaction' if successful
         :rtype: dict
         """
+        url, body = self._sign_request(tx, input_chain_paths, output_chain_paths, spend_id, verifications, callback)
+        response = self.session.post(url, body, headers={'content-type': 'application/json'}, timeout=self.timeout)
+        return self._sign_response(response.status_code, response.content)
+
+    def _sign_request(self, tx, input_chain_paths, output_chain_paths, spend_id, verifications, callback):
+        """:nodoc: the URL and body of a sign request"""
         req = self._create_oracle_request(input_chain_paths, output_chain_paths, spend_id, tx, verifications, callback=callback)
         body = json.dumps(req)
-        url = self._url() + "/transactions"
         if self.verbose > 0:
             print(body)
-        response = requests.post(url, body, headers={'content-type': 'application/json'})
-        if response.status_code >= 500:
-            raise OracleInternalError(response.content)
-        result = response.json()
-        if response.status_code == 200 and result.get('result', None) == 'success':
+        return self._url() + "/transactions", body
+
+    def _sign_response(self, status_code, content):
+        """:nodoc: the result of a sign request, or raise the matching exception"""
+        if status_code >= 500:
+            raise OracleInternalError(content)
+        result = json.loads(content.decode('utf8'))
+        if status_code == 200 and result.get('result', None) == 'success':
             tx = None
             if 'transaction' in result:
                 tx = Tx.tx_from_hex(result['transaction']['bytes'])
@@ -249,10 +303,10 @@ class Oracle(object):
             raise OracleLockoutException()
         elif result.get('error') == 'Platform  velocity  hard-limit  exceeded':
             raise OraclePlatformVelocityHardLimitException('Platform  velocity  hard-limit  exceeded')
-        elif response.status_code == 200 or response.status_code == 400:
-            raise OracleError(response.content)
+        elif status_code == 200 or status_code == 400:
+            raise OracleError(content)
         else:
-            raise IOError("Unknown response %d" % (response.status_code,))
+            raise IOError("Unknown response %d" % (status_code,))
 
     def _uuid(self):
         """Get oracle keychain identifier"""
@@ -267,18 +321,22 @@ class Oracle(object):
         if self._account.complete:
             raise Exception("the account for this Oracle is already complete")
         url = self._url()
-        response = requests.get(url)
-        result = response.json()
-        if response.status_code == 200 and result.get('result', None) == 'success':
+        response = self.session.get(url, timeout=self.timeout)
+        self._get_response(url, response.status_code, response.content)
+
+    def _get_response(self, url, status_code, content):
+        """:nodoc: complete the account with the oracle keys, or raise the matching exception"""
+        result = json.loads(content.decode('utf8'))
+        if status_code == 200 and result.get('result', None) == 'success':
             self._account.add_keys([AccountKey.from_key(s) for s in result['keys']['default']])
             self.num_oracle_keys = len(result['keys']['default'])
             self._account.set_complete()
-        elif response.status_code == 200 or response.status_code == 400:
-            raise OracleError(response.content)
-        elif response.status_code == 404:
+        elif status_code == 200 or status_code == 400:
+            raise OracleError(content)
+        elif status_code == 404:
             raise OracleUnknownKeychainException("No keychain found on %s" % (url,))
         else:
-            raise Error("Unknown response %d" % (response.status_code,))
+            raise Error("Unknown response %d" % (status_code,))
 
     def populate_pii(self, personal_info):
         pii = {}
@@ -317,6 +375,13 @@ class Oracle(object):
                 }
            }
         """
+        body = self._create_body(parameters, personal_info)
+        response = self.session.post(self._url(), body, headers={'content-type': 'application/json'},
+                                     timeout=self.timeout)
+        self._create_response(body, response.status_code, response.content)
+
+    def _create_body(self, parameters, personal_info):
+        """:nodoc:"""
         if self._account.complete:
             raise Exception("account already complete")
         r = {'walletAgent': self._wallet_agent, 'rulesetId': 'default'}
@@ -325,23 +390,23 @@ class Oracle(object):
         r['pii'] = self.populate_pii(personal_info)
         r['parameters'] = parameters
         r['keys'] = [k.hwif() for k in self._account.keys]
-        body = json.dumps(r)
-        url = self._url()
-        response = requests.post(url, body, headers={'content-type': 'application/json'})
+        return json.dumps(r)
 
-        result = response.json()
-        if response.status_code == 200 and result.get('result', None) == 'success':
+    def _create_response(self, body, status_code, content):
+        """:nodoc: complete the account with the oracle keys, or raise the matching exception"""
+        result = json.loads(content.decode('utf8'))
+        if status_code == 200 and result.get('result', None) == 'success':
             self._account.add_keys([AccountKey.from_key(s) for s in result['keys']['default']])
             self.num_oracle_keys = len(result['keys']['default'])
             self._account.set_complete()
-        elif response.status_code == 400 and result.get('error', None) == 'already exists':
+        elif status_code == 400 and result.get('error', None) == 'already exists':
             raise OracleAccountExistsException("already exists")
-        elif response.status_code == 200 or response.status_code == 400:
-            raise OracleError(response.content)
+        elif status_code == 200 or status_code == 400:
+            raise OracleError(content)
         else:
             print(body)
-            print(response.content)
-            raise Error("Unknown response %d" % (response.status_code,))
+            print(content)
+            raise Error("Unknown response %d" % (status_code,))
 
     def verify_personal_information(self, personal_info, call=None, callback=None):
         """
@@ -354,6 +419,13 @@ class Oracle(object):
         :param callback: URL where Oracle can inform the app about asynchronous results
         :type callback: str
         """
+        body = self._verify_body(personal_info, call, callback)
+        response = self.session.post(self._url() + "/verifyPii", body, headers={'content-type': 'application/json'},
+                                     timeout=self.timeout)
+        self._verify_response(body, response.status_code, response.content)
+
+    def _verify_body(self, personal_info, call, callback):
+        """:nodoc:"""
         r = {'walletAgent': self._wallet_agent}
         if self.manager:
             r['managerUsername'] = self.manager
@@ -362,23 +434,23 @@ class Oracle(object):
             r['callback'] = callback
         if call:
             r['call'] = call
-        body = json.dumps(r)
-        url = self._url() + "/verifyPii"
-        response = requests.post(url, body, headers={'content-type': 'application/json'})
+        return json.dumps(r)
 
-        result = response.json()
-        if response.status_code == 200 and result.get('result', None) == 'success':
+    def _verify_response(self, body, status_code, content):
+        """:nodoc: raise the matching exception if verification failed"""
+        result = json.loads(content.decode('utf8'))
+        if status_code == 200 and result.get('result', None) == 'success':
             pass
-        elif response.status_code == 400 and result.get('error', None) == 'phone type not yet known':
+        elif status_code == 400 and result.get('error', None) == 'phone type not yet known':
             raise OracleCannotCallException(result['error'])
-        elif response.status_code == 400 and result.get('error', None) == 'phone is not a landline':
+        elif status_code == 400 and result.get('error', None) == 'phone is not a landline':
             raise OracleCannotCallException(result['error'])
-        elif response.status_code == 200 or response.status_code == 400:
-            raise OracleError(response.content)
+        elif status_code == 200 or status_code == 400:
+            raise OracleError(content)
         else:
             print(body)
-            print(response.content)
-            raise Error("Unknown response %d" % (response.status_code,))
+            print(content)
+            raise Error("Unknown response %d" % (status_code,))
 
 def dummy_signature(sig_type):
     order = generator_secp256k1.order()
@@ -0,0 +1,115 @@
+"""
+Opt-in cache of private subchain nodes for signing.
+
+By default accounts do not keep private keys around - signing derives each input key from the account key, which
+costs one CKD step per path level.  A hot wallet can attach a :class:`PrivateNodeCache` to an account with
+:meth:`multisigcore.hierarchy.Account.attach_private_cache`, so that the private subchain nodes (e.g. "0" and "1")
+are kept and each leaf key is a single CKD step.
+
+Entries expire a fixed time after they were derived, whether or not they are used, and the least recently used
+entries are evicted beyond the size bound.  Expired and evicted nodes are dropped, since a signing call may still
+be using them.  :meth:`PrivateNodeCache.wipe` also clears the secret exponent (as an integer and as bytes) and
+chain code of the cached node objects and of any subkeys memoized on them.  Python cannot overwrite the memory of
+the values themselves - clearing drops the references the nodes hold.  All live caches are wiped at interpreter
+exit.
+
+Hardened levels are derived without memoization too, so no private node is left on the account key.
+"""
+import atexit
+import time
+import weakref
+
+from .derivation import private_subkey_for_path
+from .lru import LRUCache
+
+__author__ = 'devrandom'
+
+DEFAULT_MAXSIZE = 64
+DEFAULT_TTL = 300
+
+_live_caches = weakref.WeakSet()
+
+
+def wipe_node(node):
+    """Clear the secrets of a private node and of the subkeys memoized on it"""
+    for subkey in node._subkey_cache.values():
+        wipe_node(subkey)
+    node._subkey_cache.clear()
+    node._secret_exponent = None
+    node._secret_exponent_bytes = None
+    node._chain_code = None
+
+
+class PrivateNodeCache(LRUCache):
+    """
+    Private nodes by signing key hash160 and path, bounded in size and lifetime.
+
+    :param int maxsize: maximum number of nodes
+    :param ttl: seconds a node is kept after it was derived
+    :param clock: time source, returning seconds
+    """
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL, clock=time.time):
+        super(PrivateNodeCache, self).__init__(maxsize)
+        self.ttl = ttl
+        self.expirations = 0
+        self._clock = clock
+        _live_caches.add(self)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= self._clock():
+                del self._entries[key]
+                self.expirations += 1
+            entry = super(PrivateNodeCache, self).get(key)
+            return default if entry is None else entry[0]
+
+    def put(self, key, node):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (node, self._clock() + self.ttl)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def node_for_path(self, key, path):
+        """
+        The private node of a path, derived from key if not cached.
+
+        :type key: pycoin.key.BIP32Node.BIP32Node
+        :param str path: path relative to key, such as a subchain
+        """
+        cache_key = (key.hash160(use_uncompressed=False), path)
+        node = self.get(cache_key)
+        if node is None:
+            node = private_subkey_for_path(key, path)
+            self.put(cache_key, node)
+        return node
+
+    def wipe(self):
+        """Clear the secrets of all cached nodes and remove them"""
+        with self._lock:
+            for node, _ in self._entries.values():
+                wipe_node(node)
+            self._entries.clear()
+
+    clear = wipe
+
+    def stats(self):
+        """
+        :return: hits, misses, hit rate, evictions, expirations and current size
+        :rtype: dict
+        """
+        stats = super(PrivateNodeCache, self).stats()
+        lookups = self.hits + self.misses
+        stats['hit_rate'] = float(self.hits) / lookups if lookups else 0.0
+        stats['expirations'] = self.expirations
+        stats['ttl'] = self.ttl
+        return stats
+
+
+@atexit.register
+def wipe_all():
+    """Wipe all live private node caches"""
+    for cache in list(_live_caches):
+        cache.wipe()
@@ -0,0 +1,88 @@
+"""
+Reservation of spendables for transactions under construction.
+
+Threads building transactions for the same account reserve the outputs they select, so concurrent calls to
+:meth:`multisigcore.hierarchy.Account.tx` never select the same output.  A reservation is released if the
+transaction is abandoned or when it expires, and committed once the transaction is broadcast.  Committed outputs
+are not selected again while the provider still reports them as unspent.
+"""
+import threading
+import time
+
+__author__ = 'devrandom'
+
+DEFAULT_TIMEOUT = 600
+
+
+def _outpoint(spend):
+    return spend.tx_hash, spend.tx_out_index
+
+
+def _tx_outpoints(tx):
+    return [(tx_in.previous_hash, tx_in.previous_index) for tx_in in tx.txs_in]
+
+
+class Reservations(object):
+    """
+    Thread-safe reservations of the outputs of one account, see
+    :meth:`multisigcore.hierarchy.Account.attach_reservations`.
+
+    :param timeout: seconds after which a reservation that was neither committed nor released expires
+    :param clock: time source, returning seconds
+    """
+    def __init__(self, timeout=DEFAULT_TIMEOUT, clock=time.time):
+        self.timeout = timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._reserved = {}
+        self._committed = set()
+
+    def reserve(self, spendables, select):
+        """
+        Atomically select among the spendables that are not reserved or committed, and reserve the selection.
+
+        :param list[pycoin.tx.Spendable.Spendable] spendables: all current spendables
+        :param select: function from a list of available spendables to the selected ones, or None
+        :return: the available spendables, and the selected ones or None
+        """
+        with self._lock:
+            now = self._clock()
+            for outpoint, expiry in list(self._reserved.items()):
+                if expiry <= now:
+                    del self._reserved[outpoint]
+            # committed outputs no longer reported as unspent are gone for good
+            outpoints = [_outpoint(spend) for spend in spendables]
+            self._committed.intersection_update(outpoints)
+            available = [spend for spend, outpoint in zip(spendables, outpoints)
+                         if outpoint not in self._reserved and outpoint not in self._committed]
+            selected = select(available)
+            if selected:
+                expiry = now + self.timeout
+                for spend in selected:
+                    self._reserved[_outpoint(spend)] = expiry
+            return available, selected
+
+    def release(self, tx):
+        """Release the outputs spent by an abandoned transaction"""
+        self._release(_tx_outpoints(tx))
+
+    def cancel(self, spendables):
+        """Release reserved spendables, e.g. if building the transaction failed"""
+        self._release([_outpoint(spend) for spend in spendables])
+
+    def _release(self, outpoints):
+        with self._lock:
+            for outpoint in outpoints:
+                self._reserved.pop(outpoint, None)
+
+    def commit(self, tx):
+        """Record that a transaction was broadcast, so its outputs stay unavailable"""
+        with self._lock:
+            for outpoint in _tx_outpoints(tx):
+                self._reserved.pop(outpoint, None)
+                self._committed.add(outpoint)
+
+    def reserved_count(self):
+        """The number of outputs currently reserved, including expired reservations not yet collected"""
+        with self._lock:
+            return len(self._reserved)
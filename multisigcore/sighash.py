@@ -0,0 +1,117 @@
+"""
+Signature hashes of legacy (non-segwit) transaction inputs.
+
+Tx.signature_hash builds and serializes a copy of the whole transaction for each input, so hashing all the inputs
+of an n-input transaction costs O(n^2) in Python objects.  :class:`SighashEngine` serializes the invariant parts
+once - version, outpoints and sequences with blanked scripts, outputs, lock time - and only splices in the script of
+the input being signed.  The SHA256 state of the inputs before each input is computed once and copied, so only the
+input itself and the bytes after it are hashed again.  The rest of the serialization still has to be hashed for
+each input, but this is done by hashlib on a single buffer.
+
+Checking that the transaction did not change under the engine is itself O(n), so it is done once per
+:func:`signing_pass` rather than for each signature hash.
+
+Only SIGHASH_ALL is handled, which is what this library signs with.
+"""
+import contextlib
+import hashlib
+import io
+import struct
+
+from pycoin.encoding import from_bytes_32
+from pycoin.intbytes import int_to_bytes
+from pycoin.serialize.bitcoin_streamer import stream_bc_int
+from pycoin.tx.Tx import SIGHASH_ALL
+from pycoin.tx.script import opcodes, tools
+
+__author__ = 'devrandom'
+
+# outpoint, empty script and sequence
+BLANK_INPUT_SIZE = 32 + 4 + 1 + 4
+
+_CODESEPARATOR = int_to_bytes(opcodes.OP_CODESEPARATOR)
+
+
+def _varint(n):
+    f = io.BytesIO()
+    stream_bc_int(f, n)
+    return f.getvalue()
+
+
+def fingerprint(tx):
+    """The fields of a transaction that signature hashes depend on, other than input scripts"""
+    return (tx.version, tx.lock_time,
+            [(tx_in.previous_hash, tx_in.previous_index, tx_in.sequence) for tx_in in tx.txs_in],
+            [(tx_out.coin_value, tx_out.script) for tx_out in tx.txs_out])
+
+
+@contextlib.contextmanager
+def signing_pass(tx):
+    """
+    Context for computing the signature hashes of many inputs of tx, during which tx may only change in its input
+    scripts.  If tx keeps a signature hash engine, as :class:`multisigcore.hierarchy.AccountTx` does, the engine is
+    checked against tx once on entry instead of for each signature hash.
+    """
+    tx_pass = getattr(tx, 'signing_pass', None)
+    if tx_pass is None:
+        yield
+    else:
+        with tx_pass():
+            yield
+
+
+class SighashEngine(object):
+    """
+    SIGHASH_ALL signature hashes of the inputs of a transaction.  The transaction must not change other than in its
+    input scripts while the engine is used - see :meth:`matches`.
+
+    :type tx: pycoin.tx.Tx.Tx
+    """
+    def __init__(self, tx):
+        self.fingerprint = fingerprint(tx)
+        self._count = len(tx.txs_in)
+        self._outpoints = []
+        self._sequences = []
+        blank = []
+        for tx_in in tx.txs_in:
+            outpoint = tx_in.previous_hash + struct.pack("<L", tx_in.previous_index)
+            sequence = struct.pack("<L", tx_in.sequence)
+            self._outpoints.append(outpoint)
+            self._sequences.append(sequence)
+            blank.append(outpoint + b'\x00' + sequence)
+        self._blank = memoryview(b''.join(blank))
+        tail = [_varint(len(tx.txs_out))]
+        for tx_out in tx.txs_out:
+            tail.append(struct.pack("<Q", tx_out.coin_value))
+            tail.append(_varint(len(tx_out.script)))
+            tail.append(tx_out.script)
+        tail.append(struct.pack("<LL", tx.lock_time, SIGHASH_ALL))
+        self._tail = b''.join(tail)
+        # the hash state before each input
+        state = hashlib.sha256(struct.pack("<L", tx.version) + _varint(self._count))
+        self._prefixes = []
+        for idx in range(self._count):
+            self._prefixes.append(state.copy())
+            state.update(self._blank[idx * BLANK_INPUT_SIZE:(idx + 1) * BLANK_INPUT_SIZE])
+
+    def matches(self, tx):
+        """Whether the signature hashes of tx are still those of this engine"""
+        return fingerprint(tx) == self.fingerprint
+
+    def signature_hash(self, tx_out_script, tx_in_idx):
+        """
+        The SIGHASH_ALL signature hash of an input, as Tx.signature_hash.
+
+        :param bytes tx_out_script: the script being spent - for P2SH, the redeem script
+        :param int tx_in_idx: the input
+        :rtype: int
+        """
+        tx_out_script = tools.delete_subscript(tx_out_script, _CODESEPARATOR)
+        h = self._prefixes[tx_in_idx].copy()
+        h.update(self._outpoints[tx_in_idx])
+        h.update(_varint(len(tx_out_script)))
+        h.update(tx_out_script)
+        h.update(self._sequences[tx_in_idx])
+        h.update(self._blank[(tx_in_idx + 1) * BLANK_INPUT_SIZE:])
+        h.update(self._tail)
+        return from_bytes_32(hashlib.sha256(h.digest()).digest())
@@ -0,0 +1,203 @@
+"""
+Parallel signing of transaction inputs.
+
+Signing is split in three phases: the signature hashes and the signatures needed are planned in this process,
+the ECDSA signatures are computed - optionally on an executor such as a process pool, which only receives secret
+exponents and signature hashes - and the input scripts are then assembled here the same way pycoin's
+ScriptMultisig, ScriptPayToAddress and ScriptPayToScript solve them, so the result is identical to Tx.sign.
+
+Private keys are looked up by hash160 in a :class:`KeyLookup`, built once from the secret exponents and public pairs
+of the keys.
+"""
+from pycoin import ecdsa, encoding
+from pycoin.intbytes import bytes_from_int
+from pycoin.serialize import b2h
+from pycoin.tx.Tx import SIGHASH_ALL
+from pycoin.tx.pay_to import ScriptMultisig, ScriptPayToAddress, ScriptPayToScript, SolvingError, \
+    script_obj_from_script
+from pycoin.tx.pay_to.ScriptType import ScriptType
+from pycoin.tx.script import der, tools
+from pycoin.tx.script.check_signature import parse_signature_blob
+
+from .sighash import signing_pass
+
+__author__ = 'devrandom'
+
+_ORDER = ecdsa.generator_secp256k1.order()
+
+
+def script_signature(secret_exponent, sign_value, signature_type):
+    """A low S DER signature followed by the signature type, as used in input scripts"""
+    r, s = ecdsa.sign(ecdsa.generator_secp256k1, secret_exponent, sign_value)
+    if s + s > _ORDER:
+        s = _ORDER - s
+    return der.sigencode_der(r, s) + bytes_from_int(signature_type)
+
+
+class KeyLookup(dict):
+    """
+    Private keys by the hash160 of their compressed and uncompressed public keys, for use as the hash160_lookup of
+    Tx.sign and :func:`sign_parallel`.  Build it once per set of keys and reuse it for any number of transactions.
+
+    :param keys: private keys
+    :type keys: list[pycoin.key.Key.Key]
+    """
+    def __init__(self, keys=()):
+        super(KeyLookup, self).__init__()
+        self.add(keys)
+
+    def add(self, keys):
+        """Add private keys"""
+        for key in keys:
+            secret_exponent = key.secret_exponent()
+            if secret_exponent is None:
+                raise ValueError("key is not private")
+            public_pair = key.public_pair()
+            for compressed in (True, False):
+                hash160 = encoding.public_pair_to_hash160_sec(public_pair, compressed=compressed)
+                self[hash160] = (secret_exponent, public_pair, compressed)
+
+
+def _sign_worker(requests):
+    return [script_signature(*request) for request in requests]
+
+
+def sign_requests(requests, executor=None, chunk_size=16):
+    """
+    Compute signatures.
+
+    :param list[(int, int, int)] requests: secret exponent, signature hash and signature type of each signature
+    :param executor: optional executor to sign on
+    :type executor: concurrent.futures.Executor
+    :param int chunk_size: number of signatures computed by each task
+    :rtype: list[bytes]
+    """
+    if executor is None:
+        return _sign_worker(requests)
+    chunks = [requests[i:i + chunk_size] for i in range(0, len(requests), chunk_size)]
+    return [signature for signatures in executor.map(_sign_worker, chunks) for signature in signatures]
+
+
+def _existing_multisig_signatures(script_obj, existing_script, sign_value):
+    """The valid signatures in a partially signed script, and the keys they are for - as ScriptMultisig.solve"""
+    secs_solved = set()
+    existing_signatures = []
+    if existing_script:
+        pc = 0
+        seen = 0
+        opcode, data, pc = tools.get_opcode(existing_script, pc)
+        # ignore the first opcode
+        while pc < len(existing_script) and seen < script_obj.n:
+            opcode, data, pc = tools.get_opcode(existing_script, pc)
+            seen += 1
+            for sec_key in script_obj.sec_keys:
+                try:
+                    public_pair = encoding.sec_to_public_pair(sec_key)
+                    sig_pair, signature_type = parse_signature_blob(data)
+                    if ecdsa.verify(ecdsa.generator_secp256k1, public_pair, sign_value, sig_pair):
+                        existing_signatures.append(data)
+                        secs_solved.add(sec_key)
+                        break
+                except encoding.EncodingError:
+                    # if public_pair is invalid, we just ignore it
+                    pass
+    return existing_signatures, secs_solved
+
+
+def plan_input(tx, tx_in_idx, hash160_lookup, p2sh_lookup, requests, hash_type=SIGHASH_ALL):
+    """
+    Plan the signing of an input, appending the signatures it needs to requests.
+
+    :return: a function from the list of signatures for all requests to the input script
+    :raise SolvingError: if the input cannot be signed
+    """
+    tx_out_script = tx.unspents[tx_in_idx].script
+    script_obj = script_obj_from_script(tx_out_script)
+    suffix = b''
+    if isinstance(script_obj, ScriptPayToScript):
+        if p2sh_lookup is None:
+            raise ValueError("p2sh_lookup not set")
+        underlying_script = p2sh_lookup.get(script_obj.hash160)
+        if underlying_script is None:
+            raise ValueError("hash160=%s not found in p2sh_lookup" % (b2h(script_obj.hash160),))
+        script_obj = script_obj_from_script(underlying_script)
+        script_to_hash = underlying_script
+        suffix = tools.bin_script([underlying_script])
+    else:
+        script_to_hash = tx_out_script
+    sign_value = tx.signature_hash(script_to_hash, tx_in_idx, hash_type=hash_type)
+
+    if isinstance(script_obj, ScriptMultisig):
+        slots, secs_solved = _existing_multisig_signatures(script_obj, tx.txs_in[tx_in_idx].script, sign_value)
+        for signature_order, sec_key in enumerate(script_obj.sec_keys):
+            if sec_key in secs_solved:
+                continue
+            if len(slots) >= script_obj.n:
+                break
+            result = hash160_lookup.get(encoding.hash160(sec_key))
+            if result is None:
+                continue
+            slots.insert(signature_order, len(requests))
+            requests.append((result[0], sign_value, hash_type))
+        dummy_signature = ScriptType._dummy_signature(hash_type)
+        while len(slots) < script_obj.n:
+            slots.append(dummy_signature)
+
+        def assemble(signatures):
+            return (b'\x00' + tools.bin_script([signatures[slot] if isinstance(slot, int) else slot
+                                                for slot in slots]) + suffix)
+        return assemble
+
+    if isinstance(script_obj, ScriptPayToAddress):
+        result = hash160_lookup.get(script_obj.hash160)
+        if result is None:
+            raise SolvingError("can't find secret exponent for %s" % script_obj.address())
+        secret_exponent, public_pair, compressed = result
+        sec = encoding.public_pair_to_sec(public_pair, compressed=compressed)
+        slot = len(requests)
+        requests.append((secret_exponent, sign_value, hash_type))
+        return lambda signatures: tools.bin_script([signatures[slot], sec]) + suffix
+
+    # other script types are solved right away
+    solution = tx.solve(hash160_lookup, tx_in_idx, tx_out_script, hash_type=hash_type, p2sh_lookup=p2sh_lookup)
+    return lambda signatures: solution
+
+
+def sign_parallel(tx, hash160_lookup, p2sh_lookup=None, executor=None, chunk_size=16):
+    """
+    Sign a transaction like Tx.sign, computing the signatures on an executor.
+
+    :type tx: pycoin.tx.Tx.Tx
+    :param hash160_lookup: dict-like mapping of hash160 to (secret exponent, public pair, compressed)
+    :param p2sh_lookup: dict-like mapping of hash160 to redeem script
+    :param executor: optional executor to sign on, e.g. a concurrent.futures.ProcessPoolExecutor
+    :param int chunk_size: number of signatures computed by each task
+    :rtype: pycoin.tx.Tx.Tx
+    """
+    sign_parallel_many([tx], hash160_lookup, p2sh_lookup, executor, chunk_size)
+    return tx
+
+
+def sign_parallel_many(txs, hash160_lookup, p2sh_lookup=None, executor=None, chunk_size=16):
+    """
+    Sign transactions like :func:`sign_parallel`, computing the signatures of all of them in one batch.
+
+    :type txs: list[pycoin.tx.Tx.Tx]
+    :rtype: list[pycoin.tx.Tx.Tx]
+    """
+    requests = []
+    plans = []
+    for tx in txs:
+        tx.check_unspents()
+        with signing_pass(tx):
+            for idx, tx_in in enumerate(tx.txs_in):
+                if tx.is_signature_ok(idx) or tx_in.is_coinbase() or not tx.unspents[idx]:
+                    continue
+                try:
+                    plans.append((tx_in, plan_input(tx, idx, hash160_lookup, p2sh_lookup, requests)))
+                except SolvingError:
+                    pass
+    signatures = sign_requests(requests, executor, chunk_size)
+    for tx_in, assemble in plans:
+        tx_in.script = assemble(signatures)
+    return txs
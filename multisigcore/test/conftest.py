@@ -0,0 +1,6 @@
+import sys
+
+__author__ = 'devrandom'
+
+# the asyncio client uses Python 3.5 syntax
+collect_ignore = [] if sys.version_info >= (3, 5) else ['test_async_oracle.py']
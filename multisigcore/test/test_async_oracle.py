@@ -0,0 +1,163 @@
+import asyncio
+import gc
+import json
+import unittest
+import weakref
+
+import mock
+
+from multisigcore import async_oracle
+from multisigcore.async_oracle import AsyncOracle, close_sessions
+from multisigcore.oracle import DEFAULT_POOL_SIZE
+from multisigcore.oracle import OracleDeferralException, OracleRejectionException, OracleUnknownKeychainException
+from multisigcore.testing import *
+
+__author__ = 'devrandom'
+
+
+class FakeResponse(object):
+    def __init__(self, session, status, content):
+        self.session = session
+        self.status = status
+        self.content = content
+
+    async def __aenter__(self):
+        self.session.in_flight += 1
+        self.session.max_in_flight = max(self.session.max_in_flight, self.session.in_flight)
+        await asyncio.sleep(0.01)
+        return self
+
+    async def __aexit__(self, *args):
+        self.session.in_flight -= 1
+
+    async def read(self):
+        return self.content
+
+
+class FakeSession(object):
+    """Stands in for an aiohttp.ClientSession"""
+    def __init__(self, handler, connector=None):
+        self.handler = handler
+        self.connector = connector
+        self.closed = False
+        self.requests = []
+        self.timeouts = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def request(self, method, url, data=None, headers=None, timeout=None):
+        self.requests.append((method, url, data))
+        self.timeouts.append(timeout)
+        status, result = self.handler(method, url, data)
+        return FakeResponse(self, status, json.dumps(result).encode('utf8'))
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeClientTimeout(object):
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+
+class FakeTCPConnector(object):
+    def __init__(self, limit):
+        self.limit = limit
+
+
+class FakeAiohttp(object):
+    """Stands in for the aiohttp module, with sessions answering requests with handler"""
+    ClientTimeout = FakeClientTimeout
+    TCPConnector = FakeTCPConnector
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.sessions = []
+
+    def ClientSession(self, connector):
+        session = FakeSession(self.handler, connector)
+        self.sessions.append(weakref.ref(session))
+        return session
+
+
+def get_handler(method, url, data):
+    return 200, {"result": "success", "keys": {"default": [oracle_key.hwif()]}}
+
+
+class AsyncOracleTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        patcher = mock.patch.object(async_oracle, 'aiohttp', FakeAiohttp(get_handler))
+        self.aiohttp = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def test_get(self):
+        session = FakeSession(get_handler)
+        oracles = [AsyncOracle(make_incomplete_multisig_account(), session=session, max_in_flight=3)
+                   for _ in range(10)]
+        self.loop.run_until_complete(asyncio.gather(*[oracle.get() for oracle in oracles]))
+        self.assertTrue(all(oracle.account.complete for oracle in oracles))
+        self.assertEqual(make_multisig_account().address(111), oracles[0].account.address(111))
+        self.assertEqual(10, len(session.requests))
+        self.assertEqual(3, session.max_in_flight)
+        self.assertEqual('GET', session.requests[0][0])
+        self.assertEqual([{'total': None}] * 10, [timeout.kwargs for timeout in session.timeouts])
+        # sessions passed in are released, but not closed
+        self.assertIn(session, async_oracle._pools[self.loop])
+        self.loop.run_until_complete(close_sessions())
+        self.assertNotIn(self.loop, async_oracle._pools)
+        self.assertFalse(session.closed)
+
+    def test_shared_session(self):
+        oracles = [AsyncOracle(make_incomplete_multisig_account(), max_in_flight=2, timeout=(3, 10))
+                   for _ in range(5)]
+        other = AsyncOracle(make_incomplete_multisig_account(), base_url='https://other.example/')
+        self.loop.run_until_complete(asyncio.gather(*[oracle.get() for oracle in oracles + [other]]))
+        self.assertTrue(all(oracle.account.complete for oracle in oracles + [other]))
+        # one session per base_url
+        self.assertEqual(2, len(self.aiohttp.sessions))
+        session = self.aiohttp.sessions[0]()
+        self.assertEqual(5, len(session.requests))
+        self.assertEqual(2, session.max_in_flight)
+        self.assertEqual(DEFAULT_POOL_SIZE, session.connector.limit)
+        self.assertEqual({'connect': 3, 'sock_read': 10}, session.timeouts[0].kwargs)
+        self.assertTrue(session.requests[0][1].startswith('https://s.digitaloracle.co/'))
+        self.assertTrue(self.aiohttp.sessions[1]().requests[0][1].startswith('https://other.example/'))
+        # closing releases the shared sessions
+        self.loop.run_until_complete(close_sessions())
+        self.assertTrue(session.closed)
+        self.assertNotIn(self.loop, async_oracle._pools)
+        del session
+        gc.collect()
+        self.assertEqual([None, None], [ref() for ref in self.aiohttp.sessions])
+        # and a new session is made on the next request
+        oracle = AsyncOracle(make_incomplete_multisig_account())
+        self.loop.run_until_complete(oracle.get())
+        self.assertEqual(3, len(self.aiohttp.sessions))
+        self.loop.run_until_complete(close_sessions())
+
+    def test_exceptions(self):
+        oracle = AsyncOracle(make_incomplete_multisig_account(),
+                             session=FakeSession(lambda method, url, data: (404, {"error": "not found"})))
+        self.assertRaises(OracleUnknownKeychainException, self.loop.run_until_complete, oracle.get())
+
+        input_tx = Tx(1, [TxIn(b'1' * 32, 0)], [TxOut(20000, make_multisig_account().payto_for_path(TEST_PATH).script())])
+        tx = AccountTx(1, [AccountTxIn(input_tx.hash(), 0, path=TEST_PATH)], [TxOut(10000, b'')])
+        responses = [(200, {"result": "deferred", "spendId": "aaa",
+                            "deferral": {"reason": "verifications", "verifications": ["otp"]}}),
+                     (200, {"result": "rejected"})]
+        session = FakeSession(lambda method, url, data: responses.pop(0))
+        oracle = AsyncOracle(make_multisig_account(), tx_db={input_tx.hash(): input_tx}, session=session)
+        with self.assertRaises(OracleDeferralException) as context:
+            self.loop.run_until_complete(oracle.sign(tx, verifications={"otp": "123456"}))
+        self.assertEqual(["otp"], context.exception.verifications)
+        self.assertEqual("aaa", context.exception.spend_id)
+        method, url, data = session.requests[0]
+        self.assertTrue(url.endswith("/transactions"))
+        self.assertEqual([TEST_PATH], json.loads(data)['transaction']['chainPaths'])
+        self.assertRaises(OracleRejectionException, self.loop.run_until_complete, oracle.sign(tx))
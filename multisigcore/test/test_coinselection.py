@@ -0,0 +1,54 @@
+from unittest import TestCase
+
+from multisigcore.coinselection import *
+
+__author__ = 'devrandom'
+
+
+class CoinSelectionTest(TestCase):
+    def setUp(self):
+        # a P2PKH payment, unsigned inputs, P2SH change, 1000 per started kB
+        self.fee_model = FeeModel([34], 41, 32)
+
+    def test_fee_model(self):
+        self.assertEqual(10 + 41 + 34, self.fee_model.size(1))
+        self.assertEqual(10 + 41 + 34 + 32, self.fee_model.size(1, True))
+        self.assertEqual(1000, self.fee_model.fee(1))
+        self.assertEqual(2000, self.fee_model.fee(24))
+        self.assertEqual(DUST, self.fee_model.cost_of_change(1))
+        self.assertEqual(1000 + DUST, self.fee_model.cost_of_change(23))
+        self.assertEqual(3, varint_size(253))
+
+    def test_in_order(self):
+        values = [3000, 1000, 8000]
+        self.assertEqual([0, 1, 2], InOrderSelector().select_values(values, 4000, self.fee_model))
+        self.assertEqual([0], InOrderSelector().select_values(values, 2000, self.fee_model))
+        self.assertIsNone(InOrderSelector().select_values(values, 11001, self.fee_model))
+
+    def test_largest_first(self):
+        values = [3000, 1000, 8000]
+        self.assertEqual([2], LargestFirstSelector().select_values(values, 4000, self.fee_model))
+        self.assertEqual([2, 0], LargestFirstSelector().select_values(values, 8000, self.fee_model))
+
+    def test_oldest_first(self):
+        class Coin(object):
+            def __init__(self, coin_value, block_index_available):
+                self.coin_value = coin_value
+                self.block_index_available = block_index_available
+        coins = [Coin(5000, 0), Coin(5000, 200), Coin(5000, 100)]
+        self.assertEqual([coins[2], coins[1]], OldestFirstSelector().select(coins, 8000, self.fee_model))
+
+    def test_branch_and_bound(self):
+        selector = BranchAndBoundSelector(seed=1)
+        # 4000 + 6000 pays exactly 9000 plus the fee, with no change
+        values = [7000, 4000, 12000, 6000, 500]
+        self.assertEqual([1, 3], sorted(selector.select_values(values, 9000, self.fee_model)))
+        # no changeless solution - the smallest sufficient set from the knapsack approximation
+        values = [7000, 4000, 12000]
+        self.assertEqual([1], selector.select_values(values, 2000, self.fee_model))
+        self.assertEqual([0, 1], sorted(selector.select_values(values, 8000, self.fee_model)))
+        self.assertIsNone(selector.select_values(values, 30000, self.fee_model))
+        # many equal coins
+        values = [1500] * 5000
+        selected = selector.select_values(values, 10000, self.fee_model)
+        self.assertEqual(8, len(selected))
@@ -1,16 +1,40 @@
-from unittest import TestCase
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+from unittest import TestCase, skipIf
+
+import mock
+from multisigcore import keycache, sighash, txarchive
+from multisigcore.buffers import slice_bytes
+from multisigcore.coinselection import BranchAndBoundSelector
+from multisigcore.privatecache import PrivateNodeCache
+from multisigcore.reservation import Reservations
+from multisigcore.signing import KeyLookup
+from multisigcore.utxostore import UtxoStore
 from multisigcore.hierarchy import *
-from multisigcore.testing import make_multisig_account, make_unsorted_multisig_account, TEST_PATH
+from multisigcore.testing import make_multisig_account, make_unsorted_multisig_account, TEST_PATH, \
+    wallet_key, recover_key, oracle_key
 
 from pycoin.encoding import bitcoin_address_to_hash160_sec
 from pycoin.networks import address_prefix_for_netcode
 from pycoin.scripts.tx import dump_tx
 from pycoin.serialize import h2b
 from pycoin.tx import Spendable
-from pycoin.tx.pay_to import ScriptPayToAddress
+from pycoin.tx.pay_to import ScriptPayToAddress, build_hash160_lookup
+from pycoin.tx.script import tools
+
+try:
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+except ImportError:
+    # Python 2 without the futures backport
+    ProcessPoolExecutor = ThreadPoolExecutor = None
 
 __author__ = 'devrandom'
 
+requires_futures = skipIf(ProcessPoolExecutor is None, "requires concurrent.futures")
+
 
 class MySimpleTestnetProvider(object):
     def spendables_for_address(self, address):
@@ -33,6 +57,52 @@ class MySimpleProvider(object):
         else:
             return []
 
+
+class MyMultisigProvider(BatchService):
+    """Funds each of the redeem scripts once, whatever the addresses queried"""
+    def __init__(self, scripts):
+        self.scripts = scripts
+
+    def spendables_for_addresses(self, addresses):
+        return [Spendable(coin_value=10000, script=ScriptPayToScript(encoding.hash160(script.script())).script(),
+                          tx_out_index=n, tx_hash=b'2'*32)
+                for n, script in enumerate(self.scripts)]
+
+
+class MyStandardProvider(BatchService):
+    """
+    Funds addresses with standard outputs, and records the number of addresses of each query.
+
+    :param funded: the funded addresses
+    :param int count: number of outputs of each funded address
+    """
+    def __init__(self, funded, coin_value=10000, count=1):
+        self.funded = funded
+        self.coin_value = coin_value
+        self.count = count
+        self.queried = []
+
+    def spendables_for_addresses(self, addresses):
+        self.queried.append(len(addresses))
+        return [Spendable(coin_value=self.coin_value, script=standard_tx_out_script(address),
+                          tx_out_index=n, tx_hash=b'2'*32)
+                for address in addresses if address in self.funded for n in range(self.count)]
+
+
+def make_funded_multisig_account(master_key, num_funded):
+    """
+    An unsorted 2 of 3 account with 10000 on each of its first num_funded receiving addresses.
+
+    :return: the account keys, the account and the funded redeem scripts
+    """
+    keys = [master_key.account_for_path("0H/1/%dH" % (n,)) for n in (2, 3, 4)]
+    account = MultisigAccount(keys=keys, sort=False)
+    scripts = [account.script_for_path("0/%d" % (n,)) for n in range(num_funded)]
+    account._provider = MyMultisigProvider(scripts)
+    account.set_lookahead(num_funded)
+    return keys, account, scripts
+
+
 class HierarchyTest(TestCase):
     def setUp(self):
         self.master_key = MasterKey.from_seed(h2b("000102030405060708090a0b0c0d0e0f"))
@@ -54,6 +124,17 @@ class HierarchyTest(TestCase):
         self.assertEqual(leaf.as_text(), "xpub6H1LXWLaKsWFhvm6RVpEL9P4KfRZSW7abD2ttkWP3SSQvnyA8FSVqNTEcYFgJS2UaFcxupHiYkro49S8yGasTvXEYBVPamhGW6cFJodrTHy")
         self.assertEqual(leaf.as_text(as_private=True), "xprvA41z7zogVVwxVSgdKUHDy1SKmdb533PjDz7J6N6mV6uS3ze1ai8FHa8kmHScGpWmj4WggLyQjgPie1rFSruoUihUZREPSL39UNdE3BBDu76")
 
+    def test_accounts_for_range(self):
+        accounts = self.master_key.accounts_for_range("0H/1", 1, 3)
+        self.assertEqual(2, len(accounts))
+        self.assertIsInstance(accounts[1], AccountKey)
+        self.assertEqual("xpub6D4BDPcP2GT577Vvch3R8wDkScZWzQzMMUm3PWbmWvVJrZwQY4VUNgqFJPMM3No2dFDFGTsxxpG5uJh7n7epu4trkrX7x7DogT5Uv6fcLW5", accounts[1].hwif())
+        self.assertEqual(self.master_key.account_for_path("0H/1/1H").hwif(as_private=True), accounts[0].hwif(as_private=True))
+        self.assertEqual(self.master_key.bip44_account(1).hwif(), self.master_key.accounts_for_range("0H/0H", 0, 2)[1].hwif())
+        public = MasterKey.from_key(self.master_key.hwif())
+        self.assertFalse(public.account_for_path("0/1").is_private())
+        self.assertEqual(public.account_for_path("0/1").hwif(), public.accounts_for_range("0", 1, 2, hardened=False)[0].hwif())
+
     def test_electrum(self):
         # Electrum seed v6: fade really needle dinner excuse half rabbit sorry stomach confusion bid twice suffer
         m = MasterKey.from_seed(h2b("7043e6911790bbcc5d0c5c00ab4c3deb2641af606f987113bcc28b7ccd94b2b6be3a0203be1c61fe64e6d6e4e806107fec9e80d5bf9a62284d3bb45550d797f0"))
@@ -72,6 +153,90 @@ class HierarchyTest(TestCase):
         payto = uma.payto_for_path(TEST_PATH)
         self.assertEqual("3EyjKmfhbcrBHUCi9a7Qg8NYcMBK27aaDa", payto.address())
 
+    def test_subchain_node_cache(self):
+        account = make_multisig_account()
+        self.assertEqual("34DjTcNWGReJV4xx7R1AWK7FTz3xMwMcjA", account.payto_for_path(TEST_PATH).address())
+        self.assertEqual("3CWheC3YFPXAxVPBKkevMV5YFhy2h2oVSu", account.address(1))
+        # subchain nodes derived once per key and then reused for each leaf
+        self.assertEqual(set([(i, p) for i in range(3) for p in ("0", "0/0")]), set(account._nodes.keys()))
+        for i, key in enumerate(account.keys):
+            self.assertEqual(key.subkey_for_path("0/0.pub").hwif(), account._nodes[(i, "0/0")].hwif())
+            self.assertEqual(key.subkey_for_path("0/1.pub").sec(), account._cache['keys']["0/1"][i].sec())
+
+    def test_multisig_derive_range(self):
+        uma = make_unsorted_multisig_account()
+        leaves = uma.derive_range(0, 0, 3)
+        self.assertEqual(3, len(leaves))
+        self.assertEqual(["3MhrgJ9BtL3GTsUU6EqAqDGKdUAv8C15EN", "3CWheC3YFPXAxVPBKkevMV5YFhy2h2oVSu",
+                          "3Qc7D1EiXhGdZo7szB2VpQUnbBx6hAWtzm"], leaves.addresses)
+        self.assertEqual(["0/0", "0/1", "0/2"], leaves.paths())
+        for n in range(3):
+            payto = uma.leaf_payto(n)
+            self.assertEqual(uma.leaf_script(n).script(), leaves.redeem_scripts[n])
+            self.assertEqual(payto.hash160, leaves.hash160(n))
+            self.assertEqual(payto.script(), leaves.scripts[n])
+        leaves = self.multisig_account.derive_range("0/0", 1, 2)
+        self.assertEqual("34DjTcNWGReJV4xx7R1AWK7FTz3xMwMcjA", leaves.addresses[0])
+
+    def test_simple_derive_range(self):
+        account_key = self.master_key.account_for_path("0H/1/2H")
+        account = SimpleAccount(account_key)
+        leaves = account.derive_range(1, 0, 2)
+        self.assertEqual(["19Fi5VpcosH3CtCFjd5HyveM5c4Kecirza", "1AdEBCFQJHBzHKgWX517rQWCWwQ6qvYfAB"], leaves.addresses)
+        self.assertEqual(ScriptPayToAddress(leaves.hash160(1)).script(), leaves.scripts[1])
+        self.assertIsNone(leaves.redeem_scripts)
+        self.assertEqual(account_key.subkey_for_path("1/1.pub").hwif(), account._cache['keys']["1/1"].hwif())
+
+    @requires_futures
+    def test_parallel_address_map(self):
+        account = make_multisig_account()
+        account.set_lookahead(5)
+        account.address(2)
+        with ProcessPoolExecutor(2) as executor:
+            address_map = account.make_address_map(True, executor=executor, chunk_size=2)
+        expected = make_multisig_account()
+        expected.set_lookahead(5)
+        self.assertEqual(expected.make_address_map(True), address_map)
+        self.assertEqual("0/2", address_map["335QrAenpWLGFRNZT7VpzbkT1bPzRUkWna"])
+        # derived keys were merged into the key cache
+        self.assertEqual(expected._cache['keys']["1/4"][1].hwif(), account._cache['keys']["1/4"][1].hwif())
+        self.assertEqual(set(expected._cache['keys'].keys()), set(account._cache['keys'].keys()))
+
+    def test_script_cache(self):
+        account = MultisigAccount(keys=[wallet_key, recover_key, oracle_key], script_cache_size=2)
+        script = account.script_for_path(TEST_PATH)
+        self.assertIs(script, account.script_for_path(TEST_PATH))
+        self.assertEqual("34DjTcNWGReJV4xx7R1AWK7FTz3xMwMcjA", account.payto_for_path(TEST_PATH).address())
+        self.assertEqual({'hits': 2, 'misses': 1, 'evictions': 0, 'size': 1, 'maxsize': 2}, account.script_cache.stats())
+        account.address(0)
+        account.address(1)
+        self.assertEqual(1, account.script_cache.evictions)
+        self.assertNotIn(TEST_PATH, account.script_cache)
+        self.assertEqual(script.script(), account.script_for_path(TEST_PATH).script())
+        self.assertEqual(2, len(account.script_cache))
+
+    def test_concurrent_addresses(self):
+        account = MultisigAccount(keys=[wallet_key, recover_key, oracle_key], script_cache_size=8)
+        account.address_map = {}
+        account._update_address_map()
+        addresses = []
+
+        def issue():
+            for _ in range(10):
+                addresses.append(account.next_address())
+                account.script_for_path("0/%d" % (len(addresses) % 12))
+        threads = [threading.Thread(target=issue) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(41, account.num_ext_keys)
+        self.assertEqual(40, len(set(addresses)))
+        self.assertEqual(set(account.address(n) for n in range(1, 41)), set(addresses))
+        self.assertLessEqual(len(account.script_cache), 8)
+        stats = account.script_cache.stats()
+        self.assertEqual(stats['size'], len(account.script_cache))
+
     def test_multisig_address(self):
         uma = make_unsorted_multisig_account()
         self.assertEqual("3MhrgJ9BtL3GTsUU6EqAqDGKdUAv8C15EN", self.multisig_account.address(0))
@@ -121,6 +286,76 @@ class HierarchyTest(TestCase):
         account1 = SimpleAccount(account_key, account.cache)
         self.assertEqual("1r1msgrPfqCMRAhg23cPBD9ZXH1UQ6jec", account1.address(0, False))
 
+    def test_binary_cache(self):
+        account = make_multisig_account()
+        account.derive_range(0, 0, 3)
+        account.address(1, True)
+        account.payto_for_path(TEST_PATH)
+        account.next_address()
+        blob = account.binary_cache
+        self.assertTrue(blob.startswith(b'MSKC'))
+        self.assertLess(len(blob), len(account.cache))
+        account1 = MultisigAccount(keys=[wallet_key, recover_key, oracle_key], cache=blob)
+        self.assertEqual(2, account1.num_ext_keys)
+        self.assertEqual(json.loads(account.cache), json.loads(account1.cache))
+        with mock.patch('multisigcore.hierarchy.public_subkeys', side_effect=AssertionError()):
+            self.assertEqual("3CWheC3YFPXAxVPBKkevMV5YFhy2h2oVSu", account1.address(1))
+            self.assertEqual("34DjTcNWGReJV4xx7R1AWK7FTz3xMwMcjA", account1.payto_for_path(TEST_PATH).address())
+        # in place from a memoryview
+        account2 = MultisigAccount(keys=[wallet_key, recover_key, oracle_key], cache=memoryview(blob))
+        self.assertEqual([key.sec() for key in account._cache['keys']["0/1"]], account2._cached_secs("0/1"))
+        self.assertEqual(json.loads(account.cache), json.loads(account2.cache))
+
+        simple = SimpleAccount(self.master_key.account_for_path("0H/1/2H"))
+        simple.address(0)
+        simple1 = SimpleAccount(self.master_key.account_for_path("0H/1/2H"), simple.binary_cache)
+        self.assertEqual(simple.cache, simple1.cache)
+        empty = SimpleAccount(self.master_key.account_for_path("0H/1/2H"))
+        self.assertEqual(empty.cache, SimpleAccount(self.master_key.account_for_path("0H/1/2H"), empty.binary_cache).cache)
+        empty = make_multisig_account()
+        empty1 = MultisigAccount(keys=[wallet_key, recover_key, oracle_key], cache=empty.binary_cache)
+        self.assertEqual(empty.address(0), empty1.address(0))
+        empty2 = MultisigAccount(keys=[wallet_key, recover_key, oracle_key], cache=empty1.binary_cache)
+        self.assertEqual(json.loads(empty1.cache), json.loads(empty2.cache))
+        self.assertEqual(empty.address(0), empty2.address(0))
+
+    def test_snapshot(self):
+        account = make_multisig_account()
+        account.set_lookahead(3)
+        account.make_address_map(True)
+        account.payto_for_path(TEST_PATH)
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "account.snapshot")
+            keycache.write_snapshot(account, filename)
+            snapshot = keycache.open_snapshot(filename)
+            account1 = MultisigAccount(keys=[wallet_key, recover_key, oracle_key], cache=snapshot)
+            account1.set_lookahead(3)
+            keys = account1._cache['keys']
+            self.assertEqual(9, len(keys))
+            self.assertIn("1/3", keys)
+            self.assertNotIn("1/4", keys)
+            with mock.patch('multisigcore.hierarchy.public_subkeys', side_effect=AssertionError()):
+                self.assertEqual(account.make_address_map(True), account1.make_address_map(True))
+                self.assertEqual("34DjTcNWGReJV4xx7R1AWK7FTz3xMwMcjA", account1.payto_for_path(TEST_PATH).address())
+            self.assertEqual(0, keys.decoded_count())
+            self.assertEqual(account._cache['keys']["0/2"][1].hwif(), keys["0/2"][1].hwif())
+            self.assertEqual(1, keys.decoded_count())
+            account1.address(4)
+            self.assertEqual(json.loads(account.cache)['issued'], json.loads(account1.cache)['issued'])
+            self.assertEqual(10, len(json.loads(account1.cache)['keys']))
+            # snapshotting a snapshot copies the leaves never decoded, and replaces the file
+            decoded = keys.decoded_count()
+            keycache.write_snapshot(account1, filename)
+            self.assertEqual(decoded, keys.decoded_count())
+            snapshot2 = keycache.open_snapshot(filename)
+            account2 = MultisigAccount(keys=[wallet_key, recover_key, oracle_key], cache=snapshot2)
+            self.assertEqual(json.loads(account1.cache), json.loads(account2.cache))
+            snapshot2.close()
+            snapshot.close()
+        finally:
+            shutil.rmtree(directory)
+
     def test_multisig_account(self):
         account_key = self.master_key.account_for_path("0H/1/2H")
         recover_key = self.master_key.account_for_path("0H/1/3H")
@@ -155,6 +390,148 @@ class HierarchyTest(TestCase):
         # Countersign
         multisigcore.local_sign(tx, [redeem_script], [oracle_key.subkey_for_path("0/0")])
         self.assertTrue(tx.is_signature_ok(0))
+        self.assertEqual(10 + 297 + 32 + 32, account.estimate_size(tx))
+        self.assertLessEqual(len(tx.as_bin()), account.estimate_size(tx))
+
+    @requires_futures
+    def test_parallel_sign(self):
+        keys, account, scripts = make_funded_multisig_account(self.master_key, 3)
+        tx = account.tx([("3FfiLhj1yXkXRFRRb9CMsMXBNZXQEv23Pi", 25000)])
+        self.assertEqual(3, len(tx.txs_in))
+        expected = AccountTx.deserialize(tx.serialize())
+        account.sign(expected)
+        with ProcessPoolExecutor(2) as executor:
+            account.sign(tx, executor=executor)
+            self.assertEqual(expected.as_hex(), tx.as_hex())
+            # countersign the partially signed transaction
+            oracle_keys = [keys[2].subkey_for_path(path) for path in tx.input_chain_paths()]
+            multisigcore.local_sign(expected, scripts, oracle_keys)
+            multisigcore.local_sign(tx, scripts, oracle_keys, executor=executor)
+        self.assertEqual(expected.as_hex(), tx.as_hex())
+        self.assertEqual(0, tx.bad_signature_count())
+
+    def test_verify_signatures(self):
+        keys, account, scripts = make_funded_multisig_account(self.master_key, 2)
+        tx = account.tx([("3FfiLhj1yXkXRFRRb9CMsMXBNZXQEv23Pi", 15000)])
+        account.sign(tx)
+        # one of two signatures
+        self.assertEqual([False, False], account.verify_signatures(tx))
+        oracle_keys = [keys[2].subkey_for_path(path) for path in tx.input_chain_paths()]
+        multisigcore.local_sign(tx, scripts, oracle_keys)
+        self.assertEqual([True, True], account.verify_signatures(tx))
+        # as returned by the oracle, without paths
+        signed = Tx.from_hex(tx.as_hex())
+        self.assertEqual([True, None], account.verify_signatures(signed, ["0/0", None]))
+        if ThreadPoolExecutor is not None:
+            with ThreadPoolExecutor(2) as executor:
+                self.assertEqual([True, True], account.verify_signatures(signed, tx.input_chain_paths(), executor))
+        # signatures must be for the expected redeem script, and in key order
+        self.assertEqual([False, False], account.verify_signatures(signed, ["0/1", "0/0"]))
+        opcodes = []
+        pc = 0
+        while pc < len(tx.txs_in[0].script):
+            opcode, data, pc = tools.get_opcode(tx.txs_in[0].script, pc)
+            opcodes.append(data)
+        signed.txs_in[0].script = b'\x00' + tools.bin_script([opcodes[2], opcodes[1], opcodes[3]])
+        self.assertEqual([False, True], account.verify_signatures(signed, tx.input_chain_paths()))
+
+    def test_sign_many(self):
+        keys, account, scripts = make_funded_multisig_account(self.master_key, 3)
+        txs = [account.tx([("3FfiLhj1yXkXRFRRb9CMsMXBNZXQEv23Pi", amount)]) for amount in (5000, 15000)]
+        expected = [AccountTx.deserialize(tx.serialize()) for tx in txs]
+        for tx in expected:
+            account.sign(tx)
+        parallel = [AccountTx.deserialize(tx.serialize()) for tx in txs]
+        self.assertIs(txs, account.sign_many(txs))
+        self.assertEqual([tx.as_hex() for tx in expected], [tx.as_hex() for tx in txs])
+        if ThreadPoolExecutor is not None:
+            with ThreadPoolExecutor(2) as executor:
+                account.sign_many(parallel, executor=executor)
+            self.assertEqual([tx.as_hex() for tx in expected], [tx.as_hex() for tx in parallel])
+        key_lookup, p2sh_lookup = account.signing_lookups(txs)
+        self.assertEqual(set(encoding.hash160(script.script()) for script in scripts[:2]), set(p2sh_lookup))
+        self.assertRaises(ValueError, MultisigAccount(keys=[key.public_copy() for key in keys]).sign_many, txs)
+
+    def test_private_node_cache(self):
+        now = [1000]
+        cache = PrivateNodeCache(maxsize=3, ttl=60, clock=lambda: now[0])
+        account_key = self.master_key.account_for_path("0H/1/2H")
+        account = SimpleAccount(account_key)
+        paths = ["0/1", "1/2", "0/3", "3H/4"]
+        tx = AccountTx(1, [AccountTxIn(b'2'*32, n, path=path) for n, path in enumerate(paths)], [])
+        expected_key = BIP32Node.from_hwif(account_key.hwif(as_private=True))
+        expected = [expected_key.subkey_for_path(path).hwif(as_private=True) for path in paths]
+        self.assertEqual(expected, [key.hwif(as_private=True) for key in account.keys_for_tx(tx)])
+        account.attach_private_cache(cache)
+        self.assertIs(cache, account.private_cache)
+        self.assertEqual(expected, [key.hwif(as_private=True) for key in account.keys_for_tx(tx)])
+        self.assertEqual(expected, [key.hwif(as_private=True) for key in account.keys_for_tx(tx)])
+        # private nodes, hardened or not, are not memoized on the account key
+        self.assertEqual({}, account_key._subkey_cache)
+        stats = cache.stats()
+        self.assertEqual((3, 3, 0.5, 3), (stats['hits'], stats['misses'], stats['hit_rate'], stats['size']))
+        account_id = account_key.hash160(use_uncompressed=False)
+        node = cache.get((account_id, "3H"))
+        # expired nodes are derived again
+        now[0] += 60
+        account.keys_for_tx(tx)
+        self.assertIsNot(node, cache.get((account_id, "3H")))
+        self.assertEqual(3, cache.stats()['expirations'])
+        # beyond the size bound, the least recently used node is evicted
+        cache.node_for_path(account_key, "2")
+        self.assertEqual(1, cache.evictions)
+        self.assertEqual(3, len(cache))
+        node = cache.get((account_id, "2"))
+        child = node.subkey(0)
+        cache.wipe()
+        self.assertEqual(0, len(cache))
+        for wiped in (node, child):
+            self.assertIsNone(wiped._secret_exponent)
+            self.assertIsNone(wiped._secret_exponent_bytes)
+            self.assertIsNone(wiped._chain_code)
+        self.assertEqual({}, node._subkey_cache)
+
+    def test_private_node_cache_accounts(self):
+        cache = PrivateNodeCache()
+        keys = [self.master_key.account_for_path("0H/1/%dH" % (n,)) for n in range(2)]
+        # accounts whose 32 bit fingerprints collide do not share nodes
+        for key in keys:
+            key.fingerprint = lambda: b'\0\0\0\0'
+        nodes = [cache.node_for_path(key, "0") for key in keys]
+        self.assertEqual([key.subkey_for_path("0").hwif(as_private=True) for key in keys],
+                         [node.hwif(as_private=True) for node in nodes])
+        self.assertEqual(2, len(cache))
+
+    def test_key_lookup(self):
+        keys = [self.master_key.subkey_for_path("0H/1/2H/0/%d" % (n,)) for n in range(3)]
+        lookup = KeyLookup(keys)
+        self.assertEqual(dict(build_hash160_lookup([key.secret_exponent() for key in keys])), dict(lookup))
+        self.assertRaises(ValueError, KeyLookup, [keys[0].public_copy()])
+
+    def test_sighash_engine(self):
+        account = make_multisig_account()
+        scripts = [account.script_for_path("0/%d" % (n,)).script() for n in range(3)]
+        txs_in = [AccountTxIn(b'2'*32, n, b'\x01\x02', 1000 + n) for n in range(5)]
+        txs_out = [TxOut(7000, scripts[0]), AccountTxOut(3000, scripts[1], "1/0")]
+        tx = AccountTx(1, txs_in, txs_out, 100)
+        for idx in range(5):
+            for script in scripts:
+                self.assertEqual(Tx.signature_hash(tx, script, idx, SIGHASH_ALL),
+                                 tx.signature_hash(script, idx, SIGHASH_ALL))
+        engine = tx.sighash_engine()
+        # input scripts are blanked, so changing them keeps the engine
+        tx.txs_in[0].script = b'\x03'
+        self.assertIs(engine, tx.sighash_engine())
+        tx.txs_out[0].coin_value = 6000
+        self.assertIsNot(engine, tx.sighash_engine())
+        self.assertEqual(Tx.signature_hash(tx, scripts[0], 1, SIGHASH_ALL),
+                         tx.signature_hash(scripts[0], 1, SIGHASH_ALL))
+        # within a signing pass, the engine is checked once rather than for each input
+        with mock.patch('multisigcore.sighash.fingerprint', wraps=sighash.fingerprint) as fingerprint:
+            with tx.signing_pass():
+                hashes = [tx.signature_hash(scripts[0], idx, SIGHASH_ALL) for idx in range(5)]
+            self.assertEqual(1, fingerprint.call_count)
+        self.assertEqual([Tx.signature_hash(tx, scripts[0], idx, SIGHASH_ALL) for idx in range(5)], hashes)
 
     def test_simple_account(self):
         account_key = self.master_key.account_for_path("0H/1/2H")
@@ -182,11 +559,191 @@ class HierarchyTest(TestCase):
         with self.assertRaises(InsufficientBalanceException) as e:
             account.tx([("3FfiLhj1yXkXRFRRb9CMsMXBNZXQEv23Pi", 9001)])
         self.assertEqual(10000, e.exception.balance)
+        tx_bnb = account.tx([("3FfiLhj1yXkXRFRRb9CMsMXBNZXQEv23Pi", 8500)], selector=BranchAndBoundSelector())
+        self.assertEqual(1, len(tx_bnb.txs_out))
+        self.assertEqual(1000, account.recommended_fee(tx))
+        estimated_size = account.estimate_size(tx)
+        self.assertEqual(10 + 148 + 32 + 34, estimated_size)
+        self.assertEqual(estimated_size, account.recommended_fee(tx, fee_per_byte=1))
+        tx_rate = account.tx([("3FfiLhj1yXkXRFRRb9CMsMXBNZXQEv23Pi", 2000)], fee_per_byte=10)
+        self.assertEqual(10000 - 2000 - 10 * estimated_size, tx_rate.txs_out[1].coin_value)
         account.sign(tx)
         self.assertTrue(tx.is_signature_ok(0))
+        self.assertLessEqual(len(tx.as_bin()), estimated_size)
+        self.assertGreaterEqual(len(tx.as_bin()), estimated_size - 2)
         self.assertEqual(["0/0"], tx.input_chain_paths())
         self.assertEqual([None, "1/0"], tx.output_chain_paths())
 
+    def test_incremental_address_map(self):
+        account_key = self.master_key.account_for_path("0H/1/2H")
+        account = SimpleAccount(account_key)
+        account._provider = MySimpleProvider()
+        account.set_lookahead(2)
+        self.assertEqual(1, len(account.spendables()))
+        self.assertEqual(6, len(account.address_map))
+        self.assertEqual("0/0", account.path_for("1r1msgrPfqCMRAhg23cPBD9ZXH1UQ6jec"))
+        with mock.patch('multisigcore.hierarchy.public_subkeys', side_effect=AssertionError()):
+            # warm account - no derivation
+            self.assertEqual(1, len(account.spendables()))
+            # loaded from cache - no derivation
+            account1 = SimpleAccount(account_key, account.cache)
+            account1._provider = MySimpleProvider()
+            account1.set_lookahead(2)
+            self.assertEqual(1, len(account1.spendables()))
+            self.assertEqual(account.address_map, account1.address_map)
+        account.next_address()
+        account.next_change_address()
+        self.assertEqual(8, len(account.address_map))
+        self.assertEqual("0/3", account.path_for(account.address(3)))
+        account.set_lookahead(4)
+        self.assertEqual(12, len(account.address_map))
+        self.assertEqual(sorted(account.make_address_map(True).keys()), sorted(account.address_map.keys()))
+        account.set_lookahead(1)
+        self.assertEqual(sorted(account.make_address_map(True).keys()), sorted(account._watched_addresses()))
+
+    def test_script_index(self):
+        account = self.multisig_account
+        account._provider = MySimpleProvider()
+        account.set_lookahead(1)
+        self.assertEqual([], account.spendables())
+        script = standard_tx_out_script("3CWheC3YFPXAxVPBKkevMV5YFhy2h2oVSu")
+        self.assertEqual("0/1", account.path_for_script(script))
+        self.assertEqual("1/0", account.path_for_script(standard_tx_out_script(account.current_change_address())))
+        with self.assertRaises(ValueError):
+            account.path_for_script(standard_tx_out_script("3FfiLhj1yXkXRFRRb9CMsMXBNZXQEv23Pi"))
+        spendables = []
+        txs_in = []
+        with mock.patch.object(MultisigAccount, 'address_from_spend', side_effect=AssertionError()):
+            account.add_spend(Spendable(coin_value=10000, script=script, tx_out_index=0, tx_hash=b'2'*32),
+                              spendables, txs_in)
+        self.assertEqual("0/1", txs_in[0].path)
+
+    def test_discover(self):
+        account_key = self.master_key.account_for_path("0H/1/2H")
+        account = SimpleAccount(account_key)
+        funded = [account_key.subkey_for_path(path).address() for path in ["0/0", "0/25", "1/3"]]
+        account._provider = MyStandardProvider(funded, coin_value=1000)
+        spendables = account.discover(gap_limit=20, batch_size=10)
+        self.assertEqual(3, len(spendables))
+        self.assertEqual(27, account.num_ext_keys)
+        self.assertEqual(5, account.num_int_keys)
+        # 0/0..0/49 and 1/0..1/29
+        self.assertEqual([10] * 8, account._provider.queried)
+        self.assertEqual("0/26", account.path_for(account.current_address()))
+
+    def test_utxo_store(self):
+        account_key = self.master_key.account_for_path("0H/1/2H")
+        account = SimpleAccount(account_key)
+        account._provider = MyStandardProvider([account_key.subkey_for_path("0/0").address()], count=2)
+        queried = account._provider.queried
+        account.set_lookahead(2)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, "utxos.sqlite")
+            account.attach_utxo_store(UtxoStore(filename))
+            self.assertEqual(20000, account.balance())
+            self.assertEqual([6], queried)
+            # served locally
+            self.assertEqual(2, len(account.spendables()))
+            self.assertEqual([6], queried)
+            tx = account.tx([("3FfiLhj1yXkXRFRRb9CMsMXBNZXQEv23Pi", 2000)])
+            self.assertEqual(1, len(tx.txs_in))
+            self.assertEqual(["0/0"], tx.input_chain_paths())
+            # the change path is marked stale, and the spent output is not reported again
+            self.assertEqual(10000, account.balance())
+            self.assertEqual([6, 1], queried)
+            account.utxo_store.close()
+            account.attach_utxo_store(UtxoStore(filename))
+            self.assertEqual(10000, account.balance())
+            self.assertEqual([6, 1], queried)
+            account.utxo_store.mark_spent(tx, False)
+            self.assertEqual(20000, account.utxo_store.balance())
+            account.utxo_store.mark_stale(["0/0"])
+            account.sync()
+            self.assertEqual([6, 1, 1], queried)
+            account.sync(full=True)
+            self.assertEqual([6, 1, 1, 6], queried)
+            account.utxo_store.close()
+            # synced paths expire, so that later payments to watched addresses are seen
+            now = [1000]
+            account.attach_utxo_store(UtxoStore(filename, max_age=60, clock=lambda: now[0]))
+            account.sync(full=True)
+            self.assertEqual(20000, account.balance())
+            self.assertEqual([6, 1, 1, 6, 6], queried)
+            now[0] += 61
+            self.assertEqual(20000, account.balance())
+            self.assertEqual([6, 1, 1, 6, 6, 6], queried)
+            account.utxo_store.close()
+            # stores created before paths expired are synced again
+            db = sqlite3.connect(os.path.join(tmpdir, "old.sqlite"))
+            db.executescript("CREATE TABLE paths (path TEXT PRIMARY KEY, stale INTEGER NOT NULL DEFAULT 0);"
+                             "INSERT INTO paths VALUES ('0/0', 0);")
+            db.close()
+            store = UtxoStore(os.path.join(tmpdir, "old.sqlite"), max_age=60, clock=lambda: now[0])
+            self.assertEqual(["0/0"], store.stale_paths(["0/0"]))
+            store.update(["0/0"], [])
+            self.assertEqual([], store.stale_paths(["0/0"]))
+            store.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_reservations(self):
+        account_key = self.master_key.account_for_path("0H/1/2H")
+        account = SimpleAccount(account_key)
+        account._provider = MyStandardProvider([account_key.subkey_for_path("0/0").address()], count=20)
+        now = [1000]
+        account.attach_reservations(Reservations(timeout=60, clock=lambda: now[0]))
+        txs = []
+
+        def build():
+            for _ in range(5):
+                txs.append(account.tx([("3FfiLhj1yXkXRFRRb9CMsMXBNZXQEv23Pi", 2000)]))
+        threads = [threading.Thread(target=build) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        outpoints = [(tx_in.previous_hash, tx_in.previous_index) for tx in txs for tx_in in tx.txs_in]
+        self.assertEqual(20, len(set(outpoints)))
+        with self.assertRaises(InsufficientBalanceException) as e:
+            account.tx([("3FfiLhj1yXkXRFRRb9CMsMXBNZXQEv23Pi", 2000)])
+        self.assertEqual(0, e.exception.balance)
+        account.release_tx(txs[0])
+        account.commit_tx(txs[1])
+        tx = account.tx([("3FfiLhj1yXkXRFRRb9CMsMXBNZXQEv23Pi", 2000)])
+        self.assertEqual(txs[0].txs_in[0].previous_index, tx.txs_in[0].previous_index)
+        # reservations expire, committed outputs stay unavailable
+        now[0] += 61
+        self.assertEqual(19, len(account.reservations.reserve(account.spendables(), lambda available: None)[0]))
+
+    def test_tx_batch(self):
+        account_key = self.master_key.account_for_path("0H/1/2H")
+        account = SimpleAccount(account_key)
+        account._provider = MyStandardProvider([account_key.subkey_for_path("0/0").address()], count=20)
+        payables = [("3FfiLhj1yXkXRFRRb9CMsMXBNZXQEv23Pi", 2000 + n) for n in range(25)]
+        txs = account.tx_batch(payables, max_outputs=10)
+        self.assertEqual([10, 10, 8], [len(tx.txs_out) for tx in txs])
+        self.assertEqual([coin_value for _, coin_value in payables],
+                         [tx_out.coin_value for tx in txs for tx_out in tx.txs_out[:-1]])
+        outpoints = [(tx_in.previous_hash, tx_in.previous_index) for tx in txs for tx_in in tx.txs_in]
+        self.assertEqual(len(outpoints), len(set(outpoints)))
+        self.assertEqual(["1/0", "1/1", "1/2"], [tx.output_chain_paths()[-1] for tx in txs])
+        self.assertEqual(4, account.num_int_keys)
+        self.assertEqual("1/3", account.path_for(account.current_change_address()))
+        for tx in txs:
+            self.assertLessEqual(account.estimate_size(tx), 100000)
+        # split further to fit the size limit
+        txs = account.tx_batch(payables, max_outputs=10, max_size=500)
+        self.assertEqual(6, len(txs))
+        self.assertTrue(all(account.estimate_size(tx) <= 500 for tx in txs))
+        with self.assertRaises(InsufficientBalanceException):
+            account.tx_batch(payables * 4)
+        # change addresses are only issued once all the transactions are built
+        num_int_keys = account.num_int_keys
+        with mock.patch.object(SimpleAccount, '_assemble_tx', side_effect=[txs[0], ValueError()]):
+            self.assertRaises(ValueError, account.tx_batch, payables, max_outputs=10)
+        self.assertEqual(num_int_keys, account.num_int_keys)
+
     def test_tx_serialize(self):
         account_key = self.master_key.account_for_path("0H/1/2H")
         account = SimpleAccount(account_key)
@@ -208,6 +765,64 @@ class HierarchyTest(TestCase):
         self.assertEqual(["0/0"], tx.input_chain_paths())
         self.assertEqual([None, "1/0"], tx.output_chain_paths())
 
+    def test_tx_archive(self):
+        account_key = self.master_key.account_for_path("0H/1/2H")
+        account = SimpleAccount(account_key)
+        account._provider = MySimpleProvider()
+        account.set_lookahead(2)
+        tx1 = account.tx([("3FfiLhj1yXkXRFRRb9CMsMXBNZXQEv23Pi", 2000)])
+        tx2 = account.tx([("3FfiLhj1yXkXRFRRb9CMsMXBNZXQEv23Pi", 3000)])
+        account.sign(tx2)
+        blob = txarchive.dumps([tx1, tx2])
+        self.assertLess(len(blob), len(tx1.serialize()) + len(tx2.serialize()))
+        txs = txarchive.loads(blob)
+        self.assertEqual([tx1.as_hex(), tx2.as_hex()], [tx.as_hex() for _, tx in txarchive.iter_buffer(memoryview(blob))])
+        padded = b'x' + tx2.as_bin() + b'y'
+        tx, end = AccountTx.parse_buffer(memoryview(padded), 1, ["0/0"], [None, "1/0"])
+        self.assertEqual((tx2.as_hex(), len(padded) - 1), (tx.as_hex(), end))
+        self.assertEqual((bytes, bytes), (type(tx.txs_in[0].previous_hash), type(tx.txs_in[0].script)))
+        self.assertEqual(b'\x03\x04', slice_bytes(memoryview(b'\x01\x02\x03\x04\x05'), 2, 4))
+        self.assertEqual([None, "1/0"], tx.output_chain_paths())
+        self.assertEqual(0xfd0102, parse_varint(b'\xfe\x02\x01\xfd\x00', 0)[0])
+        self.assertEqual([tx1.as_hex(), tx2.as_hex()], [tx.as_hex() for tx in txs])
+        self.assertEqual(["0/0"], txs[1].input_chain_paths())
+        self.assertEqual([None, "1/0"], txs[1].output_chain_paths())
+        self.assertEqual(10000, txs[0].unspents[0].coin_value)
+        self.assertTrue(txs[1].is_signature_ok(0))
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, "txs.bin")
+            txarchive.TxArchive(filename).append([tx1])
+            archive = txarchive.TxArchive(filename)
+            archive.append([tx2])
+            archive.append([tx1])
+            with open(filename, 'rb') as f:
+                self.assertEqual(blob, f.read()[:len(blob)])
+            self.assertEqual([tx1.as_hex(), tx2.as_hex(), tx1.as_hex()], [tx.as_hex() for tx in archive])
+            self.assertEqual([["0/0"]] * 3, [tx.input_chain_paths() for tx in archive])
+            scanned = list(archive.scan())
+            self.assertEqual([tx1.as_hex(), tx2.as_hex(), tx1.as_hex()], [tx.as_hex() for _, tx in scanned])
+            self.assertEqual(tx2.as_hex(), archive.tx_at(scanned[1][0]).as_hex())
+            self.assertEqual([None, "1/0"], archive.tx_at(scanned[1][0]).output_chain_paths())
+            # writers read the paths appended by other writers before appending
+            tx3 = AccountTx.deserialize(tx2.serialize())
+            tx3.txs_in[0].path = "0/5"
+            tx3.txs_out[1].path = "1/7"
+            txarchive.TxArchive(filename).append([tx3])
+            tx4 = AccountTx.deserialize(tx2.serialize())
+            tx4.txs_in[0].path = "0/9"
+            archive.append([tx4])
+            self.assertEqual([["0/0"]] * 3 + [["0/5"], ["0/9"]], [tx.input_chain_paths() for tx in archive])
+            # random access reads only scan records appended since the last scan
+            scanned = list(archive.scan())
+            with mock.patch.object(txarchive, '_parse_paths', wraps=txarchive._parse_paths) as parse_paths:
+                self.assertEqual([None, "1/7"], archive.tx_at(scanned[3][0]).output_chain_paths())
+                for offset, tx in scanned:
+                    self.assertEqual(tx.as_hex(), archive.tx_at(offset).as_hex())
+                self.assertEqual(0, parse_paths.call_count)
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_next_address(self):
         account_key = self.master_key.account_for_path("0H/1/2H")
         account = SimpleAccount(account_key)
@@ -1,11 +1,21 @@
 import io
 import json
+import pickle
+import threading
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+try:
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from SocketServer import ThreadingMixIn
 
 from httmock import HTTMock
 import dateutil.parser
 
 from multisigcore.oracle import OracleError, OracleDeferralException, OracleRejectionException, OracleLockoutException, \
-    PersonalInformation
+    PersonalInformation, make_session, shared_session
 from multisigcore.testing import *
 
 
@@ -14,6 +24,11 @@ __author__ = 'devrandom'
 import unittest
 from multisigcore import Oracle, local_sign
 
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    pass
+
+
 class OracleTest(unittest.TestCase):
     def setUp(self):
         self.wallet_private_key = MasterKey.from_seed("aaa-2015-02-10".encode('utf8'))
@@ -64,7 +79,20 @@ class OracleTest(unittest.TestCase):
         self.maxDiff = None
         self.assertEqual(json.loads(json.dumps(req)), json.loads(JSON))
 
-    def test_sign(self):
+    def test_sign_request_after_local_sign(self):
+        account = MultisigAccount(keys=[self.wallet_private_key, recover_key, oracle_key])
+        tx = AccountTx(1, [AccountTxIn(self.input_tx.hash(), 0, path=TEST_PATH)],
+                       [TxOut(290000, self.account.payto_for_path(TEST_PATH).script())],
+                       unspents=[self.input_tx.txs_out[0]])
+        account.sign(tx)
+        self.assertEqual(1, tx.bad_signature_count())
+        # the signature hash engine built by signing is not copied with the transaction
+        copied = pickle.loads(pickle.dumps(tx))
+        self.assertEqual(tx.as_hex(), copied.as_hex())
+        self.assertEqual(1, copied.bad_signature_count())
+        req = Oracle(account, tx_db=self.tx_db)._create_oracle_request([TEST_PATH], [None], None, tx)
+        self.assertEqual([TEST_PATH], req['transaction']['chainPaths'])
+
         self._request = None
         def digitaloracle_mock(url, request):
             self._request = request
@@ -209,4 +237,51 @@ class OracleTest(unittest.TestCase):
 
         with HTTMock(digitaloracle_mock):
             personal_info = PersonalInformation(email="a@b.com", phone="+14155551212")
-            oracle.verify_personal_information(personal_info, call="phone", callback="http://a.com/")
\ No newline at end of file
+            oracle.verify_personal_information(personal_info, call="phone", callback="http://a.com/")
+
+class SessionTest(unittest.TestCase):
+    def setUp(self):
+        connections = self.connections = []
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                connections.append(self.client_address)
+
+            def do_GET(self):
+                body = json.dumps({"result": "success", "keys": {"default": [oracle_key.hwif()]}}).encode('utf8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.base_url = 'http://127.0.0.1:%d/' % (self.server.server_address[1],)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_reuse(self):
+        oracles = [Oracle(make_incomplete_multisig_account(), base_url=self.base_url, timeout=10) for _ in range(3)]
+        self.assertIs(oracles[0].session, oracles[2].session)
+        self.assertIs(oracles[0].session, shared_session(self.base_url))
+        for oracle in oracles:
+            oracle.get()
+            self.assertTrue(oracle.account.complete)
+        self.assertEqual(1, len(self.connections))
+        # a private session has its own connections
+        oracle = Oracle(make_incomplete_multisig_account(), base_url=self.base_url, session=make_session(1))
+        self.assertIsNot(oracles[0].session, oracle.session)
+        oracle.get()
+        self.assertEqual(2, len(self.connections))
@@ -0,0 +1,387 @@
+"""
+Compact binary container for many :class:`multisigcore.hierarchy.AccountTx` records.
+
+Compared to :meth:`AccountTx.serialize`, transactions and unspents are stored as raw bytes, and chain paths are
+interned - each distinct path is stored once and referred to by number::
+
+    magic "MSTX", version (1 byte)
+    records: type (1 byte), payload length (varint), payload
+
+    paths record: count, then each new path (varint length and utf8), numbered consecutively from 1
+    tx record: input count and input path numbers, output count and output path numbers (0 for no path),
+        transaction length and transaction bytes, then the unspent of each input
+
+A file can be appended to - new paths are defined in a paths record before the first transaction using them - and
+read as a stream, holding only one record in memory at a time.  Archives can also be scanned in place from a buffer
+such as an mmap with :func:`iter_buffer` or :meth:`TxArchive.scan`, without copying records.
+
+:class:`TxArchive` locks the file while appending, and reads the path records appended by other writers before
+writing its own, so several processes can append to the same archive.
+"""
+import io
+import mmap
+import struct
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+from pycoin.serialize.bitcoin_streamer import parse_bc_int, stream_bc_int
+
+from .buffers import slice_bytes
+from .hierarchy import AccountTx, parse_varint
+
+__author__ = 'devrandom'
+
+MAGIC = b'MSTX'
+VERSION = 1
+HEADER = MAGIC + b'\x01'
+
+RECORD_PATHS = 1
+RECORD_TX = 2
+
+
+def _varint(n):
+    f = io.BytesIO()
+    stream_bc_int(f, n)
+    return f.getvalue()
+
+
+class PathTable(object):
+    """The interned paths of an archive"""
+    def __init__(self):
+        self.paths = [None]
+        self._ids = {None: 0}
+        self._pending = []
+
+    def id_for(self, path):
+        """The number of a path, interning it if new"""
+        path_id = self._ids.get(path)
+        if path_id is None:
+            path_id = len(self.paths)
+            self.paths.append(path)
+            self._ids[path] = path_id
+            self._pending.append(path)
+        return path_id
+
+    def add(self, path):
+        """Add a path defined by a paths record"""
+        self._ids[path] = len(self.paths)
+        self.paths.append(path)
+
+    def pending_record(self):
+        """A paths record for the paths interned since the last call, or b''"""
+        if not self._pending:
+            return b''
+        payload = [_varint(len(self._pending))]
+        for path in self._pending:
+            data = path.encode('utf8')
+            payload.append(_varint(len(data)))
+            payload.append(data)
+        self._pending = []
+        return _record(RECORD_PATHS, b''.join(payload))
+
+
+def _record(record_type, payload):
+    return b''.join([_varint(record_type), _varint(len(payload)), payload])
+
+
+def tx_record(tx, path_table):
+    """
+    Encode a transaction record, interning its paths.  Write path_table.pending_record() before it.
+
+    :type tx: multisigcore.hierarchy.AccountTx
+    :type path_table: PathTable
+    :rtype: bytes
+    """
+    input_paths = tx.input_chain_paths()
+    output_paths = tx.output_chain_paths()
+    parts = [_varint(len(input_paths))]
+    parts.extend(_varint(path_table.id_for(path)) for path in input_paths)
+    parts.append(_varint(len(output_paths)))
+    parts.extend(_varint(path_table.id_for(path)) for path in output_paths)
+    tx_bytes = tx.as_bin()
+    parts.append(_varint(len(tx_bytes)))
+    parts.append(tx_bytes)
+    if tx.unspents:
+        f = io.BytesIO()
+        tx.stream_unspents(f)
+        parts.append(f.getvalue())
+    return _record(RECORD_TX, b''.join(parts))
+
+
+def _parse_path_ids(buf, offset, paths):
+    count, offset = parse_varint(buf, offset)
+    result = []
+    for _ in range(count):
+        path_id, offset = parse_varint(buf, offset)
+        result.append(paths[path_id])
+    return result, offset
+
+
+def parse_tx_record(buf, paths, offset=0, end=None):
+    """
+    Decode the payload of a transaction record in place.
+
+    :param buf: bytes, memoryview, mmap or any other buffer holding the payload
+    :param list[str] paths: the path table, indexed by path number
+    :param int offset: where the payload starts
+    :param int end: where the payload ends, by default the end of buf
+    :rtype: multisigcore.hierarchy.AccountTx
+    """
+    end = len(buf) if end is None else end
+    input_paths, offset = _parse_path_ids(buf, offset, paths)
+    output_paths, offset = _parse_path_ids(buf, offset, paths)
+    tx_length, offset = parse_varint(buf, offset)
+    tx, _ = AccountTx.parse_buffer(buf, offset, input_paths, output_paths)
+    offset += tx_length
+    if offset < end:
+        tx.parse_unspents_buffer(buf, offset)
+    return tx
+
+
+def read_records(f):
+    """
+    Iterate over the records of an archive, after the header.
+
+    :param f: binary file-like object, positioned after the header
+    :return: iterator of (record type, payload)
+    """
+    while True:
+        first = f.read(1)
+        if not first:
+            return
+        f.seek(-1, io.SEEK_CUR)
+        record_type = parse_bc_int(f)
+        length = parse_bc_int(f)
+        payload = f.read(length)
+        if len(payload) != length:
+            raise ValueError("truncated archive record")
+        yield record_type, payload
+
+
+def _parse_paths(buf, path_table, offset=0):
+    count, offset = parse_varint(buf, offset)
+    for _ in range(count):
+        length, offset = parse_varint(buf, offset)
+        path_table.add(slice_bytes(buf, offset, offset + length).decode('utf8'))
+        offset += length
+
+
+def _check_header(f):
+    if f.read(len(HEADER)) != HEADER:
+        raise ValueError("not a transaction archive")
+
+
+def _lock_file(f):
+    """Wait for an exclusive lock on an open file"""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def iter_buffer(buf, offset=0, path_table=None):
+    """
+    Scan the transactions of an archive in place.
+
+    :param buf: bytes, memoryview, mmap or any other buffer
+    :param int offset: where the archive header starts
+    :param path_table: collects the paths of the archive
+    :type path_table: PathTable
+    :return: iterator of (record offset, transaction)
+    """
+    if slice_bytes(buf, offset, offset + len(HEADER)) != HEADER:
+        raise ValueError("not a transaction archive")
+    path_table = path_table or PathTable()
+    offset += len(HEADER)
+    end = len(buf)
+    while offset < end:
+        record_offset = offset
+        record_type, offset = parse_varint(buf, offset)
+        length, offset = parse_varint(buf, offset)
+        if offset + length > end:
+            raise ValueError("truncated archive record")
+        if record_type == RECORD_PATHS:
+            _parse_paths(buf, path_table, offset)
+        elif record_type == RECORD_TX:
+            yield record_offset, parse_tx_record(buf, path_table.paths, offset, offset + length)
+        offset += length
+
+
+def iter_txs(f):
+    """
+    Stream the transactions of an archive.
+
+    :param f: binary file-like object, positioned at the header
+    :rtype: collections.Iterable[multisigcore.hierarchy.AccountTx]
+    """
+    _check_header(f)
+    path_table = PathTable()
+    for record_type, payload in read_records(f):
+        if record_type == RECORD_PATHS:
+            _parse_paths(payload, path_table)
+        elif record_type == RECORD_TX:
+            yield parse_tx_record(payload, path_table.paths)
+
+
+def dumps(txs):
+    """
+    Encode transactions as an archive.
+
+    :type txs: list[multisigcore.hierarchy.AccountTx]
+    :rtype: bytes
+    """
+    path_table = PathTable()
+    parts = [HEADER]
+    for tx in txs:
+        record = tx_record(tx, path_table)
+        parts.append(path_table.pending_record())
+        parts.append(record)
+    return b''.join(parts)
+
+
+def loads(blob):
+    """
+    Decode all the transactions of an archive.
+
+    :rtype: list[multisigcore.hierarchy.AccountTx]
+    """
+    return list(iter_txs(io.BytesIO(blob)))
+
+
+class TxArchive(object):
+    """
+    An archive file that transactions can be appended to and streamed from.
+
+    :param str filename: the archive file, created on the first append if it does not exist
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._path_table = None
+        # the end of the last complete record read into the path table
+        self._scanned = 0
+        self._lock = threading.Lock()
+
+    def _scan_paths(self, buf):
+        """Read the path records after the scanned part of the archive into the path table"""
+        end = len(buf)
+        if self._path_table is None or self._scanned > end:
+            self._path_table = PathTable()
+            self._scanned = 0
+        offset = self._scanned
+        if offset == 0:
+            if slice_bytes(buf, 0, len(HEADER)) != HEADER:
+                raise ValueError("not a transaction archive")
+            offset = len(HEADER)
+        while offset < end:
+            try:
+                record_type, start = parse_varint(buf, offset)
+                length, start = parse_varint(buf, start)
+            except struct.error:
+                break
+            if start + length > end:
+                # being written
+                break
+            if record_type == RECORD_PATHS:
+                _parse_paths(buf, self._path_table, start)
+            offset = start + length
+        self._scanned = offset
+
+    def append(self, txs):
+        """
+        Append transactions to the archive.
+
+        :type txs: list[multisigcore.hierarchy.AccountTx]
+        """
+        with self._lock:
+            with open(self.filename, 'a+b') as f:
+                _lock_file(f)
+                try:
+                    self._append(f, txs)
+                finally:
+                    _unlock_file(f)
+
+    def _append(self, f, txs):
+        f.seek(0, io.SEEK_END)
+        size = f.tell()
+        if size:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                self._scan_paths(buf)
+            finally:
+                buf.close()
+            if self._scanned != size:
+                raise ValueError("truncated archive record")
+            parts = []
+        else:
+            self._path_table = PathTable()
+            self._scanned = 0
+            parts = [HEADER]
+        path_table = self._path_table
+        # interned paths are only kept once written
+        self._path_table = None
+        for tx in txs:
+            record = tx_record(tx, path_table)
+            parts.append(path_table.pending_record())
+            parts.append(record)
+        data = b''.join(parts)
+        f.write(data)
+        f.flush()
+        self._path_table = path_table
+        self._scanned = size + len(data)
+
+    def __iter__(self):
+        with open(self.filename, 'rb') as f:
+            for tx in iter_txs(f):
+                yield tx
+
+    def _map(self):
+        with open(self.filename, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def scan(self):
+        """
+        Scan the archive in place through a read-only memory map.
+
+        :return: iterator of (record offset, transaction) - see :meth:`tx_at`
+        """
+        buf = self._map()
+        try:
+            for item in iter_buffer(buf):
+                yield item
+        finally:
+            buf.close()
+
+    def tx_at(self, record_offset):
+        """
+        Read the transaction record at an offset returned by :meth:`scan`.
+
+        :rtype: multisigcore.hierarchy.AccountTx
+        """
+        buf = self._map()
+        try:
+            # the paths of a record are defined before it
+            with self._lock:
+                if self._path_table is None or record_offset >= self._scanned:
+                    self._scan_paths(buf)
+                paths = self._path_table.paths
+            record_type, offset = parse_varint(buf, record_offset)
+            length, offset = parse_varint(buf, offset)
+            if record_type != RECORD_TX:
+                raise ValueError("no transaction record at %d" % (record_offset,))
+            return parse_tx_record(buf, paths, offset, offset + length)
+        finally:
+            buf.close()
@@ -0,0 +1,88 @@
+"""
+Analytical size estimates of signed transactions.
+
+The sizes are computed from the shape of the transaction - the number of signatures and keys of each input and the
+length of each output script - without serializing it, so they also apply to unsigned transactions, whose inputs
+still have empty scripts.  Signatures are counted at their maximum size with low S values, so the estimates are
+upper bounds, exceeding the final size by at most a byte per signature.
+"""
+import math
+
+__author__ = 'devrandom'
+
+# DER encoded low S signature with a 33 byte R, plus the hash type byte
+MAX_SIGNATURE_SIZE = 72
+COMPRESSED_SEC_SIZE = 33
+# previous hash, previous index and sequence
+TX_IN_FIXED_SIZE = 32 + 4 + 4
+# version and lock time
+TX_FIXED_SIZE = 4 + 4
+
+
+def varint_size(n):
+    """The serialized size of a bitcoin variable length integer"""
+    if n < 253:
+        return 1
+    if n <= 0xffff:
+        return 3
+    if n <= 0xffffffff:
+        return 5
+    return 9
+
+
+def push_size(length):
+    """The size of a script push of length bytes"""
+    if length < 76:
+        return 1 + length
+    if length <= 0xff:
+        return 2 + length
+    if length <= 0xffff:
+        return 3 + length
+    return 5 + length
+
+
+def multisig_script_size(num_keys):
+    """The size of an m of n multisig redeem script with compressed keys"""
+    return 1 + num_keys * push_size(COMPRESSED_SEC_SIZE) + 1 + 1
+
+
+def input_size(script_length):
+    """The size of an input with a script_length byte script"""
+    return TX_IN_FIXED_SIZE + varint_size(script_length) + script_length
+
+
+def p2sh_multisig_input_size(num_sigs, num_keys):
+    """
+    The size of a signed P2SH m of n multisig input.
+
+    :param int num_sigs: the number of signatures required (m)
+    :param int num_keys: the number of keys (n)
+    """
+    script_length = 1 + num_sigs * push_size(MAX_SIGNATURE_SIZE) + push_size(multisig_script_size(num_keys))
+    return input_size(script_length)
+
+
+def p2pkh_input_size():
+    """The size of a signed pay to public key hash input with a compressed key"""
+    return input_size(push_size(MAX_SIGNATURE_SIZE) + push_size(COMPRESSED_SEC_SIZE))
+
+
+def output_size(script_length):
+    """The size of an output with a script_length byte script"""
+    return 8 + varint_size(script_length) + script_length
+
+
+def tx_size(input_sizes, output_sizes):
+    """
+    The size of a transaction.
+
+    :param list[int] input_sizes: the size of each input
+    :param list[int] output_sizes: the size of each output
+    """
+    return (TX_FIXED_SIZE + varint_size(len(input_sizes)) + sum(input_sizes) +
+            varint_size(len(output_sizes)) + sum(output_sizes))
+
+
+def fee_for_size(size, fee_per_byte):
+    """The fee at a rate of fee_per_byte satoshis per byte, rounded up"""
+    return int(math.ceil(size * fee_per_byte))
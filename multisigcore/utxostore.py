@@ -0,0 +1,150 @@
+"""
+Local persistent store of the unspent outputs of an account.
+
+The store keeps the spendables of each leaf path in an SQLite database, and remembers when it synced each path
+with the provider.  Only paths that were never synced, that were synced more than max_age seconds ago - so that
+payments to issued and lookahead addresses are eventually seen - or that were marked stale - because a transaction
+we built pays to them, or because a notification told us they changed - are queried again, so a warm account can
+build transactions with a local query.
+
+Outputs spent by a transaction we built are marked spent locally, and stay marked until the provider no longer
+reports them.
+"""
+import sqlite3
+import threading
+import time
+
+from pycoin.tx import Spendable
+
+__author__ = 'devrandom'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS utxos (
+    tx_hash BLOB NOT NULL,
+    tx_out_index INTEGER NOT NULL,
+    coin_value INTEGER NOT NULL,
+    script BLOB NOT NULL,
+    path TEXT NOT NULL,
+    block_index_available INTEGER NOT NULL DEFAULT 0,
+    spent INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (tx_hash, tx_out_index)
+);
+CREATE INDEX IF NOT EXISTS utxos_path ON utxos (path);
+CREATE TABLE IF NOT EXISTS paths (
+    path TEXT PRIMARY KEY,
+    stale INTEGER NOT NULL DEFAULT 0,
+    synced_at REAL NOT NULL DEFAULT 0
+);
+"""
+
+DEFAULT_MAX_AGE = 300
+
+# stay below the SQLite limit on the number of query parameters
+_QUERY_CHUNK = 500
+
+
+class UtxoStore(object):
+    """
+    Unspent outputs of one account, see :meth:`multisigcore.hierarchy.Account.attach_utxo_store`.
+
+    :param str filename: the SQLite database file, or ":memory:"
+    :param max_age: seconds after which a synced path is synced again, None to only sync stale paths again
+    :param clock: time source, returning seconds
+    """
+    def __init__(self, filename=':memory:', max_age=DEFAULT_MAX_AGE, clock=time.time):
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(paths)")]
+        if 'synced_at' not in columns:
+            # stores created before paths expired are synced again
+            with self._db:
+                self._db.execute("ALTER TABLE paths ADD COLUMN synced_at REAL NOT NULL DEFAULT 0")
+        self.max_age = max_age
+        self._clock = clock
+        self._lock = threading.RLock()
+
+    def close(self):
+        self._db.close()
+
+    def stale_paths(self, paths):
+        """
+        The paths that were never synced, were synced more than max_age seconds ago, or were marked stale.
+
+        :param list[str] paths: leaf paths
+        :rtype: list[str]
+        """
+        cutoff = self._clock() - self.max_age if self.max_age is not None else float('-inf')
+        fresh = set()
+        with self._lock:
+            for i in range(0, len(paths), _QUERY_CHUNK):
+                chunk = paths[i:i + _QUERY_CHUNK]
+                query = "SELECT path FROM paths WHERE stale = 0 AND synced_at > ? AND path IN (%s)" % (
+                    ", ".join("?" * len(chunk)),)
+                fresh.update(row[0] for row in self._db.execute(query, [cutoff] + list(chunk)))
+        return [path for path in paths if path not in fresh]
+
+    def mark_stale(self, paths):
+        """Mark paths to be synced again, e.g. on a notification that their addresses received coins"""
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO paths (path, stale) VALUES (?, 1)",
+                                 [(path,) for path in paths])
+
+    def update(self, paths, spendables):
+        """
+        Replace the outputs of paths with the spendables reported by the provider.
+        Outputs marked spent locally stay marked spent.
+
+        :param list[str] paths: the synced paths
+        :param list[(str, pycoin.tx.Spendable.Spendable)] spendables: the path and spendable of each output
+        """
+        with self._lock, self._db:
+            spent = set()
+            for path in paths:
+                for tx_hash, tx_out_index in self._db.execute(
+                        "SELECT tx_hash, tx_out_index FROM utxos WHERE path = ? AND spent = 1", (path,)):
+                    spent.add((bytes(tx_hash), tx_out_index))
+            self._db.executemany("DELETE FROM utxos WHERE path = ?", [(path,) for path in paths])
+            self._db.executemany(
+                "INSERT OR REPLACE INTO utxos (tx_hash, tx_out_index, coin_value, script, path, "
+                "block_index_available, spent) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(sqlite3.Binary(spend.tx_hash), spend.tx_out_index, spend.coin_value, sqlite3.Binary(spend.script),
+                  path, spend.block_index_available, 1 if (spend.tx_hash, spend.tx_out_index) in spent else 0)
+                 for path, spend in spendables])
+            now = self._clock()
+            self._db.executemany("INSERT OR REPLACE INTO paths (path, stale, synced_at) VALUES (?, 0, ?)",
+                                 [(path, now) for path in paths])
+
+    def spendables(self, paths=None):
+        """
+        The outputs not marked spent, in the order they were recorded.
+
+        :param list[str] paths: only the outputs of these paths, default all
+        :rtype: list[pycoin.tx.Spendable.Spendable]
+        """
+        query = "SELECT coin_value, script, tx_hash, tx_out_index, block_index_available, path " \
+                "FROM utxos WHERE spent = 0 ORDER BY rowid"
+        with self._lock:
+            rows = self._db.execute(query).fetchall()
+        wanted = set(paths) if paths is not None else None
+        return [Spendable(coin_value, bytes(script), bytes(tx_hash), tx_out_index, block_index_available)
+                for coin_value, script, tx_hash, tx_out_index, block_index_available, path in rows
+                if wanted is None or path in wanted]
+
+    def balance(self):
+        """The total value of the outputs not marked spent"""
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(coin_value), 0) FROM utxos WHERE spent = 0").fetchone()[0]
+
+    def mark_spent(self, tx, spent=True):
+        """
+        Mark the outputs spent by a transaction, and mark the paths it pays to stale.
+
+        :type tx: multisigcore.hierarchy.AccountTx
+        :param spent: False to release the outputs again, e.g. if the transaction was abandoned
+        """
+        with self._lock, self._db:
+            self._db.executemany("UPDATE utxos SET spent = ? WHERE tx_hash = ? AND tx_out_index = ?",
+                                 [(1 if spent else 0, sqlite3.Binary(tx_in.previous_hash), tx_in.previous_index)
+                                  for tx_in in tx.txs_in])
+        if spent:
+            self.mark_stale([tx_out.path for tx_out in tx.txs_out if getattr(tx_out, 'path', None)])
@@ -0,0 +1,146 @@
+"""
+Batch verification of the signatures of P2SH multisig inputs, such as those of a transaction co-signed by the Oracle.
+
+Each input is checked against the redeem script we expect it to spend - not the one in its input script - and its
+signatures are checked in order against the keys of the redeem script, as OP_CHECKMULTISIG does.  Signature hashes
+come from a :class:`multisigcore.sighash.SighashEngine`, and ECDSA verification multiplies the generator through
+the precomputed table in :mod:`multisigcore.derivation`.  Inputs can be verified on an executor such as a process
+pool, which only receives public keys, signatures and signature hashes.
+"""
+from pycoin import encoding
+from pycoin.ecdsa import generator_secp256k1
+from pycoin.tx.Tx import SIGHASH_ALL
+from pycoin.tx.pay_to import ScriptMultisig, script_obj_from_script
+from pycoin.tx.script import tools
+from pycoin.tx.script.check_signature import parse_signature_blob
+
+from .derivation import mul_generator, mul_point, public_pair_for_sec
+from .sighash import SighashEngine
+
+__author__ = 'devrandom'
+
+_P = generator_secp256k1.curve().p()
+_ORDER = generator_secp256k1.order()
+
+
+def verify_signature(public_pair, value, signature):
+    """
+    Verify an ECDSA signature, as pycoin.ecdsa.verify.
+
+    :param public_pair: the public key
+    :param int value: the signed hash
+    :param signature: the (r, s) pair
+    :rtype: bool
+    """
+    r, s = signature
+    if not 0 < r < _ORDER or not 0 < s < _ORDER:
+        return False
+    c = pow(s, _ORDER - 2, _ORDER)
+    X, Y, Z = mul_generator(value * c % _ORDER, mul_point(public_pair, r * c % _ORDER))
+    if Z == 0:
+        return False
+    x = X * pow(Z * Z % _P, _P - 2, _P) % _P
+    return x % _ORDER == r
+
+
+def _public_pair(sec):
+    if len(sec) == 33:
+        return public_pair_for_sec(sec)
+    return encoding.sec_to_public_pair(sec)
+
+
+def _verify_multisig(job):
+    """Match signatures to keys in order, as OP_CHECKMULTISIG"""
+    public_pairs, signatures = job
+    key_idx = 0
+    for signature, value in signatures:
+        while key_idx < len(public_pairs) and not verify_signature(public_pairs[key_idx], value, signature):
+            key_idx += 1
+        if key_idx == len(public_pairs):
+            return False
+        key_idx += 1
+    return True
+
+
+def _verify_worker(jobs):
+    return [_verify_multisig(job) for job in jobs]
+
+
+def multisig_job(tx, tx_in_idx, redeem_script, engine):
+    """
+    Decode the signatures of a P2SH multisig input.
+
+    :type tx: pycoin.tx.Tx.Tx
+    :param bytes redeem_script: the redeem script the input is expected to spend
+    :param engine: the signature hash engine of tx
+    :type engine: multisigcore.sighash.SighashEngine
+    :return: the public keys and the signatures with their signature hash, or None if the input script does not
+        have the required number of well formed signatures for the redeem script
+    """
+    script_obj = script_obj_from_script(redeem_script)
+    if not isinstance(script_obj, ScriptMultisig):
+        raise ValueError("not a multisig redeem script")
+    script = tx.txs_in[tx_in_idx].script
+    pushes = []
+    pc = 0
+    try:
+        while pc < len(script):
+            opcode, data, pc = tools.get_opcode(script, pc)
+            pushes.append(data)
+    except Exception:
+        return None
+    # OP_0, the signatures and the redeem script
+    if len(pushes) != script_obj.n + 2 or pushes[-1] != redeem_script:
+        return None
+    signatures = []
+    for blob in pushes[1:-1]:
+        if not blob:
+            return None
+        try:
+            signature, signature_type = parse_signature_blob(blob)
+        except Exception:
+            return None
+        if signature_type == SIGHASH_ALL:
+            value = engine.signature_hash(redeem_script, tx_in_idx)
+        else:
+            value = tx.signature_hash(redeem_script, tx_in_idx, signature_type)
+        signatures.append((signature, value))
+    return [_public_pair(sec) for sec in script_obj.sec_keys], signatures
+
+
+def verify_multisig_inputs(tx, redeem_scripts, executor=None, chunk_size=4):
+    """
+    Verify the signatures of P2SH multisig inputs.
+
+    :type tx: pycoin.tx.Tx.Tx
+    :param redeem_scripts: the redeem script each input is expected to spend, or None to skip the input
+    :type redeem_scripts: list[bytes or None]
+    :param executor: optional executor to verify on, e.g. a concurrent.futures.ProcessPoolExecutor
+    :param int chunk_size: number of inputs verified by each task
+    :return: for each input, whether it is fully signed with valid signatures, or None if skipped
+    :rtype: list[bool or None]
+    """
+    if len(redeem_scripts) != len(tx.txs_in):
+        raise ValueError("expected one redeem script per input")
+    get_engine = getattr(tx, 'sighash_engine', None)
+    engine = get_engine() if get_engine is not None else SighashEngine(tx)
+    results = [None] * len(tx.txs_in)
+    jobs = []
+    indices = []
+    for idx, redeem_script in enumerate(redeem_scripts):
+        if redeem_script is None:
+            continue
+        job = multisig_job(tx, idx, redeem_script, engine)
+        if job is None:
+            results[idx] = False
+            continue
+        jobs.append(job)
+        indices.append(idx)
+    if executor is None:
+        verified = _verify_worker(jobs)
+    else:
+        chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+        verified = [result for chunk in executor.map(_verify_worker, chunks) for result in chunk]
+    for idx, result in zip(indices, verified):
+        results[idx] = result
+    return results